@@ -1,10 +1,14 @@
-import ollama
 import json
 import os
 from typing import Dict, Any
 from app.logger import get_agent_logger
 from app.config import DEFAULT_LANGUAGE
+from app.metrics import timed, record_outcome
 from app.translations import ASSISTANT_EXTRACTION_PROMPTS
+from app.logic import model_tiers
+from app.logic.prompt_builder import PromptBuilder
+from app.logic.structured_output import chat_structured
+from app.models import PatientDataDelta
 
 # Logger per questo modulo
 logger = get_agent_logger()
@@ -78,6 +82,7 @@ class AssistantAgent:
                 
         return merged
 
+    @timed("extraction")
     def update_patient_data(self, session_id: str, user_message: str, last_agent_message: str = None) -> Dict[str, Any]:
         """
         Analizza il messaggio e aggiorna il file JSON del paziente.
@@ -94,26 +99,20 @@ class AssistantAgent:
             context=context_str,
             user_message=user_message
         )
+        builder = PromptBuilder("assistant", model=model_tiers.model_for("extraction"))
+        builder.add("instructions", prompt)
+        prompt = builder.build()
 
         try:
-            response = ollama.chat(
-                model='llama3:8b',
+            # Modello della fase "extraction"; output non valido o modello assente -> escalation (model_tiers)
+            new_data_delta = chat_structured(
+                agent="assistant",
+                model=model_tiers.model_for("extraction"),
                 messages=[{'role': 'system', 'content': prompt}],
-                format='json',
-                options={'temperature': 0.0}
-            )
-            
-            # Pulizia JSON prima del parsing
-            raw_content = response['message']['content']
-            clean_content = raw_content.strip()
-            # Rimuovi eventuali markdown
-            if clean_content.startswith("```"):
-                clean_content = clean_content.split("```")[1]
-                if clean_content.startswith("json"):
-                    clean_content = clean_content[4:]
-            clean_content = clean_content.strip()
-            
-            new_data_delta = json.loads(clean_content)
+                output_model=PatientDataDelta,
+                escalate_to=model_tiers.escalation_for("extraction"),
+                options={'temperature': 0.0, 'num_ctx': builder.num_ctx}
+            ).model_dump()
             
             # Merging sicuro in Python
             updated_data = self._merge_data(current_data, new_data_delta)
@@ -125,4 +124,5 @@ class AssistantAgent:
 
         except Exception as e:
             logger.error(f"Assistant Agent Error: {e}")
+            record_outcome("extraction", "fallback")
             return current_data
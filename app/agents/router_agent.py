@@ -1,8 +1,11 @@
-import ollama
-import json
 from typing import Literal, Optional
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field
+from app.config import ROUTER_FAST_PATH_MIN_FACTS, LEXICAL_PREROUTER_ENABLED
+from app.logic.lexical_matcher import get_lexical_matcher
+from app.logic import structured_output, model_tiers
+from app.logic.prompt_builder import PromptBuilder, count_message_tokens, count_tokens
 from app.logger import get_agent_logger
+from app.metrics import timed, record_outcome
 from app.translations import ROUTER_SYSTEM_PROMPTS, get_translation, DEFAULT_LANGUAGE
 
 # Logger per questo modulo
@@ -27,12 +30,14 @@ class RouterOutput(BaseModel):
     )
 
 class RouterAgent:
-    def __init__(self, available_specialists: list, language: str = DEFAULT_LANGUAGE):
+    def __init__(self, available_specialists: list, language: str = DEFAULT_LANGUAGE, vector_router=None):
         """
         Inizializza l'agente Router.
+        Se `vector_router` è passato, i casi chiari vengono instradati senza chiamare l'LLM.
         """
         self.specialists = [s.lower() for s in available_specialists]
         self.language = language
+        self.vector_router = vector_router
         
         # Skill map to help routing (descrizioni generiche)
         self.specialist_descriptions = {
@@ -50,21 +55,10 @@ class RouterAgent:
             "ematologo": "Blood, anemia, bleeding, platelets, leukemia."
         }
         
-        # Mappa sinonimi per normalizzare l'output dell'LLM
-        self.synonyms = {
-            "cardiologia": "cardiologo", "cuore": "cardiologo",
-            "dermatologia": "dermatologo", "pelle": "dermatologo",
-            "endocrinologia": "endocrinologo",
-            "gastroenterologia": "gastroenterologo", "stomaco": "gastroenterologo",
-            "geriatria": "geriatra",
-            "infettivologia": "infettivologo", "infezioni": "infettivologo",
-            "nefrologia": "nefrologo", "reni": "nefrologo",
-            "oncologia": "oncologo", "tumori": "oncologo",
-            "pneumologia": "pneumologo", "polmoni": "pneumologo",
-            "reumatologia": "reumatologo", "reumi": "reumatologo", "ossa": "reumatologo",
-            "allergologia": "allergologo",
-            "ematologia": "ematologo", "sangue": "ematologo"
-        }
+        # Pre-router lessicale (Aho-Corasick) e mappa sinonimi per normalizzare l'output dell'LLM.
+        # I termini sono in app/data/specialty_terms.json
+        self.lexical_matcher = get_lexical_matcher()
+        self.synonyms = self.lexical_matcher.synonyms
         
         # Costruiamo una stringa descrittiva per il prompt
         specialist_info = []
@@ -93,10 +87,76 @@ class RouterAgent:
                 specialist_list=specialist_list_str
             )
 
-    def decide_routing(self, chat_history: list, patient_data: dict = None) -> dict:
+    def _build_routing_query(self, chat_history: list, patient_data: dict = None) -> str:
+        """Testo usato dal router vettoriale: sintomi estratti + ultimi messaggi dell'utente."""
+        parts = []
+        if patient_data and patient_data.get("symptoms"):
+            parts.append(", ".join(patient_data["symptoms"][:5]))
+        user_messages = [m["content"] for m in chat_history if m.get("role") == "user"]
+        parts.extend(user_messages[-3:])
+        return " | ".join(parts)
+
+    def _build_fast_path_summary(self, chat_history: list, patient_data: dict = None) -> str:
+        """Riassunto per lo specialista quando il routing non passa dall'LLM."""
+        parts = []
+        if patient_data:
+            if patient_data.get("symptoms"):
+                parts.append(", ".join(patient_data["symptoms"]))
+            if patient_data.get("duration"):
+                parts.append(", ".join(patient_data["duration"][:2]))
+        if not parts:
+            parts = [m["content"] for m in chat_history if m.get("role") == "user"]
+        return ". ".join(parts)
+
+    def _has_enough_facts(self, patient_data: dict = None) -> bool:
+        """Come nel prompt del router: servono almeno 2 informazioni chiave prima di instradare."""
+        if not patient_data or not patient_data.get("symptoms"):
+            return False
+        facts = len(patient_data["symptoms"]) + (1 if patient_data.get("duration") else 0)
+        return facts >= ROUTER_FAST_PATH_MIN_FACTS
+
+    @timed("routing")
+    def decide_routing(self, chat_history: list, patient_data: dict = None, prompt_history: list = None,
+                       fast_router: bool = False) -> dict:
         """
         Analizza la cronologia e i dati paziente per decidere il routing.
+        `prompt_history`: cronologia compattata per il prompt (vedi HistoryCompactor); default ultimi 12 messaggi.
+        `fast_router`: modalità degradata sotto carico, il router vettoriale accetta casi meno netti.
         """
+        # --- PRE-ROUTER LESSICALE ---
+        # Parole chiave univoche di una specialità nel messaggio grezzo: nessun LLM necessario
+        if LEXICAL_PREROUTER_ENABLED:
+            user_messages = [m["content"] for m in chat_history if m.get("role") == "user"]
+            if user_messages:
+                lexical_spec = self.lexical_matcher.resolve_specialty(user_messages[-1], self.specialists)
+                if lexical_spec:
+                    logger.info(f"Pre-router lessicale: match univoco -> {lexical_spec}")
+                    record_outcome("routing", "lexical")
+                    return {
+                        "action": "route_to_specialist",
+                        "question": None,
+                        "specialist": lexical_spec,
+                        "summary": self._build_fast_path_summary(chat_history, patient_data),
+                        "message": None,
+                    }
+
+        # --- FAST PATH VETTORIALE ---
+        # Se il router vettoriale è sicuro evitiamo del tutto la chiamata all'LLM
+        fast_route = None
+        routing_query = ""
+        if self.vector_router and self._has_enough_facts(patient_data):
+            routing_query = self._build_routing_query(chat_history, patient_data)
+            fast_route = self.vector_router.route(routing_query, relaxed=fast_router)
+            if fast_route and not fast_route["shadow"]:
+                record_outcome("routing", "fast_path")
+                return {
+                    "action": "route_to_specialist",
+                    "question": None,
+                    "specialist": fast_route["specialist"],
+                    "summary": self._build_fast_path_summary(chat_history, patient_data),
+                    "message": None,
+                }
+
         # Costruzione contesto paziente dai dati estratti dall'AssistantAgent
         patient_context = ""
         if patient_data:
@@ -116,29 +176,35 @@ class RouterAgent:
                 patient_context = "\n\n--- EXTRACTED PATIENT DATA (what you already know) ---\n" + "\n".join(context_parts)
                 patient_context += "\n\nBased on this data, decide: do you have enough to route, or do you need more info?"
         
-        full_prompt = self.system_prompt + patient_context
+        history = prompt_history if prompt_history is not None else chat_history[-12:]
+        builder = PromptBuilder("router", model=model_tiers.model_for("routing"))
+        builder.add("patient_data", patient_context, priority=1, max_tokens=400)
+        patient_context = builder.build(
+            extra_tokens=count_tokens(self.system_prompt) + count_message_tokens(history)
+        ).strip()
         
-        messages = [{'role': 'system', 'content': full_prompt}]
-        messages.extend(chat_history[-12:])
+        # Prefisso stabile (prompt fisso per lingua + cronologia), dati estratti in coda: riuso della KV cache
+        messages = [{'role': 'system', 'content': self.system_prompt}]
+        messages.extend(history)
+        if patient_context:
+            messages.append({'role': 'system', 'content': patient_context})
 
         try:
-            response = ollama.chat(
-                model='llama3:8b', 
-                messages=messages, 
-                format='json',
-                options={'temperature': 0.0}
-            )
-            
-            raw_content = response['message']['content']
-            
-            # --- VALIDAZIONE PYDANTIC ---
+            # --- OUTPUT VINCOLATO + VALIDAZIONE PYDANTIC ---
             try:
-                validated_output = RouterOutput.model_validate_json(raw_content)
+                validated_output = structured_output.chat_structured(
+                    agent="router",
+                    model=model_tiers.model_for("routing"),
+                    messages=messages, 
+                    output_model=RouterOutput,
+                    escalate_to=model_tiers.escalation_for("routing"),
+                    options={'temperature': 0.0, 'num_ctx': builder.num_ctx}
+                )
                 decision = validated_output.model_dump()
                 
                 # Logica extra di validazione (controllo se lo specialista esiste davvero)
                 if decision['action'] == 'route_to_specialist':
-                    chosen_spec = decision.get('specialist', '').lower().strip()
+                    chosen_spec = (decision.get('specialist') or '').lower().strip()
                     
                     # Normalizzazione Sinonimi
                     if chosen_spec in self.synonyms:
@@ -146,20 +212,32 @@ class RouterAgent:
                     
                     if chosen_spec not in self.specialists:
                         logger.warning(f"Router hallucinated specialist '{chosen_spec}'. Fallback.")
+                        record_outcome("routing", "fallback")
                         return {
                             "action": "cannot_route", 
                             "message": f"I don't have a specialist available for '{chosen_spec}'."
                         }
                     decision['specialist'] = chosen_spec # Normalize
                 
+                # Confronto con il router vettoriale (accuratezza del fast path / calibrazione)
+                if self.vector_router and routing_query:
+                    routed_to = decision['specialist'] if decision['action'] == 'route_to_specialist' else None
+                    if fast_route:
+                        self.vector_router.record_shadow(routing_query, fast_route["specialist"], routed_to)
+                    elif routed_to:
+                        self.vector_router.record_llm_decision(routing_query, routed_to)
+
                 logger.info(f"Router Decision Validated: {decision['action']}")
+                record_outcome("routing", "llm")
                 return decision
 
-            except ValidationError as e:
+            except structured_output.StructuredOutputError as e:
                 logger.error(f"Router Pydantic Validation Error: {e}")
+                record_outcome("routing", "fallback")
                 # Intelligent fallback: if JSON is broken, ask to rephrase
                 return {"action": "ask_general_followup", "question": "Sorry, I didn't understand well. Can you repeat the main symptom?"}
 
         except Exception as e:
             logger.error(f"Generic Router Error: {e}")
+            record_outcome("routing", "fallback")
             return {"action": "cannot_route", "message": "Technical error in routing system."}
\ No newline at end of file
@@ -1,11 +1,13 @@
-import ollama
-import json
 from typing import Dict, Any, List, Optional
 
 from app.config import LLM_MODEL, DEFAULT_LANGUAGE
 from app.tools import medical_calculators
-from app.models import MedicalAnalysis
+from app.models import MedicalAnalysis, AgentAction
+from app.logic import structured_output, model_tiers
+from app.logic.degradation import DegradationMode, FULL
+from app.logic.prompt_builder import PromptBuilder, compact_json, count_message_tokens, count_tokens
 from app.logger import get_agent_logger
+from app.metrics import timed, record_outcome
 from app.translations import SPECIALIST_DECIDE_PROMPTS, get_translation
 
 # Logger per questo modulo
@@ -14,13 +16,16 @@ logger = get_agent_logger()
 model = LLM_MODEL
 
 class SpecialistAgent:
-    def __init__(self, specialty: str, rag_handler, triage_engine, language: str = DEFAULT_LANGUAGE):
+    def __init__(self, specialty: str, rag_handler, triage_engine, language: str = DEFAULT_LANGUAGE,
+                 triage_cache=None):
         """
         Inizializza un agente specialista conversazionale con Riflessione.
+        `triage_cache`: cache semantica delle analisi (vedi app/logic/triage_cache.py), opzionale.
         """
         self.specialty = specialty.lower()
         self.rag_handler = rag_handler
         self.triage_engine = triage_engine
+        self.triage_cache = triage_cache
         self.language = language
         
         # Prompt to decide action (ask or analyze) - loaded from translations
@@ -67,21 +72,21 @@ class SpecialistAgent:
         Refined JSON:
         """
 
-    def decide_next_action(self, chat_history: list, patient_data: dict = None, asked_questions: list = None) -> dict:
+    @timed("specialist_decision")
+    def decide_next_action(self, chat_history: list, patient_data: dict = None, asked_questions: list = None,
+                           prompt_history: list = None) -> dict:
         """
         Decide se fare un'altra domanda specifica o avviare l'analisi finale.
+        `prompt_history`: cronologia compattata per il prompt (vedi HistoryCompactor); default ultimi 12 messaggi.
         """
         # Costruiamo il contesto dei dati paziente
         patient_context = ""
         if patient_data:
-            patient_context = f"\nDATI PAZIENTE CONOSCIUTI:\n{json.dumps(patient_data, indent=2, ensure_ascii=False)}\n"
+            patient_context = f"\nDATI PAZIENTE CONOSCIUTI:\n{compact_json(patient_data)}\n"
             patient_context += "NOTA: NON chiedere informazioni già presenti qui sopra (es. se c'è già la temperatura, non chiederla).\n"
 
-        # Costruiamo il contesto delle domande già fatte
-        asked_context = ""
-        if asked_questions:
-            asked_context = f"\nDOMANDE GIÀ FATTE (VIETATO RIPETERE):\n" + "\n".join(f"- {q}" for q in asked_questions) + "\n"
-            asked_context += "CRITICO: Se la tua domanda è simile a una di queste, NON FARLA. Passa al triage o chiedi altro.\n"
+        # Le domande già fatte sono una sezione a elenco del prompt (vedi sotto)
+        asked_footer = "\nCRITICO: Se la tua domanda è simile a una di queste, NON FARLA. Passa al triage o chiedi altro.\n"
 
         # --- VINCOLI DINAMICI (GLOBAL BLACKLIST) ---
         known_info_list = []
@@ -106,47 +111,60 @@ class SpecialistAgent:
             if patient_data.get("symptoms"):
                 constraints_str += "- FORBIDDEN to ask generically 'what are the symptoms'.\n"
 
-        full_system_prompt = self.decide_action_prompt + patient_context + asked_context + constraints_str
-        
-        messages = [{'role': 'system', 'content': full_system_prompt}]
-        messages.extend(chat_history[-12:]) # Finestra di contesto aumentata
+        # --- BUDGET DEL PROMPT ---
+        # Se il prompt non entra nel budget si accorciano prima le domande più vecchie, poi i vincoli
+        history = prompt_history if prompt_history is not None else chat_history[-12:]
+        builder = PromptBuilder("specialist_decision", model=model_tiers.model_for("specialist_decision"))
+        builder.add("patient_data", patient_context, priority=3, max_tokens=800)
+        builder.add_items("asked_questions", [f"- {q}" for q in (asked_questions or [])], priority=1, max_tokens=400,
+                          header="\nDOMANDE GIÀ FATTE (VIETATO RIPETERE):\n", footer=asked_footer, keep="tail")
+        builder.add("constraints", constraints_str, priority=2, max_tokens=500)
+        session_context = builder.build(
+            extra_tokens=count_tokens(self.decide_action_prompt) + count_message_tokens(history)
+        ).strip()
+
+        # --- PREFISSO STABILE ---
+        # Prompt fisso per (specialità, lingua) + cronologia in testa, dati del turno in coda:
+        # tra un turno e l'altro Ollama riusa la KV cache del prefisso comune.
+        messages = [{'role': 'system', 'content': self.decide_action_prompt}]
+        messages.extend(history)
+        if session_context:
+            messages.append({'role': 'system', 'content': session_context})
 
         try:
-            response = ollama.chat(model='llama3:8b', messages=messages, format='json')
-            decision = json.loads(response['message']['content'])
-
-            action = decision.get("action")
-            
-            # Validazione Azione
-            if action == "ask_specialist_followup":
+            decision = structured_output.chat_structured(
+                "specialist_decision", model_tiers.model_for("specialist_decision"), messages, AgentAction,
+                specialty=self.specialty, escalate_to=model_tiers.escalation_for("specialist_decision"),
+                options={'num_ctx': builder.num_ctx}
+            ).model_dump()
+
+            # Validazione Azione (il valore di "action" è già garantito dallo schema)
+            if decision["action"] == "ask_specialist_followup":
                  if not decision.get("question"):
                       # Safe fallback: if question is missing, ask for clarification
+                      record_outcome("specialist_decision", "fallback", self.specialty)
                       return {"action": "ask_specialist_followup", "question": "Could you describe your symptoms better?"}
                  return decision
 
-            elif action == "perform_triage":
-                 summary = decision.get("summary", "")
-                 # Anti-placeholder check
-                 if not summary or summary == "Full summary..." or len(summary) < 10:
-                      logger.warning(f" {self.specialty.upper()} used a placeholder summary. Regenerating from messages.")
-                      # Fallback: regenerate summary from user messages
-                      summary_fallback = " ".join([m['content'] for m in chat_history if m['role'] == 'user'])
-                      decision["summary"] = summary_fallback
-                 return decision
-            
-            else: 
-                # Unknown or invalid action
-                logger.warning(f" {self.specialty.upper()} Unknown Action: '{action}'. Asking for clarification.")
-                return {"action": "ask_specialist_followup", "question": "I'm not sure I understood. Can you give me more details?"}
+            summary = decision.get("summary") or ""
+            # Anti-placeholder check
+            if summary == "Full summary..." or len(summary) < 10:
+                 logger.warning(f" {self.specialty.upper()} used a placeholder summary. Regenerating from messages.")
+                 # Fallback: regenerate summary from user messages
+                 summary_fallback = " ".join([m['content'] for m in chat_history if m['role'] == 'user'])
+                 decision["summary"] = summary_fallback
+            return decision
 
-        except (json.JSONDecodeError, Exception) as e:
+        except Exception as e:
             logger.error(f" Decision Error {self.specialty.upper()} Agent: {e}. Fallback to generic question.")
+            record_outcome("specialist_decision", "fallback", self.specialty)
             # IMPORTANT: Do not go to triage on error, it's dangerous. Ask for info.
             return {"action": "ask_specialist_followup", "question": "Excuse me, I got confused for a moment. Can you repeat the last symptom?"}
 
 
 
     
+    @timed("reflection")
     def _run_reflection(self, symptoms_summary: str, initial_analysis: dict, patient_data: dict = None) -> dict:
         """
         Esegue il passo di Riflessione usando Pydantic per validare la struttura.
@@ -156,7 +174,7 @@ class SpecialistAgent:
         # Formattiamo i dati del paziente per il prompt
         patient_context = ""
         if patient_data:
-            patient_context = f"Dati Paziente (Storia/Farmaci/Allergie): {json.dumps(patient_data, indent=2)}"
+            patient_context = f"Dati Paziente (Storia/Farmaci/Allergie): {compact_json(patient_data)}"
 
         reflection_system_prompt = f"""
         You are a senior medical supervisor specialized in {self.specialty.upper()}.
@@ -180,34 +198,38 @@ class SpecialistAgent:
         }}
         
         PROBABILITY VALUES: Use "High", "Medium", or "Low" (English, capitalized).
-        
+        """
+
+        # Istruzioni fisse per specialità come prefisso (riusabile dalla KV cache), dati del caso in coda
+        reflection_user_prompt = f"""
         PATIENT SYMPTOMS: {symptoms_summary}
         {patient_context}
         
         INITIAL ANALYSIS TO REVIEW:
-        {json.dumps(initial_analysis, indent=2)}
+        {compact_json(initial_analysis)}
         
         YOUR REVIEWED ANALYSIS (JSON only, no other text):
         """
+        builder = PromptBuilder("reflection", model=model_tiers.model_for("reflection"))
+        reflection_user_prompt = builder.add("case", reflection_user_prompt).build(
+            extra_tokens=count_tokens(reflection_system_prompt)
+        )
 
         try:
-            reflection_response = ollama.chat(
-                model='llama3:8b',
-                messages=[{'role': 'system', 'content': reflection_system_prompt}],
-                options={'temperature': 0.0},
-                format='json' 
+            # --- OUTPUT VINCOLATO + VALIDAZIONE PYDANTIC ---
+            # Lo schema di MedicalAnalysis viene passato a Ollama; se la risposta non è
+            # comunque valida viene sollevato un errore e usiamo l'analisi iniziale.
+            validated_data = structured_output.chat_structured(
+                agent="reflection",
+                specialty=self.specialty,
+                model=model_tiers.model_for("reflection"),
+                escalate_to=model_tiers.escalation_for("reflection"),
+                messages=[{'role': 'system', 'content': reflection_system_prompt},
+                          {'role': 'user', 'content': reflection_user_prompt}],
+                output_model=MedicalAnalysis,
+                options={'temperature': 0.0, 'num_ctx': builder.num_ctx}
             )
             
-            content = reflection_response['message']['content']
-            
-            # --- DEBUG: Log della risposta raw ---
-            logger.debug(f"Riflessione RAW response: {content[:500]}...")
-            
-            # --- VALIDAZIONE PYDANTIC ---
-            # Qui avviene la magia: se il JSON è sbagliato, Pydantic solleva un errore
-            # e noi lo catturiamo invece di far crashare l'app più avanti.
-            validated_data = MedicalAnalysis.model_validate_json(content)
-            
             # Convertiamo in dict per il resto del sistema
             refined_analysis = validated_data.model_dump()
             
@@ -224,11 +246,12 @@ class SpecialistAgent:
 
         except Exception as e:
             logger.error(f"Errore Validazione Pydantic ({self.specialty.upper()}): {e}")
-            logger.debug(f"Contenuto che ha causato errore: {content[:300] if 'content' in dir() else 'N/A'}...")
             logger.warning(f"Uso analisi iniziale come fallback (aveva {len(initial_analysis.get('potential_conditions', []))} condizioni).")
+            record_outcome("reflection", "fallback", self.specialty)
             return initial_analysis
 
 
+    @timed("forced_diagnosis")
     def _force_diagnosis(self, symptoms: str) -> dict:
         """
         Ultima spiaggia: Chiede all'LLM di generare ipotesi basandosi SOLO sui sintomi.
@@ -236,7 +259,6 @@ class SpecialistAgent:
         """
         prompt = f"""
         You are a medical specialist in {self.specialty.upper()}.
-        The patient's symptoms are: "{symptoms}".
         
         The RAG system produced no results.
         YOU MUST list the 3 most probable conditions based on your general knowledge.
@@ -250,20 +272,26 @@ class SpecialistAgent:
             ]
         }}
         """
+        user_message = {'role': 'user', 'content': f'The patient\'s symptoms are: "{symptoms}".'}
+        builder = PromptBuilder("forced_diagnosis", model=model_tiers.model_for("forced_diagnosis"))
+        builder.add("instructions", prompt)
+        messages = [{'role': 'system', 'content': builder.build(extra_tokens=count_message_tokens([user_message]))},
+                    user_message]
         try:
-            response = ollama.chat(model='llama3:8b', messages=[{'role': 'user', 'content': prompt}], format='json')
-            return json.loads(response['message']['content'])
+            return structured_output.chat_structured(
+                "forced_diagnosis", model_tiers.model_for("forced_diagnosis"), messages, MedicalAnalysis,
+                specialty=self.specialty, escalate_to=model_tiers.escalation_for("forced_diagnosis"),
+                options={'num_ctx': builder.num_ctx}
+            ).model_dump()
         except Exception as e:
             logger.error(f" Errore Force Diagnosis: {e}")
             return {"potential_conditions": []}
 
-    def perform_analysis_and_triage(self, symptoms_summary: str, extracted_data: dict = None, patient_data: dict = None) -> dict:
+    def build_rag_query(self, symptoms_summary: str, patient_data: dict = None) -> str:
         """
-        Esegue l'analisi RAG, la Riflessione e la decisione di triage.
+        Query RAG costruita da patient_data (più affidabile del summary LLM).
+        Usata sia dal triage finale sia dal prefetch RAG: a parità di dati la query è identica.
         """
-        logger.info(f" {self.specialty.upper()} AGENT: Analisi Finale ---")
-
-        # --- COSTRUZIONE QUERY RAG DA PATIENT_DATA (più affidabile del summary LLM) ---
         rag_query = symptoms_summary  # Fallback al summary originale
         
         if patient_data:
@@ -297,6 +325,20 @@ class SpecialistAgent:
             else:
                 logger.info(f"Uso summary LLM per query RAG: {symptoms_summary[:100]}...")
 
+        return rag_query
+
+    @timed("triage")
+    def perform_analysis_and_triage(self, symptoms_summary: str, extracted_data: dict = None, patient_data: dict = None,
+                                    prefetched_docs: list = None, mode: DegradationMode = FULL) -> dict:
+        """
+        Esegue l'analisi RAG, la Riflessione e la decisione di triage.
+        `prefetched_docs`: candidati già recuperati e riordinati dal prefetch RAG per questa query.
+        `mode`: modalità della pipeline sotto carico (vedi app/logic/degradation.py).
+        """
+        logger.info(f" {self.specialty.upper()} AGENT: Analisi Finale ---")
+
+        rag_query = self.build_rag_query(symptoms_summary, patient_data)
+
         # 1. Esecuzione Tool Simbolici
         tool_report_items = []
         if extracted_data:
@@ -324,31 +366,21 @@ class SpecialistAgent:
         if tool_report_items:
             tool_results_md = "\n\n---\n### 📊 Analisi Parametri Vitali\n" + "\n".join(f"- {item}" for item in tool_report_items)
 
-        # 2. Fase RAG (usa la query costruita da patient_data)
-        initial_rag_analysis = self.rag_handler.get_potential_conditions(rag_query, self.specialty)
-        
-        # --- DEBUG: Log dell'analisi RAG ---
-        rag_conditions_count = len(initial_rag_analysis.get("potential_conditions", []))
-        logger.info(f"RAG ha ritornato {rag_conditions_count} condizioni iniziali.")
-
-        # Controlla fallimento RAG
-        if "error" in initial_rag_analysis or not isinstance(initial_rag_analysis.get("potential_conditions"), list):
-            error_msg = initial_rag_analysis.get("error", "Formato non valido")
-            logger.warning(f"RAG fallito. Motivo: {error_msg}")
-            logger.debug(f"Dati ricevuti: {initial_rag_analysis}")
-            
-            # NON ritornare subito! Passiamo al Supervisore con una lista vuota.
-            # Questo attiverà la generazione basata su conoscenza generale.
-            initial_rag_analysis = {"potential_conditions": [], "error": error_msg}
-        
-        # 3. Fase di Riflessione (SEMPRE ATTIVA)
-        # Anche se RAG non ha trovato nulla, chiediamo al Supervisore di ragionare sui sintomi.
-        final_analysis = self._run_reflection(symptoms_summary, initial_rag_analysis, patient_data)
+        # 2-3. Analisi (RAG + Riflessione), o quella di un caso equivalente già analizzato
+        cached_analysis, profile_vector = None, None
+        if self.triage_cache:
+            try:
+                cached_analysis, profile_vector = self.triage_cache.lookup(self.specialty, symptoms_summary, patient_data)
+            except Exception as e:
+                logger.warning(f"Cache triage non disponibile: {e}")
 
-        # --- HARD FALLBACK: SE ANCORA VUOTO, FORZA GENERAZIONE ---
-        if not final_analysis.get("potential_conditions"):
-            logger.warning(f" {self.specialty.upper()}: Analisi ancora vuota dopo riflessione. FORZO GENERAZIONE.")
-            final_analysis = self._force_diagnosis(symptoms_summary)
+        cacheable = False
+        if cached_analysis:
+            record_outcome("triage", "cache_hit", self.specialty)
+            final_analysis = cached_analysis
+        else:
+            final_analysis, cacheable = self._run_analysis(symptoms_summary, rag_query, patient_data, prefetched_docs,
+                                                           mode)
 
         # 4. Fase Simbolica (Decisione Triage)
         
@@ -382,8 +414,15 @@ class SpecialistAgent:
             logger.info(f"REFERTO MEDICO ({self.specialty.upper()})")
             for i, cond in enumerate(final_analysis["potential_conditions"]):
                 logger.info(f"{i+1}. {cond.get('condition')} ({cond.get('probability')})")
-                logger.debug(f"   Reasoning: {cond.get('reasoning')}")
+                logger.debug("   Reasoning: %s", cond.get('reasoning'))
+
+        if cacheable and self.triage_cache:
+            try:
+                self.triage_cache.store(self.specialty, symptoms_summary, patient_data, final_analysis, profile_vector)
+            except Exception as e:
+                logger.warning(f"Salvataggio in cache triage fallito: {e}")
 
+        # Le regole simboliche valgono sempre sui parametri vitali di questa sessione (anche con la cache)
         recommendation = self.triage_engine.get_recommendation(final_analysis, extracted_data)
 
         # 5. Costruzione Output Finale
@@ -396,4 +435,50 @@ class SpecialistAgent:
             "tool_report": tool_results_md 
         }
         
-        return {"type": "triage_result", "data": final_response_data}
\ No newline at end of file
+        return {"type": "triage_result", "data": final_response_data}
+
+    def _run_analysis(self, symptoms_summary: str, rag_query: str, patient_data: dict = None,
+                      prefetched_docs: list = None, mode: DegradationMode = FULL):
+        """
+        RAG, Riflessione ed eventuale generazione forzata.
+        Ritorna (analisi, cacheable): l'analisi non va in cache se il RAG è fallito
+        o se è stata prodotta in modalità degradata.
+        """
+        # 2. Fase RAG (usa la query costruita da patient_data)
+        depth = {}
+        if mode.retrieval_k:
+            depth = {"k": mode.retrieval_k, "top_n": mode.rerank_top_n}
+        initial_rag_analysis = self.rag_handler.get_potential_conditions(rag_query, self.specialty,
+                                                                         reranked=prefetched_docs, **depth)
+        
+        # --- DEBUG: Log dell'analisi RAG ---
+        rag_conditions_count = len(initial_rag_analysis.get("potential_conditions", []))
+        logger.info(f"RAG ha ritornato {rag_conditions_count} condizioni iniziali.")
+
+        # Controlla fallimento RAG
+        if "error" in initial_rag_analysis or not isinstance(initial_rag_analysis.get("potential_conditions"), list):
+            error_msg = initial_rag_analysis.get("error", "Formato non valido")
+            logger.warning(f"RAG fallito. Motivo: {error_msg}")
+            record_outcome("rag", "fallback", self.specialty)
+            logger.debug("Dati ricevuti: %s", initial_rag_analysis)
+            
+            # NON ritornare subito! Passiamo al Supervisore con una lista vuota.
+            # Questo attiverà la generazione basata su conoscenza generale.
+            initial_rag_analysis = {"potential_conditions": [], "error": error_msg}
+        
+        # 3. Fase di Riflessione (attiva salvo degradazione sotto carico)
+        # Anche se RAG non ha trovato nulla, chiediamo al Supervisore di ragionare sui sintomi.
+        if mode.skip_reflection:
+            logger.info(f" {self.specialty.upper()}: riflessione saltata (modalità {mode.name}).")
+            record_outcome("reflection", "skipped", self.specialty)
+            final_analysis = initial_rag_analysis
+        else:
+            final_analysis = self._run_reflection(symptoms_summary, initial_rag_analysis, patient_data)
+
+        # --- HARD FALLBACK: SE ANCORA VUOTO, FORZA GENERAZIONE ---
+        if not final_analysis.get("potential_conditions"):
+            logger.warning(f" {self.specialty.upper()}: Analisi ancora vuota dopo riflessione. FORZO GENERAZIONE.")
+            record_outcome("triage", "forced_diagnosis", self.specialty)
+            final_analysis = self._force_diagnosis(symptoms_summary)
+
+        return final_analysis, "error" not in initial_rag_analysis and mode.level == 0
@@ -1,5 +1,136 @@
+import os
+
+# Radice del progetto: i file generati (log delle decisioni) non dipendono dalla cartella di avvio
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 LLM_MODEL = "llama3:8b"
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # Multilingue IT/ES/PT/EN
 API_BASE_URL = "http://127.0.0.1:8000"
-DEFAULT_LANGUAGE = "it"  # Default language: "en" or "it"
\ No newline at end of file
+DEFAULT_LANGUAGE = "it"  # Default language: "en" or "it"
+
+# --- Backend di inferenza (embedder e reranker) ---
+INFERENCE_BACKEND = "torch"          # "torch" | "onnx" | "onnx-int8" (confronto: python -m benchmarks.backends)
+ONNX_QUANTIZATION_CONFIG = "avx2"    # Istruzioni CPU per int8: "avx2" | "avx512" | "avx512_vnni" | "arm64"
+ONNX_MODELS_DIR = "onnx_models"      # Dove salvare gli export ONNX/int8
+INFERENCE_THREADS = None             # Thread intra-op (None = default della libreria)
+EMBEDDING_MAX_SEQ_LENGTH = None      # None = quella del modello (128): deve restare uguale a quella usata per i DB
+RERANKER_MAX_LENGTH = None           # None = quella del modello (512); 256 basta per query + chunk da 1000 caratteri
+
+# --- Model server condiviso (un solo embedder/reranker per tutti i worker) ---
+MODEL_SERVER_SOCKET = None  # es. "/tmp/neurosymbolic-models/models.sock" dopo `python -m app.logic.model_server`
+# Chiave condivisa per autenticare i worker (HMAC di multiprocessing.connection, prima di qualsiasi unpickle).
+# Letta da questa variabile d'ambiente; se assente il server genera una chiave nel file "authkey"
+# accanto al socket (cartella 0700, file 0600) e i worker la leggono da lì.
+MODEL_SERVER_AUTHKEY_ENV = "NEUROSYMBOLIC_MODEL_SERVER_KEY"
+
+# --- Modello per fase della pipeline (tiering) ---
+# Estrazione, routing e riassunto della cronologia girano su un modello piccolo (`ollama pull llama3.2:3b`);
+# per le fasi in ESCALATION_STAGES un output non valido, o un modello non installato, passa a ESCALATION_MODEL.
+# Con più modelli in uso conviene OLLAMA_MAX_LOADED_MODELS >= 3 (evita ricaricamenti).
+STAGE_MODELS = {
+    "extraction": "llama3.2:3b",          # AssistantAgent (estrazione JSON dei dati clinici)
+    "routing": "llama3.2:3b",             # RouterAgent
+    "history_summary": "llama3.2:3b",     # Riassunto progressivo della cronologia
+    "specialist_decision": LLM_MODEL,
+    "rag": LLM_MODEL,
+    "reflection": LLM_MODEL,
+    "forced_diagnosis": LLM_MODEL,
+    "vision": "llava",                    # ImageAnalyzer
+}
+ESCALATION_MODEL = LLM_MODEL
+ESCALATION_STAGES = ("extraction", "routing", "history_summary", "specialist_decision")
+
+# --- Output strutturato degli LLM ---
+# Lo JSON Schema atteso (MedicalAnalysis, RouterOutput, AgentAction) viene passato come `format`
+# a Ollama (>= 0.5). False = solo format="json" (riparazione locale + nuovi tentativi)
+STRUCTURED_OUTPUT_ENABLED = True
+
+# --- Prefetch RAG (retrieval + reranking avviati appena la sessione è instradata) ---
+RAG_PREFETCH_ENABLED = True
+RAG_PREFETCH_WORKERS = 2     # Prefetch in parallelo
+RAG_PREFETCH_TTL_S = 1800    # Prefetch non ritirati scartati dopo 30 minuti
+RAG_PREFETCH_WAIT_S = 10.0   # Attesa massima al triage per un prefetch ancora in corso
+
+# --- Single-flight (richieste identiche in corso condividono un solo calcolo) ---
+SINGLE_FLIGHT_ENABLED = True      # Chiamate LLM, retrieval/RAG e turni di chat identici
+CHAT_DUPLICATE_WINDOW_S = 5.0     # Un retry con lo stesso message_id entro questa finestra riceve la stessa risposta
+
+# --- Degradazione sotto carico (modalità più economiche quando Ollama è in coda) ---
+# Livelli cumulativi: full -> no_reflection -> shallow_rerank -> fast_router -> deferred_images.
+# Si sale di un livello alla volta quando chiamate LLM in corso o rallentamento superano la soglia del
+# livello successivo; si scende di uno dopo DEGRADATION_RECOVERY_S sotto la soglia.
+DEGRADATION_ENABLED = True
+DEGRADATION_QUEUE_STEPS = (4, 8, 12, 16)          # Chiamate a Ollama in corso per attivare i livelli 1..4
+DEGRADATION_SLOWDOWN_STEPS = (2.0, 3.0, 4.0, 6.0)  # Latenza recente / latenza a vuoto (mediana per agente)
+DEGRADATION_WINDOW_S = 60.0       # Finestra delle latenze recenti
+DEGRADATION_STEP_UP_S = 5.0       # Intervallo minimo tra due passi verso l'alto
+DEGRADATION_RECOVERY_S = 30.0     # Tempo sotto soglia prima di tornare al livello precedente
+DEGRADED_RETRIEVAL_K = 12         # Candidati al reranker da shallow_rerank in su (invece di 30)
+DEGRADED_RERANK_TOP_N = 5         # Chunk passati alla generazione da shallow_rerank in su (invece di 10)
+DEGRADED_ROUTER_MARGIN_SCALE = 0.5  # fast_router: scarto richiesto al router vettoriale (x ROUTER_FAST_PATH_MARGIN)
+
+# --- Cache semantica del triage (analisi RAG + riflessione riusate per casi equivalenti) ---
+TRIAGE_CACHE_ENABLED = True
+TRIAGE_CACHE_SIMILARITY = 0.95    # Similarità coseno minima tra profili normalizzati (stessa specialità)
+TRIAGE_CACHE_TTL_S = 6 * 3600     # Le analisi salvate scadono dopo 6 ore
+TRIAGE_CACHE_MAX_ENTRIES = 2000   # Voci in memoria per processo
+
+# --- Compattazione della cronologia nei prompt di router e specialista ---
+HISTORY_COMPACTION_ENABLED = True
+HISTORY_KEEP_LAST = 6             # Messaggi recenti inclusi alla lettera
+HISTORY_SUMMARY_MIN_NEW = 4       # Messaggi usciti dalla coda prima di aggiornare il riassunto
+HISTORY_MAX_MESSAGE_CHARS = 800   # Referti e note immagine lunghi vengono troncati
+HISTORY_SUMMARY_MAX_WORDS = 150
+
+# --- Budget dei prompt e num_ctx ---
+PROMPT_TOKENIZER_FILE = None          # tokenizer.json del modello (es. di llama3) per il conteggio esatto; None = stima
+PROMPT_CHARS_PER_TOKEN = 3.2          # Stima prudente per testo misto IT/EN con termini medici
+PROMPT_MAX_TOKENS = 6000              # Budget del prompt (llama3:8b ha un contesto di 8192)
+RESPONSE_RESERVE_TOKENS = 768         # Spazio riservato alla risposta nel calcolo di num_ctx
+NUM_CTX_BUCKETS = (2048, 4096, 8192)  # Valori ammessi per num_ctx (ogni cambio ricarica il modello in Ollama)
+NUM_CTX_STICKY = True                 # Un modello non torna a un num_ctx più piccolo (evita ricaricamenti continui)
+RAG_CONTEXT_MAX_TOKENS = 3000         # Tetto dei chunk nel prompt RAG (i meno rilevanti vengono tolti)
+IMAGE_CONTEXT_TOKENS = 2880           # Token di un'immagine per il modello vision (LLaVA 1.6: fino a 2880, 1.5: 576)
+
+# --- Riuso della KV cache di Ollama (prefisso statico dei prompt) ---
+# Slot di cache per modello = OLLAMA_NUM_PARALLEL del server. Con 1 slot i prompt di agenti diversi
+# si sovrascrivono a vicenda: impostare OLLAMA_NUM_PARALLEL (e questo valore) ad almeno 4.
+LLM_KV_CACHE_SLOTS = 1
+
+# --- Micro-batching (richieste concorrenti di embedding e reranking unite in un solo batch) ---
+MICRO_BATCHING_ENABLED = True
+MICRO_BATCH_MAX_WAIT_MS = 5     # Attesa massima per raccogliere altre richieste (0 = solo quelle già in coda)
+EMBED_BATCH_MAX_SIZE = 32       # Testi per batch di embedding
+RERANK_BATCH_MAX_SIZE = 128     # Coppie query-documento per batch (una query ne porta RETRIEVAL_K = 30)
+
+# --- Router vettoriale (fast path senza LLM) ---
+ROUTER_FAST_PATH_ENABLED = True
+ROUTER_FAST_PATH_MARGIN = 0.08          # Scarto minimo di similarità tra 1° e 2° specialista
+ROUTER_FAST_PATH_MIN_SIMILARITY = 0.35  # Similarità minima del 1° specialista
+ROUTER_FAST_PATH_MIN_FACTS = 2          # Informazioni minime (sintomi + durata) prima di instradare
+ROUTER_FAST_PATH_SHADOW_RATE = 0.1      # Frazione di decisioni fast path verificate con l'LLM
+# Decisioni LLM registrate per prototipi e calibrazione: solo embedding della query e specialista, niente testo
+ROUTER_DECISIONS_LOG = os.path.join(PROJECT_ROOT, "routing_decisions.jsonl")
+ROUTER_DECISIONS_LOG_MAX_BYTES = 5 * 1024 * 1024  # Oltre, il file passa a .1 (una generazione precedente)
+ROUTER_CALIBRATE_EVERY = 50             # Ricalibra la soglia di margin ogni N nuove decisioni registrate
+ROUTER_CALIBRATION_HOLDOUT = 0.3        # Quota delle decisioni LLM riservata alla calibrazione (fuori dai prototipi)
+
+# --- Pre-router lessicale (red flag e parole chiave, senza LLM) ---
+LEXICAL_PREROUTER_ENABLED = True
+
+# --- Avvio ---
+# Quando caricare embedder, reranker e prototipi del router:
+# "background" = subito dopo l'avvio, in un thread (il server accetta già richieste)
+# "blocking"   = durante l'avvio, prima di accettare richieste
+# "off"        = alla prima richiesta che li usa
+MODEL_WARMUP = "background"
+
+# --- Logging ---
+LOG_FORMAT = "text"     # "text" (colori, terminale) oppure "json" (una riga JSON per record)
+LOG_ASYNC = True        # Accoda i record e li scrive da un thread in background
+LOG_QUEUE_SIZE = 10000  # Record in coda oltre i quali i nuovi log vengono scartati
+
+# --- Triage in batch (/triage/batch) ---
+BATCH_TRIAGE_MAX_WORKERS = 4   # Worker di default per batch
+BATCH_TRIAGE_WORKERS_LIMIT = 16  # Limite massimo richiedibile dal client
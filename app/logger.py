@@ -1,15 +1,58 @@
 """
 Modulo centralizzato per il logging strutturato.
 Sostituisce i print() con un sistema di logging configurabile.
+
+Con LOG_ASYNC i record vengono solo accodati (QueueHandler) e formattati/scritti
+da un thread in background (QueueListener): il percorso caldo non paga l'I/O.
+Con LOG_FORMAT = "json" ogni record diventa una riga JSON con request_id e
+session_id della richiesta in corso (vedi `bind_log_context`).
+
+Per i payload di debug usare lo stile `logger.debug("Dati: %s", data)`: il
+messaggio viene composto solo se il livello DEBUG è attivo.
 """
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+from datetime import datetime, timezone
 from typing import Optional
 
+from app.config import LOG_ASYNC, LOG_FORMAT, LOG_QUEUE_SIZE
+
+# Contesto della richiesta corrente (impostato dal middleware HTTP e da /chat)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+session_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_id", default=None)
+
+# Attributi standard di LogRecord: tutto il resto è un campo "extra" da serializzare
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def bind_log_context(request_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Associa request_id e/o session_id ai log emessi da qui in avanti nel contesto corrente."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if session_id is not None:
+        session_id_var.set(session_id)
+
+
+class ContextFilter(logging.Filter):
+    """Copia request_id e session_id dal contesto nel record (prima dell'accodamento)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+
 # Formattazione colorata per il terminale
 class ColoredFormatter(logging.Formatter):
     """Formatter con colori per distinguere i livelli di log."""
-    
+
     COLORS = {
         'DEBUG': '\033[36m',     # Cyan
         'INFO': '\033[32m',      # Green
@@ -18,7 +61,7 @@ class ColoredFormatter(logging.Formatter):
         'CRITICAL': '\033[35m',  # Magenta
     }
     RESET = '\033[0m'
-    
+
     def format(self, record: logging.LogRecord) -> str:
         # Aggiungi emoji per leggibilità
         emoji_map = {
@@ -28,43 +71,126 @@ class ColoredFormatter(logging.Formatter):
             'ERROR': '❌',
             'CRITICAL': '🚨',
         }
-        
+
         color = self.COLORS.get(record.levelname, '')
         emoji = emoji_map.get(record.levelname, '')
-        
+
         # Formato: [LEVEL] emoji messaggio
-        record.msg = f"{color}[{record.levelname}]{self.RESET} {emoji} {record.msg}"
-        return super().format(record)
+        # Il record non viene modificato: altri handler ricevono il messaggio originale
+        return f"{color}[{record.levelname}]{self.RESET} {emoji} {super().format(record)}"
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record, con contesto della richiesta e campi `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "session_id": getattr(record, "session_id", None),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Accoda una copia del record senza formattarla: la formattazione (colori o JSON)
+    avviene nel thread del listener. Il messaggio viene risolto qui con gli argomenti
+    attuali, così oggetti mutabili modificati dopo la chiamata non alterano il log.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # I traceback tengono vivi i frame: li rendiamo testo subito
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def handleError(self, record):
+        # Coda piena o chiusa: il log si perde ma la richiesta non viene rallentata
+        pass
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def _build_formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return ColoredFormatter('%(message)s')
+
+
+_queue_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def _get_queue_handler() -> logging.Handler:
+    """Handler condiviso da tutti i logger; il listener (unico) viene avviato al primo uso."""
+    global _queue_handler, _listener
+    with _setup_lock:
+        if _queue_handler is None:
+            log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            output = logging.StreamHandler(sys.stdout)
+            output.setFormatter(_build_formatter())
+            _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)  # Svuota la coda all'uscita
+            _queue_handler = _LazyQueueHandler(log_queue)
+            _queue_handler.addFilter(ContextFilter())
+    return _queue_handler
 
 
 def get_logger(name: str, level: Optional[int] = None) -> logging.Logger:
     """
     Ritorna un logger configurato per il modulo specificato.
-    
+
     Args:
         name: Nome del modulo (usa __name__ per il nome automatico)
         level: Livello di logging (default: INFO)
-    
+
     Returns:
         Logger configurato
     """
     logger = logging.getLogger(name)
-    
+
     # Evita handler duplicati
     if logger.handlers:
         return logger
-    
+
     # Livello di default
     logger.setLevel(level or logging.INFO)
-    
-    # Handler per console
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(ColoredFormatter('%(message)s'))
-    logger.addHandler(console_handler)
-    
+
+    if LOG_ASYNC:
+        # Handler asincrono: accoda e torna subito
+        logger.addHandler(_get_queue_handler())
+    else:
+        # Handler per console
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(_build_formatter())
+        console_handler.addFilter(ContextFilter())
+        logger.addHandler(console_handler)
+
     # Previene propagazione a root logger
     logger.propagate = False
-    
+
     return logger
 
 
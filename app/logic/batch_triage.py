@@ -0,0 +1,170 @@
+"""
+Triage in batch di casi già strutturati (senza turni conversazionali).
+
+Ogni caso ha la stessa forma dei dati gestiti dall'AssistantAgent (patient_data)
+più, opzionalmente, la specialità, un riassunto e i parametri vitali (extracted_data).
+I casi vengono eseguiti su un pool di worker limitato e i risultati restituiti in
+streaming, uno per riga, nell'ordine in cui terminano.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+
+from app.logger import get_api_logger
+
+# Logger per questo modulo
+logger = get_api_logger()
+
+# Struttura patient_data dell'AssistantAgent
+PATIENT_DATA_DEFAULTS = {
+    "symptoms": [],
+    "duration": [],
+    "negative_findings": [],
+    "medical_history": [],
+    "medications": [],
+    "allergies": [],
+    "vital_signs": {},
+    "notes": ""
+}
+
+
+def normalize_patient_data(patient_data: Optional[dict]) -> Dict[str, Any]:
+    """Completa patient_data con i campi mancanti (copie, per non condividere liste tra casi)."""
+    normalized = {k: (v.copy() if isinstance(v, (list, dict)) else v) for k, v in PATIENT_DATA_DEFAULTS.items()}
+    if patient_data:
+        normalized.update(patient_data)
+    return normalized
+
+
+def build_case_summary(case: dict, patient_data: dict) -> str:
+    """Riassunto per lo specialista: quello fornito, altrimenti ricostruito da patient_data."""
+    if case.get("summary"):
+        return case["summary"]
+    parts = []
+    if patient_data.get("symptoms"):
+        parts.append(", ".join(patient_data["symptoms"]))
+    if patient_data.get("duration"):
+        parts.append("Duration: " + ", ".join(patient_data["duration"]))
+    if patient_data.get("medical_history"):
+        parts.append("History: " + ", ".join(patient_data["medical_history"]))
+    return ". ".join(parts)
+
+
+def _latency_summary(latencies_ms: list) -> dict:
+    if not latencies_ms:
+        return {"p50": None, "p95": None, "max": None, "mean": None}
+    values = np.asarray(latencies_ms)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "max": round(float(values.max()), 1),
+        "mean": round(float(values.mean()), 1),
+    }
+
+
+class BatchTriageRunner:
+    def __init__(self, specialist_factory: Callable[[str, str], Any],
+                 route_case: Callable[[str, dict, str], Optional[str]],
+                 available_specialists: list, max_workers: int = 4):
+        """
+        Args:
+            specialist_factory: (specialità, lingua) -> nuovo SpecialistAgent.
+            route_case: (riassunto, patient_data, lingua) -> specialità, per i casi senza specialità.
+            available_specialists: Specialità con un DB vettoriale.
+            max_workers: Casi elaborati in parallelo.
+        """
+        self.specialist_factory = specialist_factory
+        self.route_case = route_case
+        self.available_specialists = available_specialists
+        self.max_workers = max(1, max_workers)
+
+        # Un agente per (specialità, lingua): set_language() sugli agenti condivisi non è thread-safe
+        self._agents: Dict[tuple, Any] = {}
+        self._agents_lock = threading.Lock()
+
+    def _get_agent(self, specialty: str, language: str):
+        key = (specialty, language)
+        with self._agents_lock:
+            if key not in self._agents:
+                self._agents[key] = self.specialist_factory(specialty, language)
+            return self._agents[key]
+
+    def _run_case(self, index: int, case: dict) -> dict:
+        start = time.perf_counter()
+        case_id = case.get("case_id") or str(index)
+        language = case.get("language") or "en"
+        result = {"type": "case_result", "case_id": case_id}
+        try:
+            patient_data = normalize_patient_data(case.get("patient_data"))
+            summary = build_case_summary(case, patient_data)
+            specialty = (case.get("specialty") or "").lower()
+            if not specialty:
+                specialty = (self.route_case(summary, patient_data, language) or "").lower()
+            if specialty not in self.available_specialists:
+                raise ValueError(f"Specialità non disponibile: '{specialty or 'N/A'}'")
+
+            agent = self._get_agent(specialty, language)
+            triage_result = agent.perform_analysis_and_triage(summary, case.get("extracted_data") or {}, patient_data)
+            data = triage_result.get("data", {})
+            result.update({
+                "status": "ok",
+                "specialty": specialty,
+                "livello": data.get("livello"),
+                "messaggio": data.get("messaggio"),
+                "referto": data.get("referto", []),
+                "sources_consulted": data.get("sources_consulted", []),
+                "tool_report": data.get("tool_report", ""),
+            })
+        except Exception as e:
+            logger.error(f"Batch triage: errore nel caso {case_id}: {e}")
+            result.update({"status": "error", "error": str(e)})
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    def run(self, cases: Iterable[dict]) -> Iterator[dict]:
+        """
+        Esegue i casi e restituisce i risultati man mano che terminano.
+        Al massimo 2 x max_workers casi sono in coda alla volta, così input molto grandi
+        non vengono caricati tutti nel pool. L'ultima riga è un riepilogo con latenze e throughput.
+        """
+        start = time.perf_counter()
+        latencies = []
+        counts = {"ok": 0, "error": 0}
+        max_pending = self.max_workers * 2
+
+        def drain(done):
+            for future in done:
+                result = future.result()
+                latencies.append(result["latency_ms"])
+                counts[result["status"]] += 1
+                yield result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for index, case in enumerate(cases):
+                # Ogni caso eredita il contesto dei log (request_id) della richiesta batch
+                pending.add(executor.submit(contextvars.copy_context().run, self._run_case, index, case))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from drain(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from drain(done)
+
+        elapsed = time.perf_counter() - start
+        total = counts["ok"] + counts["error"]
+        logger.info(f"Batch triage completato: {total} casi in {elapsed:.1f}s ({counts['error']} errori).")
+        yield {
+            "type": "summary",
+            "cases": total,
+            "ok": counts["ok"],
+            "errors": counts["error"],
+            "max_workers": self.max_workers,
+            "total_seconds": round(elapsed, 2),
+            "throughput_cases_per_sec": round(total / elapsed, 3) if elapsed > 0 else None,
+            "latency_ms": _latency_summary(latencies),
+        }
@@ -0,0 +1,143 @@
+"""
+Eliminazione dei chunk quasi-duplicati in fase di ingestione.
+
+I PDF medici ripetono molto testo (intestazioni, note legali, bibliografie,
+paragrafi di linee guida copiati tra documenti). Ogni chunk viene ridotto a una
+firma MinHash sugli shingle di parole; un indice LSH a bande trova i candidati
+simili e la similarità di Jaccard stimata decide se il chunk è un duplicato.
+Il primo chunk visto resta nel DB (rappresentante), le copie vengono scartate
+ma la loro provenienza (file + pagina) viene conservata nei metadati.
+"""
+import re
+import zlib
+import hashlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Chiavi dei metadati Chroma (solo valori scalari: liste serializzate come stringhe)
+DUPLICATE_COUNT_KEY = "duplicate_count"
+DUPLICATE_SOURCES_KEY = "duplicate_sources"
+DUPLICATE_PAGES_KEY = "duplicate_pages"
+PROVENANCE_SEPARATOR = "; "
+
+# Primo di Mersenne 2^31 - 1: (a * x + b) con x < 2^32 resta dentro uint64
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def split_provenance(value: Optional[str]) -> List[str]:
+    """Deserializza una lista di provenienza salvata nei metadati."""
+    if not value:
+        return []
+    return [item for item in value.split(PROVENANCE_SEPARATOR) if item]
+
+
+class ChunkDeduplicator:
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 32,
+                 shingle_size: int = 5, seed: int = 42):
+        """
+        Args:
+            threshold: Jaccard stimata minima per considerare due chunk duplicati.
+            num_perm: Numero di funzioni hash della firma MinHash.
+            bands: Bande LSH (num_perm deve esserne multiplo).
+            shingle_size: Parole per shingle.
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm deve essere un multiplo di bands.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+        self._exact: Dict[str, str] = {}            # hash testo normalizzato -> id rappresentante
+        self._signatures: Dict[str, np.ndarray] = {}  # id rappresentante -> firma MinHash
+        self._buckets: Dict[tuple, List[str]] = {}  # (banda, hash banda) -> id rappresentanti
+        self.provenance: Dict[str, List[dict]] = {}  # id rappresentante -> copie scartate
+        self.duplicates_removed = 0
+
+    def _tokens(self, text: str) -> List[str]:
+        return _TOKEN_RE.findall(text.lower())
+
+    def _signature(self, tokens: List[str]) -> np.ndarray:
+        k = self.shingle_size
+        if len(tokens) <= k:
+            shingles = {" ".join(tokens)}
+        else:
+            shingles = {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+        hashed = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        # Matrice (shingle x permutazioni): minimo per colonna = firma
+        permuted = (hashed[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield (band, signature[start:start + self.rows].tobytes())
+
+    def find_duplicate(self, chunk_id: str, text: str, metadata: dict) -> Optional[str]:
+        """
+        Controlla se il chunk è un quasi-duplicato di uno già registrato.
+        Se lo è, registra la provenienza sul rappresentante e ne ritorna l'id.
+        Altrimenti registra il chunk come nuovo rappresentante e ritorna None.
+        """
+        tokens = self._tokens(text)
+        exact_key = hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()
+
+        representative = self._exact.get(exact_key)
+        signature = None
+        if representative is None:
+            signature = self._signature(tokens)
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            best_score = 0.0
+            for candidate in candidates:
+                score = float(np.mean(self._signatures[candidate] == signature))
+                if score >= self.threshold and score > best_score:
+                    representative, best_score = candidate, score
+
+        if representative is not None:
+            self.provenance.setdefault(representative, []).append({
+                "source": metadata.get("source", "N/A"),
+                "page": metadata.get("page"),
+            })
+            self.duplicates_removed += 1
+            return representative
+
+        # Nuovo rappresentante
+        self._exact[exact_key] = chunk_id
+        self._signatures[chunk_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(chunk_id)
+        return None
+
+    def provenance_metadata(self, chunk_id: str, metadata: dict) -> dict:
+        """
+        Ritorna i metadati del rappresentante arricchiti con la provenienza delle copie scartate.
+        """
+        copies = self.provenance.get(chunk_id, [])
+        if not copies:
+            return metadata
+
+        sources = []
+        pages = []
+        for copy in copies:
+            if copy["source"] != metadata.get("source") and copy["source"] not in sources:
+                sources.append(copy["source"])
+            location = copy["source"] if copy["page"] is None else f"{copy['source']}:{copy['page']}"
+            if location not in pages:
+                pages.append(location)
+
+        enriched = dict(metadata)
+        enriched[DUPLICATE_COUNT_KEY] = len(copies)
+        enriched[DUPLICATE_SOURCES_KEY] = PROVENANCE_SEPARATOR.join(sources)
+        enriched[DUPLICATE_PAGES_KEY] = PROVENANCE_SEPARATOR.join(pages)
+        return enriched
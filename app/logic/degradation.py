@@ -0,0 +1,202 @@
+"""
+Degradazione controllata sotto carico.
+
+Quando le chiamate a Ollama si accodano, ogni turno che esegue la pipeline completa
+(riflessione, reranking su 30 candidati, analisi immagine) allunga la coda per tutti.
+Il controller osserva due segnali dal vivo:
+  - profondità della coda: chiamate a Ollama in corso (dopo il single-flight);
+  - rallentamento: mediana delle latenze recenti per agente rispetto alla latenza
+    misurata a vuoto (chiamate partite senza altre chiamate in corso).
+
+Le modalità sono cumulative e si attivano un passo alla volta:
+  0 full             pipeline completa
+  1 no_reflection    niente riflessione: si usa l'analisi del RAG (generazione forzata solo se vuota)
+  2 shallow_rerank   DEGRADED_RETRIEVAL_K candidati al reranker e DEGRADED_RERANK_TOP_N chunk al RAG
+  3 fast_router      router vettoriale con scarto ridotto e senza verifiche shadow
+  4 deferred_images  analisi immagini rimandata al primo turno con meno carico
+Il ritorno verso `full` è automatico, un livello ogni DEGRADATION_RECOVERY_S sotto soglia.
+La modalità viene fissata all'inizio del turno e riportata nella risposta.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Sequence, Tuple
+
+from app.config import (
+    DEGRADATION_ENABLED, DEGRADATION_QUEUE_STEPS, DEGRADATION_SLOWDOWN_STEPS, DEGRADATION_WINDOW_S,
+    DEGRADATION_STEP_UP_S, DEGRADATION_RECOVERY_S, DEGRADED_RETRIEVAL_K, DEGRADED_RERANK_TOP_N
+)
+from app.logger import get_agent_logger
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+MODES = ("full", "no_reflection", "shallow_rerank", "fast_router", "deferred_images")
+
+DEGRADATION_TRANSITIONS = REGISTRY.counter(
+    "triage_degradation_transitions_total",
+    "Cambi di modalità della pipeline (from -> to).",
+    ("from_mode", "to_mode"),
+)
+DEGRADATION_TURNS = REGISTRY.counter(
+    "triage_degradation_turns_total",
+    "Turni di chat per modalità della pipeline.",
+    ("mode",),
+)
+
+# Peso della nuova osservazione nella latenza a vuoto (media mobile esponenziale)
+_BASELINE_ALPHA = 0.2
+# Campioni minimi nella finestra perché un agente conti nel rallentamento
+_MIN_SAMPLES = 3
+
+
+class DegradationMode:
+    """Modalità della pipeline per un turno (livello 0 = completa)."""
+    def __init__(self, level: int = 0):
+        self.level = level
+        self.name = MODES[level]
+
+    @property
+    def skip_reflection(self) -> bool:
+        return self.level >= 1
+
+    @property
+    def retrieval_k(self) -> Optional[int]:
+        return DEGRADED_RETRIEVAL_K if self.level >= 2 else None
+
+    @property
+    def rerank_top_n(self) -> Optional[int]:
+        return DEGRADED_RERANK_TOP_N if self.level >= 2 else None
+
+    @property
+    def fast_router(self) -> bool:
+        return self.level >= 3
+
+    @property
+    def defer_images(self) -> bool:
+        return self.level >= 4
+
+    def __repr__(self) -> str:
+        return f"DegradationMode({self.name})"
+
+
+FULL = DegradationMode(0)
+
+
+class DegradationController:
+    def __init__(self, enabled: bool = DEGRADATION_ENABLED, queue_steps: Sequence[int] = DEGRADATION_QUEUE_STEPS,
+                 slowdown_steps: Sequence[float] = DEGRADATION_SLOWDOWN_STEPS, window_s: float = DEGRADATION_WINDOW_S,
+                 step_up_s: float = DEGRADATION_STEP_UP_S, recovery_s: float = DEGRADATION_RECOVERY_S):
+        """
+        Args:
+            queue_steps: Chiamate LLM in corso oltre le quali si attivano i livelli 1..N.
+            slowdown_steps: Rallentamento (latenza recente / a vuoto) oltre il quale si attivano i livelli 1..N.
+            window_s: Finestra delle latenze recenti.
+            step_up_s: Intervallo minimo tra due passi verso l'alto.
+            recovery_s: Tempo continuo sotto soglia prima di scendere di un livello.
+        """
+        self.enabled = enabled
+        self.queue_steps = tuple(queue_steps)
+        self.slowdown_steps = tuple(slowdown_steps)
+        self.window_s = window_s
+        self.step_up_s = step_up_s
+        self.recovery_s = recovery_s
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._level = 0
+        self._changed_at = 0.0
+        self._below_since: Optional[float] = None  # Da quando il livello richiesto è sotto quello attuale
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}  # agente -> (istante, secondi)
+        self._baseline: Dict[str, float] = {}  # agente -> latenza a vuoto
+
+    # --- Segnali (da llm_client) ---
+    def call_started(self) -> int:
+        """Una chiamata a Ollama parte; ritorna quante altre erano già in corso."""
+        with self._lock:
+            depth = self._in_flight
+            self._in_flight += 1
+        return depth
+
+    def call_finished(self, agent: str, seconds: float, depth_at_start: int):
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            self._samples.setdefault(agent, deque()).append((now, seconds))
+            if depth_at_start == 0:
+                previous = self._baseline.get(agent)
+                self._baseline[agent] = (
+                    seconds if previous is None else (1 - _BASELINE_ALPHA) * previous + _BASELINE_ALPHA * seconds
+                )
+
+    # --- Valutazione ---
+    def _slowdown(self, now: float) -> float:
+        worst = 1.0
+        for agent, samples in self._samples.items():
+            while samples and now - samples[0][0] > self.window_s:
+                samples.popleft()
+            baseline = self._baseline.get(agent)
+            if baseline and len(samples) >= _MIN_SAMPLES:
+                worst = max(worst, statistics.median(s for _, s in samples) / baseline)
+        return worst
+
+    def _target_level(self, now: float) -> int:
+        queue_level = sum(1 for step in self.queue_steps if self._in_flight >= step)
+        slowdown = self._slowdown(now)
+        slowdown_level = sum(1 for step in self.slowdown_steps if slowdown >= step)
+        return min(max(queue_level, slowdown_level), len(MODES) - 1)
+
+    def mode(self) -> DegradationMode:
+        """Modalità per il turno che sta iniziando (aggiorna il livello di un passo al massimo)."""
+        if not self.enabled:
+            return FULL
+        now = time.monotonic()
+        with self._lock:
+            previous = self._level
+            target = self._target_level(now)
+            if target > self._level:
+                self._below_since = None
+                if now - self._changed_at >= self.step_up_s:
+                    self._level += 1
+            elif target < self._level:
+                if self._below_since is None:
+                    self._below_since = now
+                elif now - self._below_since >= self.recovery_s:
+                    self._level -= 1
+                    self._below_since = now
+            else:
+                self._below_since = None
+            if self._level != previous:
+                self._changed_at = now
+            level, in_flight = self._level, self._in_flight
+
+        if level != previous:
+            DEGRADATION_TRANSITIONS.inc(from_mode=MODES[previous], to_mode=MODES[level])
+            log = logger.warning if level > previous else logger.info
+            log(f"Pipeline: modalità {MODES[previous]} -> {MODES[level]} "
+                f"({in_flight} chiamate LLM in corso, livello richiesto {MODES[target]}).")
+        return DegradationMode(level)
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            slowdown = self._slowdown(now)
+            return {
+                "enabled": self.enabled,
+                "mode": MODES[self._level],
+                "target_mode": MODES[self._target_level(now)],
+                "llm_calls_in_flight": self._in_flight,
+                "slowdown": round(slowdown, 2),
+                "baseline_seconds": {agent: round(v, 3) for agent, v in self._baseline.items()},
+                "recent_median_seconds": {
+                    agent: round(statistics.median(s for _, s in samples), 3)
+                    for agent, samples in self._samples.items() if samples
+                },
+                "turns_by_mode": {labels[0]: int(count) for labels, count in DEGRADATION_TURNS.snapshot().items()},
+            }
+
+
+# Istanza di processo (segnali da llm_client, modalità letta da /chat)
+controller = DegradationController()
@@ -0,0 +1,181 @@
+"""
+Compattazione della cronologia della chat per i prompt di router e specialista.
+
+Invece di `chat_history[-12:]` (che include note di analisi immagine e referti
+markdown lunghi) i prompt ricevono:
+  1. un riassunto progressivo dei turni più vecchi, come messaggio di sistema;
+  2. gli ultimi HISTORY_KEEP_LAST messaggi alla lettera (troncati a HISTORY_MAX_MESSAGE_CHARS).
+
+Il riassunto viene aggiornato in background dopo la risposta (fuori dal percorso
+critico): il turno successivo usa l'ultimo riassunto disponibile, e i messaggi non
+ancora riassunti restano alla lettera finché l'aggiornamento non arriva.
+Lo stato (`history_summary`) vive nella sessione; il risultato del thread in
+background viene riportato nella sessione all'inizio della richiesta successiva.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.config import (
+    HISTORY_KEEP_LAST, HISTORY_SUMMARY_MIN_NEW, HISTORY_MAX_MESSAGE_CHARS, HISTORY_SUMMARY_MAX_WORDS
+)
+from app.logger import get_agent_logger
+from app.logic import structured_output, model_tiers
+from app.logic.prompt_builder import PromptBuilder, count_message_tokens
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+HISTORY_TOKENS = REGISTRY.histogram(
+    "triage_prompt_history_tokens",
+    "Token della cronologia nel prompt (mode=full: chat_history[-12:], compacted: riassunto + coda).",
+    ("agent", "mode"),
+    buckets=(50, 100, 200, 400, 800, 1200, 1600, 2400, 3200, 4800),
+)
+HISTORY_TOKENS_SAVED = REGISTRY.counter(
+    "triage_prompt_history_tokens_saved_total",
+    "Token risparmiati dalla compattazione della cronologia.",
+    ("agent",),
+)
+
+LEGACY_WINDOW = 12  # Finestra usata prima della compattazione, per misurare il risparmio
+
+SUMMARY_PROMPT = """You are a conversation summarizer for a medical triage chat.
+Update the running summary with the new messages. Keep ONLY clinically useful facts:
+symptoms, onset and duration, severity, answers the patient gave, relevant history,
+medications, allergies, red flags, and which questions were already asked.
+Write in the language of the conversation, at most {max_words} words, no greetings.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+"""
+
+
+class HistorySummary(BaseModel):
+    summary: str = Field(..., description="Riassunto aggiornato della conversazione.")
+
+
+_EMPTY = {"text": "", "covered": 0, "anchor": ""}
+
+
+def _anchor(chat_history: List[dict]) -> str:
+    """Identifica la conversazione (primo messaggio): dopo un reset il riassunto non vale più."""
+    return str(chat_history[0].get("content", ""))[:200] if chat_history else ""
+
+
+def _truncate(message: dict, max_chars: int) -> dict:
+    content = str(message.get("content", ""))
+    if len(content) <= max_chars:
+        return message
+    return {**message, "content": content[:max_chars] + " [...]"}
+
+
+class HistoryCompactor:
+    def __init__(self, keep_last: int = HISTORY_KEEP_LAST, min_new: int = HISTORY_SUMMARY_MIN_NEW,
+                 max_message_chars: int = HISTORY_MAX_MESSAGE_CHARS, max_words: int = HISTORY_SUMMARY_MAX_WORDS):
+        """
+        Args:
+            keep_last: Messaggi recenti sempre inclusi alla lettera.
+            min_new: Messaggi usciti dalla coda necessari per rigenerare il riassunto.
+            max_message_chars: Lunghezza massima di un messaggio alla lettera.
+            max_words: Lunghezza massima del riassunto.
+        """
+        self.keep_last = keep_last
+        self.min_new = min_new
+        self.max_message_chars = max_message_chars
+        self.max_words = max_words
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._results: Dict[str, dict] = {}  # session_id -> ultimo riassunto calcolato in background
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    # --- Stato nella sessione ---
+    def sync(self, session_id: str, session_state: dict) -> dict:
+        """
+        Riporta nella sessione il riassunto calcolato in background (se più recente)
+        e scarta quello di una conversazione ricominciata. Ritorna lo stato del riassunto.
+        """
+        chat_history = session_state.get("chat_history", [])
+        anchor = _anchor(chat_history)
+        state = session_state.get("history_summary") or _EMPTY
+        with self._lock:
+            result = self._results.pop(session_id, None)
+        if result and result["anchor"] == anchor and result["covered"] > state["covered"]:
+            state = result
+        if state.get("anchor") != anchor or state["covered"] > len(chat_history):
+            state = dict(_EMPTY)  # Conversazione ricominciata dopo il riassunto
+        session_state["history_summary"] = state
+        return state
+
+    def discard(self, session_id: str):
+        """Dimentica il riassunto in attesa di una sessione conclusa."""
+        with self._lock:
+            self._results.pop(session_id, None)
+
+    # --- Prompt ---
+    def build(self, chat_history: List[dict], summary_state: Optional[dict], agent: str = "") -> List[dict]:
+        """Messaggi per il prompt: riassunto dei turni vecchi + coda recente alla lettera."""
+        summary_state = summary_state or _EMPTY
+        tail_start = max(0, len(chat_history) - self.keep_last)
+        # I messaggi non ancora riassunti restano alla lettera
+        start = min(summary_state["covered"], tail_start) if summary_state["text"] else 0
+        if not summary_state["text"] and len(chat_history) > LEGACY_WINDOW:
+            start = len(chat_history) - LEGACY_WINDOW  # Riassunto non ancora pronto: come prima
+
+        messages = []
+        if summary_state["text"]:
+            messages.append({"role": "system", "content": f"SUMMARY OF THE EARLIER CONVERSATION:\n{summary_state['text']}"})
+        messages.extend(_truncate(m, self.max_message_chars) for m in chat_history[start:])
+
+        full_tokens = count_message_tokens(chat_history[-LEGACY_WINDOW:])
+        compacted_tokens = count_message_tokens(messages)
+        HISTORY_TOKENS.observe(full_tokens, agent=agent, mode="full")
+        HISTORY_TOKENS.observe(compacted_tokens, agent=agent, mode="compacted")
+        if full_tokens > compacted_tokens:
+            HISTORY_TOKENS_SAVED.inc(full_tokens - compacted_tokens, agent=agent)
+        return messages
+
+    # --- Aggiornamento in background ---
+    def schedule_refresh(self, session_id: str, chat_history: List[dict], summary_state: Optional[dict]):
+        """Aggiorna il riassunto in background se abbastanza messaggi sono usciti dalla coda."""
+        summary_state = summary_state or _EMPTY
+        target = len(chat_history) - self.keep_last
+        if target - summary_state["covered"] < self.min_new:
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        new_messages = list(chat_history[summary_state["covered"]:target])
+        self._executor.submit(self._refresh, session_id, summary_state["text"], new_messages, target,
+                              _anchor(chat_history))
+
+    def _refresh(self, session_id: str, previous: str, new_messages: List[dict], covered: int, anchor: str):
+        try:
+            transcript = "\n".join(
+                f"{m.get('agent') or m.get('role', 'user')}: {_truncate(m, self.max_message_chars)['content']}"
+                for m in new_messages
+            )
+            builder = PromptBuilder("history_summary", model=model_tiers.model_for("history_summary"))
+            builder.add("instructions", SUMMARY_PROMPT.format(max_words=self.max_words, summary=previous or "(none)",
+                                                              messages=transcript))
+            prompt = builder.build()
+            result = structured_output.chat_structured(
+                "history_summary", model_tiers.model_for("history_summary"), [{"role": "user", "content": prompt}],
+                HistorySummary, escalate_to=model_tiers.escalation_for("history_summary"),
+                options={"temperature": 0.0, "num_ctx": builder.num_ctx}
+            )
+            with self._lock:
+                self._results[session_id] = {"text": result.summary.strip(), "covered": covered, "anchor": anchor}
+            logger.info(f"Riassunto della cronologia aggiornato ({covered} messaggi, sessione {session_id}).")
+        except Exception as e:
+            logger.warning(f"Aggiornamento del riassunto della cronologia fallito: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
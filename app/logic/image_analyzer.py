@@ -1,15 +1,20 @@
-import ollama
 import base64
 import io
-from PIL import Image
+from typing import TYPE_CHECKING
 from app.logger import get_rag_logger
+from app.config import IMAGE_CONTEXT_TOKENS
+from app.logic import llm_client, model_tiers
+from app.logic.prompt_builder import count_tokens, num_ctx_for
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Logger per questo modulo
 logger = get_rag_logger()
 
 class ImageAnalyzer:
-    def __init__(self, model_name="llava", language="Italian"):
-        self.model_name = model_name
+    def __init__(self, model_name=None, language="Italian"):
+        self.model_name = model_name or model_tiers.model_for("vision")
         self.language = language
         
         # Prompt specifici per tipo di immagine
@@ -95,7 +100,7 @@ Start with: "Medical image analysis reveals: ..."
 """
         }
 
-    def _detect_image_type(self, image: Image.Image) -> str:
+    def _detect_image_type(self, image: "Image.Image") -> str:
         """
         Attempts to detect the type of medical image based on visual characteristics.
         Returns: 'dermatology', 'radiology_xray', 'radiology_ct', 'radiology_mri', or 'general_medical'
@@ -131,7 +136,7 @@ Start with: "Medical image analysis reveals: ..."
             color_variance += abs(r - avg_color) + abs(g - avg_color) + abs(b - avg_color)
         color_variance /= min(1000, len(rgb_pixels))
         
-        logger.debug(f"Image analysis - Brightness: {avg_brightness:.1f}, Dark ratio: {dark_ratio:.2f}, Color variance: {color_variance:.1f}")
+        logger.debug("Image analysis - Brightness: %.1f, Dark ratio: %.2f, Color variance: %.1f", avg_brightness, dark_ratio, color_variance)
         
         # Decision logic
         if color_variance < 10:  # Very grayscale
@@ -163,6 +168,7 @@ Start with: "Medical image analysis reveals: ..."
         
         # --- OTTIMIZZAZIONE: Ridimensiona immagine se troppo grande ---
         try:
+            from PIL import Image  # Import al primo uso: PIL non serve all'avvio
             image_data = base64.b64decode(image_base64)
             image = Image.open(io.BytesIO(image_data))
             
@@ -190,9 +196,12 @@ Start with: "Medical image analysis reveals: ..."
 
         # Select appropriate prompt
         prompt = self.prompts.get(image_type, self.prompts["general_medical"])
+        # Contesto: prompt + token dell'immagine + risposta (invece di un 4096 fisso)
+        num_ctx = num_ctx_for(count_tokens(prompt) + IMAGE_CONTEXT_TOKENS, model=self.model_name)
 
         try:
-            response = ollama.chat(
+            response = llm_client.chat(
+                agent="image_analyzer",
                 model=self.model_name,
                 messages=[
                     {
@@ -203,7 +212,7 @@ Start with: "Medical image analysis reveals: ..."
                 ],
                 options={
                     "temperature": 0.1,  # Slightly more creative for complex analysis
-                    "num_ctx": 4096      # Increased context for detailed analysis
+                    "num_ctx": num_ctx
                 }
             )
             description = response['message']['content']
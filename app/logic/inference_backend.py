@@ -0,0 +1,124 @@
+"""
+Backend di inferenza per embedder e reranker (nodi solo CPU).
+
+- "torch":     modelli PyTorch a precisione piena (comportamento originale).
+- "onnx":      stessi pesi esportati in ONNX ed eseguiti con ONNX Runtime.
+- "onnx-int8": ONNX con quantizzazione dinamica int8 (più veloce su CPU, punteggi leggermente diversi).
+
+Gli export ONNX vengono creati al primo utilizzo in ONNX_MODELS_DIR e riutilizzati
+agli avvii successivi. Servono `optimum[onnxruntime]` e `onnxruntime`, importati
+solo se il backend scelto li richiede.
+"""
+import os
+import re
+from typing import List, Optional
+
+from app.config import (
+    INFERENCE_BACKEND, INFERENCE_THREADS, ONNX_MODELS_DIR, ONNX_QUANTIZATION_CONFIG,
+    EMBEDDING_MAX_SEQ_LENGTH, RERANKER_MAX_LENGTH
+)
+from app.logger import get_rag_logger
+
+# Logger per questo modulo
+logger = get_rag_logger()
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _local_export_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODELS_DIR, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+
+
+def _quantized_file_name(quantization_config: str) -> str:
+    # Nome usato da sentence_transformers.export_dynamic_quantized_onnx_model
+    return f"model_qint8_{quantization_config}.onnx"
+
+
+def _onnx_model_kwargs(threads: Optional[int]) -> dict:
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return {"provider": "CPUExecutionProvider", "session_options": options}
+
+
+def _load(model_cls, model_name: str, backend: str, threads: Optional[int], quantization_config: str, **kwargs):
+    """
+    Carica un SentenceTransformer o CrossEncoder col backend richiesto.
+    Per i backend ONNX esporta (ed eventualmente quantizza) il modello la prima volta.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend di inferenza non supportato: '{backend}' (disponibili: {', '.join(BACKENDS)})")
+
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return model_cls(model_name, **kwargs)
+
+    export_dir = _local_export_dir(model_name)
+    onnx_kwargs = _onnx_model_kwargs(threads)
+
+    if not os.path.exists(os.path.join(export_dir, "onnx", "model.onnx")):
+        logger.info(f"Export ONNX di '{model_name}' in '{export_dir}' (solo al primo avvio)...")
+        exported = model_cls(model_name, backend="onnx", model_kwargs=dict(onnx_kwargs), **kwargs)
+        exported.save_pretrained(export_dir)
+
+    if backend == "onnx":
+        return model_cls(export_dir, backend="onnx", model_kwargs=dict(onnx_kwargs), **kwargs)
+
+    file_name = _quantized_file_name(quantization_config)
+    if not os.path.exists(os.path.join(export_dir, "onnx", file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        logger.info(f"Quantizzazione int8 ({quantization_config}) di '{model_name}'...")
+        base = model_cls(export_dir, backend="onnx", model_kwargs=dict(onnx_kwargs), **kwargs)
+        export_dynamic_quantized_onnx_model(base, quantization_config, export_dir)
+
+    return model_cls(export_dir, backend="onnx", model_kwargs={**onnx_kwargs, "file_name": f"onnx/{file_name}"}, **kwargs)
+
+
+def load_sentence_transformer(model_name: str, backend: str = INFERENCE_BACKEND,
+                              max_seq_length: Optional[int] = EMBEDDING_MAX_SEQ_LENGTH,
+                              threads: Optional[int] = INFERENCE_THREADS,
+                              quantization_config: str = ONNX_QUANTIZATION_CONFIG):
+    from sentence_transformers import SentenceTransformer
+
+    model = _load(SentenceTransformer, model_name, backend, threads, quantization_config)
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    logger.info(f"Embedder '{model_name}' caricato (backend={backend}, max_seq_length={model.max_seq_length}).")
+    return model
+
+
+def load_cross_encoder(model_name: str, backend: str = INFERENCE_BACKEND,
+                       max_length: Optional[int] = RERANKER_MAX_LENGTH,
+                       threads: Optional[int] = INFERENCE_THREADS,
+                       quantization_config: str = ONNX_QUANTIZATION_CONFIG):
+    from sentence_transformers import CrossEncoder
+
+    kwargs = {"max_length": max_length} if max_length else {}
+    model = _load(CrossEncoder, model_name, backend, threads, quantization_config, **kwargs)
+    logger.info(f"Reranker '{model_name}' caricato (backend={backend}, max_length={model.max_length}).")
+    return model
+
+
+class SentenceTransformerEmbeddings:
+    """
+    Interfaccia Embeddings di LangChain (embed_query/embed_documents) su un SentenceTransformer
+    già caricato con qualsiasi backend. Riproduce HuggingFaceEmbeddings di langchain_community
+    (newline -> spazio, vettori normalizzati), con cui sono stati costruiti i DB vettoriali.
+    """
+    def __init__(self, model, batch_size: int = 32):
+        self.model = model
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [t.replace("\n", " ") for t in texts]
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
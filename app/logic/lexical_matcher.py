@@ -0,0 +1,181 @@
+"""
+Pre-router simbolico basato su un automa Aho-Corasick.
+
+Tutti i termini (red flag di emergenza e parole chiave delle specialità, IT/EN)
+vengono compilati una sola volta in un automa: il messaggio dell'utente viene
+scansionato in un unico passaggio, in tempo lineare, prima di qualsiasi chiamata LLM.
+Le liste dei termini stanno in `app/data/red_flags.json` e `app/data/specialty_terms.json`.
+"""
+import json
+import re
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.logger import get_agent_logger
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+RED_FLAGS_PATH = DATA_DIR / "red_flags.json"
+SPECIALTY_TERMS_PATH = DATA_DIR / "specialty_terms.json"
+
+# Quante parole prima del termine cerchiamo una negazione ("non ho dolore al petto")
+NEGATION_WINDOW = 3
+# Segnaposto dei confini di frase (punteggiatura): una negazione non li attraversa ("No, I can't breathe")
+CLAUSE_MARK = "|"
+# Occorrenze distinte minime di termini clinici per instradare senza nome esplicito
+MIN_SPECIALTY_TERMS = 2
+
+_CLAUSE_RE = re.compile(r"[.,;:!?\n]+")
+_NON_WORD_RE = re.compile(r"[^a-z0-9|]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Minuscolo, senza accenti né punteggiatura, con spazi ai bordi (match a parola intera).
+    La punteggiatura di fine frase/inciso diventa il token CLAUSE_MARK.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    # L'apostrofo unisce le parole ("can't" -> "cant") invece di spezzarle
+    without_accents = without_accents.replace("'", "").replace("’", "").replace(CLAUSE_MARK, " ")
+    without_accents = _CLAUSE_RE.sub(f" {CLAUSE_MARK} ", without_accents)
+    return " " + _NON_WORD_RE.sub(" ", without_accents).strip() + " "
+
+
+class AhoCorasick:
+    def __init__(self, patterns: Dict[str, object]):
+        """
+        Compila l'automa.
+        Args:
+            patterns: Pattern già normalizzato -> payload restituito ad ogni match.
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, object]]] = [[]]
+
+        for pattern, payload in patterns.items():
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = nxt
+            self._output[state].append((pattern, payload))
+
+        # BFS per i link di fallimento
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def iter_matches(self, text: str):
+        """Restituisce (indice_inizio, pattern, payload) per ogni occorrenza nel testo."""
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, payload in self._output[state]:
+                yield i - len(pattern) + 1, pattern, payload
+
+
+class LexicalMatcher:
+    def __init__(self, red_flags_path: Path = RED_FLAGS_PATH, specialty_terms_path: Path = SPECIALTY_TERMS_PATH):
+        """Carica le liste dei termini e compila un unico automa per red flag e specialità."""
+        with open(red_flags_path, "r", encoding="utf-8") as f:
+            red_flags = json.load(f)
+        with open(specialty_terms_path, "r", encoding="utf-8") as f:
+            specialty_terms = json.load(f)
+
+        self.negations = {normalize_text(n).strip() for n in red_flags.get("negations", [])}
+        # Parole che aprono una nuova frase ("no I can't breathe", "ma"): la negazione si ferma lì
+        self.clause_openers = {normalize_text(w).strip() for w in red_flags.get("clause_openers", [])}
+        self.synonyms: Dict[str, str] = specialty_terms.get("synonyms", {})
+
+        # Payload: ("red_flag", termine) oppure ("name"/"term", specialità)
+        patterns: Dict[str, object] = {}
+        for lang in ("it", "en"):
+            for term in red_flags.get(lang, []):
+                patterns[normalize_text(term)] = ("red_flag", term)
+        for specialty, entry in specialty_terms.get("specialties", {}).items():
+            for term in entry.get("terms", []):
+                patterns.setdefault(normalize_text(term), ("term", specialty))
+            for name in entry.get("names", []):
+                patterns[normalize_text(name)] = ("name", specialty)
+
+        self._automaton = AhoCorasick(patterns)
+        logger.info(f"LexicalMatcher: automa compilato con {len(patterns)} termini.")
+
+    def _is_negated(self, text: str, start: int, pattern: str) -> bool:
+        """
+        True se una negazione governa direttamente il termine: al massimo NEGATION_WINDOW parole
+        prima, nella stessa frase. Un termine che contiene già la negazione ("non riesco a
+        respirare") non viene negato da un "no" che lo precede.
+        """
+        if pattern.split()[0] in self.negations:
+            return False
+        for word in reversed(text[:start].split()[-NEGATION_WINDOW:]):
+            if word == CLAUSE_MARK or word in self.clause_openers:
+                return False
+            if word in self.negations:
+                return True
+        return False
+
+    def scan(self, message: str) -> dict:
+        """
+        Scansiona il messaggio in un solo passaggio.
+        Ritorna {"red_flags": [...], "specialties": {specialità: {"names": set, "terms": set}}}.
+        """
+        text = normalize_text(message)
+        red_flags: List[str] = []
+        specialties: Dict[str, Dict[str, set]] = {}
+        for start, pattern, (kind, value) in self._automaton.iter_matches(text):
+            if self._is_negated(text, start, pattern):
+                continue
+            if kind == "red_flag":
+                if value not in red_flags:
+                    red_flags.append(value)
+            else:
+                bucket = specialties.setdefault(value, {"names": set(), "terms": set()})
+                bucket["names" if kind == "name" else "terms"].add(pattern.strip())
+        return {"red_flags": red_flags, "specialties": specialties}
+
+    def find_red_flags(self, message: str) -> List[str]:
+        """Termini di emergenza (non negati) presenti nel messaggio."""
+        return self.scan(message)["red_flags"]
+
+    def resolve_specialty(self, message: str, available_specialists: List[str]) -> Optional[str]:
+        """
+        Ritorna la specialità solo se il match è univoco: una sola specialità trovata e
+        nominata esplicitamente oppure indicata da almeno MIN_SPECIALTY_TERMS termini distinti.
+        """
+        specialties = self.scan(message)["specialties"]
+        if len(specialties) != 1:
+            return None
+        specialty, hits = next(iter(specialties.items()))
+        if specialty not in available_specialists:
+            return None
+        if hits["names"] or len(hits["terms"]) >= MIN_SPECIALTY_TERMS:
+            return specialty
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_lexical_matcher() -> LexicalMatcher:
+    """Istanza condivisa (l'automa viene compilato una sola volta per processo)."""
+    return LexicalMatcher()
@@ -0,0 +1,299 @@
+"""
+Punto unico per le chiamate a Ollama.
+
+Ogni risposta di `ollama.chat` contiene le statistiche di generazione
+(prompt_eval_count, eval_count, prompt_eval_duration, eval_duration,
+load_duration, total_duration in nanosecondi): qui vengono registrate per
+agente, specialità e modello, esportate su /metrics e riassunte da
+/debug/llm-stats.
+
+Ollama riusa la KV cache quando una richiesta condivide un prefisso con quella
+precedente nello stesso slot: `PromptPrefixTracker` simula gli slot per stimare
+i token di prompt riusati e il tempo di prompt eval risparmiato, per chiamata e
+(con `begin_turn`) per richiesta HTTP.
+
+Chiamate identiche (stesso modello, messaggi e opzioni) in corso nello stesso
+momento vengono eseguite una volta sola (vedi app/logic/single_flight.py).
+"""
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import ollama
+
+from app.config import LLM_KV_CACHE_SLOTS, SINGLE_FLIGHT_ENABLED
+from app.logger import get_agent_logger
+from app.logic import degradation
+from app.logic.prompt_builder import count_message_tokens, count_tokens
+from app.logic.single_flight import SingleFlight, make_key
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+# load_duration oltre questa soglia = il modello è stato (ri)caricato in memoria
+MODEL_LOAD_THRESHOLD_S = 0.5
+
+_NS = 1e9
+
+LLM_TOKENS = REGISTRY.counter(
+    "triage_llm_tokens_total",
+    "Token elaborati da Ollama (kind=prompt|completion).",
+    ("agent", "specialty", "model", "kind"),
+)
+LLM_CALLS = REGISTRY.counter(
+    "triage_llm_calls_total",
+    "Chiamate a Ollama per esito (ok|error).",
+    ("agent", "specialty", "model", "status"),
+)
+LLM_MODEL_LOADS = REGISTRY.counter(
+    "triage_llm_model_loads_total",
+    f"Chiamate con load_duration > {MODEL_LOAD_THRESHOLD_S}s (modello ricaricato).",
+    ("agent", "model"),
+)
+LLM_PHASE_SECONDS = REGISTRY.histogram(
+    "triage_llm_phase_seconds",
+    "Durate riportate da Ollama per fase (phase=load|prompt_eval|eval|total).",
+    ("agent", "specialty", "model", "phase"),
+)
+LLM_CACHED_TOKENS = REGISTRY.counter(
+    "triage_llm_prompt_cached_tokens_total",
+    "Token di prompt in comune con una richiesta precedente (riusati dalla KV cache di Ollama).",
+    ("agent", "specialty", "model"),
+)
+LLM_PROMPT_EVAL_SAVED = REGISTRY.counter(
+    "triage_llm_prompt_eval_saved_seconds_total",
+    "Stima del tempo di prompt eval risparmiato dal riuso del prefisso.",
+    ("agent", "specialty", "model"),
+)
+TURN_PROMPT_EVAL_SAVED = REGISTRY.histogram(
+    "triage_turn_prompt_eval_saved_seconds",
+    "Stima del tempo di prompt eval risparmiato per richiesta HTTP (somma delle chiamate a Ollama).",
+    ("endpoint",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0),
+)
+
+# Accumulatore della richiesta HTTP corrente (vedi begin_turn)
+_turn: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("llm_turn", default=None)
+
+
+def begin_turn() -> dict:
+    """
+    Inizia ad accumulare le statistiche delle chiamate a Ollama della richiesta corrente.
+    Ritorna il dict aggiornato da ogni chiamata (calls, cached_tokens, prompt_eval_saved_seconds).
+    """
+    turn = {"calls": 0, "cached_tokens": 0, "prompt_eval_saved_seconds": 0.0}
+    _turn.set(turn)
+    return turn
+
+
+def _stat(response: Any, key: str) -> int:
+    """Statistica numerica della risposta (0 se assente: es. risposte dalla cache di Ollama)."""
+    try:
+        value = response[key]
+    except (KeyError, TypeError):
+        return 0
+    return int(value or 0)
+
+
+def _same_message(a: dict, b: dict) -> bool:
+    return a.get("role") == b.get("role") and a.get("content") == b.get("content") and a.get("images") == b.get("images")
+
+
+def common_prefix_tokens(previous: List[dict], messages: List[dict]) -> int:
+    """Token iniziali in comune tra due liste di messaggi (messaggi identici + parte comune del primo diverso)."""
+    tokens = 0
+    for prev, msg in zip(previous, messages):
+        if _same_message(prev, msg):
+            tokens += count_message_tokens([msg])
+            continue
+        if prev.get("role") == msg.get("role") and not prev.get("images") and not msg.get("images"):
+            tokens += count_tokens(os.path.commonprefix([str(prev.get("content", "")), str(msg.get("content", ""))]))
+        break
+    return tokens
+
+
+class PromptPrefixTracker:
+    """
+    Simula gli slot della KV cache di Ollama: per ogni modello ricorda gli ultimi
+    `slots` prompt (con la risposta, anch'essa in cache). Come il server, una richiesta
+    usa lo slot con il prefisso comune più lungo, altrimenti quello usato meno di recente.
+    """
+    def __init__(self, slots: int = LLM_KV_CACHE_SLOTS):
+        self.slots = max(1, slots)
+        self._lock = threading.Lock()
+        self._cache: Dict[str, List[List[dict]]] = {}  # modello -> slot (dal più recente)
+
+    def observe(self, model: str, messages: List[dict], response_content: str, reloaded: bool = False) -> int:
+        """Registra la richiesta e ritorna i token del prefisso che erano già in cache."""
+        conversation = list(messages) + [{"role": "assistant", "content": response_content}]
+        with self._lock:
+            slots = self._cache.setdefault(model, [])
+            if reloaded:
+                slots.clear()  # Modello ricaricato: cache vuota
+            matches = [common_prefix_tokens(slot, messages) for slot in slots]
+            best = max(range(len(slots)), key=matches.__getitem__) if slots else None
+            cached = matches[best] if best is not None else 0
+            if best is not None and (cached > 0 or len(slots) >= self.slots):
+                slots.pop(best if cached > 0 else len(slots) - 1)
+            slots.insert(0, conversation)
+            del slots[self.slots:]
+        return cached
+
+
+prefix_tracker = PromptPrefixTracker()
+
+
+class LLMStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+
+    def record(self, agent: str, specialty: str, model: str, response: Any = None, wall_seconds: float = 0.0,
+               messages: Optional[List[dict]] = None):
+        key = (agent, specialty, model)
+        prompt_tokens = _stat(response, "prompt_eval_count")
+        completion_tokens = _stat(response, "eval_count")
+        load_s = _stat(response, "load_duration") / _NS
+        prompt_eval_s = _stat(response, "prompt_eval_duration") / _NS
+        eval_s = _stat(response, "eval_duration") / _NS
+        total_s = _stat(response, "total_duration") / _NS
+        status = "ok" if response is not None else "error"
+
+        # --- Riuso del prefisso ---
+        # Il prefisso in comune con uno slot è riusabile; prompt_eval_count (token valutati
+        # davvero) conferma il riuso: i token riusati non possono superare quelli non valutati.
+        cached_tokens, saved_s = 0, 0.0
+        if response is not None and messages is not None:
+            try:
+                content = response["message"]["content"]
+            except (KeyError, TypeError):
+                content = ""
+            prefix = prefix_tracker.observe(model, messages, content, reloaded=load_s > MODEL_LOAD_THRESHOLD_S)
+            if prefix and prompt_tokens:
+                cached_tokens = min(prefix, max(0, count_message_tokens(messages) - prompt_tokens))
+                saved_s = cached_tokens * prompt_eval_s / prompt_tokens
+
+        with self._lock:
+            totals = self._totals.setdefault(key, {
+                "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "load_seconds": 0.0, "prompt_eval_seconds": 0.0, "eval_seconds": 0.0,
+                "total_seconds": 0.0, "wall_seconds": 0.0, "model_loads": 0,
+                "cached_prompt_tokens": 0, "prompt_eval_saved_seconds": 0.0,
+            })
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall_seconds
+            if response is None:
+                totals["errors"] += 1
+            else:
+                totals["prompt_tokens"] += prompt_tokens
+                totals["completion_tokens"] += completion_tokens
+                totals["load_seconds"] += load_s
+                totals["prompt_eval_seconds"] += prompt_eval_s
+                totals["eval_seconds"] += eval_s
+                totals["total_seconds"] += total_s
+                totals["model_loads"] += load_s > MODEL_LOAD_THRESHOLD_S
+                totals["cached_prompt_tokens"] += cached_tokens
+                totals["prompt_eval_saved_seconds"] += saved_s
+
+        turn = _turn.get()
+        if turn is not None:
+            turn["calls"] += 1
+            turn["cached_tokens"] += cached_tokens
+            turn["prompt_eval_saved_seconds"] += saved_s
+
+        LLM_CALLS.inc(agent=agent, specialty=specialty, model=model, status=status)
+        if response is None:
+            return
+        LLM_TOKENS.inc(prompt_tokens, agent=agent, specialty=specialty, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, agent=agent, specialty=specialty, model=model, kind="completion")
+        for phase, seconds in (("load", load_s), ("prompt_eval", prompt_eval_s), ("eval", eval_s), ("total", total_s)):
+            LLM_PHASE_SECONDS.observe(seconds, agent=agent, specialty=specialty, model=model, phase=phase)
+        if cached_tokens:
+            LLM_CACHED_TOKENS.inc(cached_tokens, agent=agent, specialty=specialty, model=model)
+            LLM_PROMPT_EVAL_SAVED.inc(saved_s, agent=agent, specialty=specialty, model=model)
+        if load_s > MODEL_LOAD_THRESHOLD_S:
+            LLM_MODEL_LOADS.inc(agent=agent, model=model)
+            logger.warning(f"LLM: modello '{model}' ricaricato ({load_s:.1f}s) durante una chiamata di '{agent}'.")
+
+    def summary(self) -> dict:
+        """
+        Riepilogo per (agente, specialità, modello), ordinato per tempo di prompt eval:
+        i prompt più costosi in cima. Include throughput (token/s) e quota sul totale.
+        """
+        with self._lock:
+            items = [(key, dict(values)) for key, values in self._totals.items()]
+
+        total_prompt_eval = sum(v["prompt_eval_seconds"] for _, v in items)
+        rows = []
+        for (agent, specialty, model), v in items:
+            ok_calls = v["calls"] - v["errors"]
+            rows.append({
+                "agent": agent,
+                "specialty": specialty,
+                "model": model,
+                **{k: (round(val, 3) if isinstance(val, float) else val) for k, val in v.items()},
+                "avg_prompt_tokens": round(v["prompt_tokens"] / ok_calls, 1) if ok_calls else None,
+                "avg_completion_tokens": round(v["completion_tokens"] / ok_calls, 1) if ok_calls else None,
+                "prompt_tokens_per_sec": (
+                    round(v["prompt_tokens"] / v["prompt_eval_seconds"], 1) if v["prompt_eval_seconds"] else None
+                ),
+                "completion_tokens_per_sec": (
+                    round(v["completion_tokens"] / v["eval_seconds"], 1) if v["eval_seconds"] else None
+                ),
+                "prompt_eval_share": (
+                    round(v["prompt_eval_seconds"] / total_prompt_eval, 3) if total_prompt_eval else None
+                ),
+                "cached_prompt_share": (
+                    round(v["cached_prompt_tokens"] / (v["prompt_tokens"] + v["cached_prompt_tokens"]), 3)
+                    if v["prompt_tokens"] + v["cached_prompt_tokens"] else None
+                ),
+            })
+        rows.sort(key=lambda r: r["prompt_eval_seconds"], reverse=True)
+        return {
+            "calls": sum(r["calls"] for r in rows),
+            "errors": sum(r["errors"] for r in rows),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in rows),
+            "completion_tokens": sum(r["completion_tokens"] for r in rows),
+            "model_loads": sum(r["model_loads"] for r in rows),
+            "cached_prompt_tokens": sum(r["cached_prompt_tokens"] for r in rows),
+            "prompt_eval_saved_seconds": round(sum(r["prompt_eval_saved_seconds"] for r in rows), 3),
+            "by_caller": rows,
+        }
+
+
+# Statistiche di processo
+llm_stats = LLMStats()
+_llm_flight = SingleFlight("llm")
+
+
+def chat(agent: str, model: str, messages: list, specialty: Optional[str] = None, **kwargs) -> Any:
+    """
+    Come `ollama.chat`, ma registra token e durate della risposta.
+    Args:
+        agent: Chiamante (es. "router", "assistant", "rag", "reflection").
+        specialty: Specialità coinvolta, se presente.
+        **kwargs: Passati a `ollama.chat` (format, options, ...).
+    Le eccezioni vengono contate e rilanciate: la gestione degli errori resta al chiamante.
+    Una chiamata identica già in corso non viene ripetuta: se ne condivide la risposta.
+    """
+    if SINGLE_FLIGHT_ENABLED:
+        return _llm_flight.do(make_key(model, messages, kwargs), _chat, agent, model, messages, specialty, **kwargs)
+    return _chat(agent, model, messages, specialty, **kwargs)
+
+
+def _chat(agent: str, model: str, messages: list, specialty: Optional[str] = None, **kwargs) -> Any:
+    # Coda e latenze alimentano il controller della degradazione
+    depth = degradation.controller.call_started()
+    start = time.perf_counter()
+    try:
+        response = ollama.chat(model=model, messages=messages, **kwargs)
+    except Exception:
+        llm_stats.record(agent, specialty or "", model, None, time.perf_counter() - start)
+        raise
+    finally:
+        degradation.controller.call_finished(agent, time.perf_counter() - start, depth)
+    llm_stats.record(agent, specialty or "", model, response, time.perf_counter() - start, messages)
+    return response
@@ -0,0 +1,130 @@
+"""
+Micro-batching di richieste concorrenti (embedding delle query e reranking).
+
+Quando più sessioni arrivano al triage nello stesso momento, ognuna chiamerebbe
+il modello con un batch piccolo. Il MicroBatcher raccoglie le richieste per al
+massimo `max_wait_ms` (o finché il batch è pieno), esegue il modello una volta
+sola sull'intero batch (il padding lo fa il tokenizer) e restituisce a ogni
+chiamante la propria fetta di risultati. Un solo thread chiama il modello, quindi
+l'accesso ai pesi è anche serializzato.
+"""
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+from app.logger import get_rag_logger
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_rag_logger()
+
+BATCH_ITEMS = REGISTRY.histogram(
+    "triage_microbatch_items",
+    "Elementi (testi o coppie query-documento) per batch eseguito.",
+    ("batcher",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+BATCH_REQUESTS = REGISTRY.histogram(
+    "triage_microbatch_requests",
+    "Richieste concorrenti unite in un batch.",
+    ("batcher",),
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32),
+)
+BATCH_QUEUE_SECONDS = REGISTRY.histogram(
+    "triage_microbatch_queue_seconds",
+    "Attesa di una richiesta prima dell'esecuzione del suo batch.",
+    ("batcher",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class _Request:
+    __slots__ = ("items", "enqueued_at", "event", "result", "error")
+
+    def __init__(self, items: list):
+        self.items = items
+        self.enqueued_at = time.perf_counter()
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    def __init__(self, fn: Callable[[list], Sequence], name: str, max_batch_size: int, max_wait_ms: float):
+        """
+        Args:
+            fn: Funzione batch (lista di input -> risultati nello stesso ordine, lista o array).
+            name: Etichetta delle metriche (es. "embed", "rerank").
+            max_batch_size: Elementi massimi per batch (una richiesta più grande viene eseguita da sola).
+            max_wait_ms: Attesa massima, dopo la prima richiesta, per raccoglierne altre.
+        """
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._carry: Optional[_Request] = None  # Richiesta che non entrava nel batch precedente
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"microbatch-{self.name}", daemon=True)
+                    self._thread.start()
+
+    def submit(self, items: Sequence) -> Sequence:
+        """Accoda gli input e attende i rispettivi risultati (stesso ordine)."""
+        if len(items) == 0:
+            return []
+        self._ensure_started()
+        request = _Request(list(items))
+        self._queue.put(request)
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_Request]:
+        first = self._carry or self._queue.get()
+        self._carry = None
+        batch, size = [first], len(first.items)
+        deadline = time.perf_counter() + self.max_wait_s
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request.items) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for request in batch for item in request.items]
+            started = time.perf_counter()
+            for request in batch:
+                BATCH_QUEUE_SECONDS.observe(started - request.enqueued_at, batcher=self.name)
+            BATCH_ITEMS.observe(len(items), batcher=self.name)
+            BATCH_REQUESTS.observe(len(batch), batcher=self.name)
+
+            try:
+                results = self.fn(items)
+                offset = 0
+                for request in batch:
+                    request.result = results[offset:offset + len(request.items)]
+                    offset += len(request.items)
+            except BaseException as e:
+                logger.error(f"MicroBatcher '{self.name}': errore su un batch di {len(items)} elementi: {e}")
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.event.set()
@@ -0,0 +1,215 @@
+"""
+Processo che possiede embedder e reranker, condiviso da tutti i worker di uvicorn.
+
+Senza server ogni worker carica la propria copia dei pesi; con il server una sola
+copia serve tutti i worker, che comunicano su un socket Unix tramite
+`ModelServerClient` (stessa interfaccia di Embeddings LangChain e CrossEncoder.predict).
+
+Avvio (prima di uvicorn):
+    python -m app.logic.model_server
+e in app/config.py: MODEL_SERVER_SOCKET = "/tmp/neurosymbolic-models/models.sock"
+
+Sicurezza: il socket viene creato in una cartella 0700 con umask restrittiva (nessuna
+finestra in cui un altro utente può connettersi) e ogni connessione deve superare
+l'handshake HMAC con la chiave condivisa (vedi MODEL_SERVER_AUTHKEY_ENV) prima che
+il server legga un messaggio.
+"""
+import os
+import secrets
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import (
+    EMBEDDING_MODEL, RERANKER_MODEL, MODEL_SERVER_SOCKET, MODEL_SERVER_AUTHKEY_ENV,
+    MICRO_BATCH_MAX_WAIT_MS, EMBED_BATCH_MAX_SIZE, RERANK_BATCH_MAX_SIZE
+)
+from app.logger import get_rag_logger
+from app.logic.micro_batcher import MicroBatcher
+
+# Logger per questo modulo
+logger = get_rag_logger()
+
+DEFAULT_SOCKET = "/tmp/neurosymbolic-models/models.sock"
+AUTHKEY_FILE = "authkey"  # Nella cartella del socket, se la chiave non arriva dall'ambiente
+
+
+def _private_dir(socket_path: str) -> str:
+    """Cartella del socket, creata 0700; rifiuta cartelle di altri utenti o accessibili a gruppo/altri."""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"La cartella del socket {directory} appartiene a un altro utente.")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+
+def _authkey(socket_path: str, create: bool = False) -> bytes:
+    """Chiave HMAC: dalla variabile d'ambiente, altrimenti dal file accanto al socket (generato dal server)."""
+    key = os.environ.get(MODEL_SERVER_AUTHKEY_ENV)
+    if key:
+        return key.encode("utf-8")
+    path = os.path.join(os.path.dirname(os.path.abspath(socket_path)), AUTHKEY_FILE)
+    if create:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(path, "r") as f:
+        return f.read().strip().encode("utf-8")
+
+
+class ModelServer:
+    def __init__(self, socket_path: str = DEFAULT_SOCKET):
+        from app.logic.inference_backend import SentenceTransformerEmbeddings, load_sentence_transformer, load_cross_encoder
+
+        self.socket_path = socket_path
+        self.embedder = SentenceTransformerEmbeddings(load_sentence_transformer(EMBEDDING_MODEL))
+        self.reranker = load_cross_encoder(RERANKER_MODEL)
+        # Un solo thread per modello esegue i batch: le richieste concorrenti dei worker
+        # vengono unite (i modelli usano già più thread internamente)
+        self._embed_batcher = MicroBatcher(self.embedder.embed_documents, "embed",
+                                           EMBED_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS)
+        self._rerank_batcher = MicroBatcher(
+            lambda pairs: self.reranker.predict(pairs, batch_size=RERANK_BATCH_MAX_SIZE, show_progress_bar=False),
+            "rerank", RERANK_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS
+        )
+        self.started_at = time.time()
+        self.requests = 0
+
+    def _handle(self, request: tuple):
+        op = request[0]
+        self.requests += 1
+        if op == "embed":
+            return np.asarray(self._embed_batcher.submit(request[1]), dtype=np.float32)
+        if op == "rerank":
+            return np.asarray(self._rerank_batcher.submit(request[1]), dtype=np.float32)
+        if op == "ping":
+            return {"embedding_model": EMBEDDING_MODEL, "reranker_model": RERANKER_MODEL,
+                    "pid": os.getpid(), "uptime_s": round(time.time() - self.started_at, 1), "requests": self.requests}
+        raise ValueError(f"Operazione sconosciuta: {op}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return  # Il worker ha chiuso la connessione
+                try:
+                    conn.send(("ok", self._handle(request)))
+                except Exception as e:
+                    logger.error(f"ModelServer: errore su '{request[0]}': {e}")
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def serve_forever(self):
+        _private_dir(self.socket_path)
+        authkey = _authkey(self.socket_path, create=not os.environ.get(MODEL_SERVER_AUTHKEY_ENV))
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Socket rimasto da un'esecuzione precedente
+        # Socket 0600 già al bind (nessuna finestra prima di un chmod)
+        previous_umask = os.umask(0o177)
+        try:
+            listener = Listener(self.socket_path, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        with listener:
+            logger.info(f"ModelServer in ascolto su {self.socket_path} (pid {os.getpid()}).")
+            while True:
+                try:
+                    conn = listener.accept()  # Handshake HMAC: senza la chiave la connessione viene rifiutata
+                except (AuthenticationError, EOFError, OSError) as e:
+                    logger.warning(f"ModelServer: connessione rifiutata ({e}).")
+                    continue
+                # Una connessione persistente per thread del worker
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+class ModelServerClient:
+    """
+    Client sottile verso il ModelServer. Ogni thread del worker usa la propria
+    connessione persistente; in caso di errore di rete si riconnette una volta.
+    Espone embed_query/embed_documents (Embeddings) e predict (CrossEncoder).
+    """
+    def __init__(self, socket_path: str, timeout: float = 120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=_authkey(self.socket_path))
+            self._local.conn = conn
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+            self._local.conn = None
+
+    def _call(self, *request):
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(request)
+                if not conn.poll(self.timeout):
+                    raise TimeoutError(f"ModelServer non ha risposto entro {self.timeout}s")
+                status, payload = conn.recv()
+                break
+            except TimeoutError:
+                # Prima di OSError (ne è sottoclasse): un timeout non va ritentato
+                self._close()  # La risposta in ritardo non deve finire alla richiesta successiva
+                raise
+            except (EOFError, OSError) as e:
+                self._close()
+                if attempt == 1:
+                    raise ConnectionError(f"ModelServer non raggiungibile su {self.socket_path}: {e}")
+        if status == "error":
+            raise RuntimeError(f"ModelServer: {payload}")
+        return payload
+
+    def ping(self) -> dict:
+        return self._call("ping")
+
+    # --- Interfaccia Embeddings (LangChain) ---
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call("embed", list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    # --- Interfaccia CrossEncoder ---
+    def predict(self, pairs, **kwargs) -> np.ndarray:
+        return self._call("rerank", [tuple(p) for p in pairs])
+
+
+_client: Optional[ModelServerClient] = None
+
+
+def get_model_server_client() -> Optional[ModelServerClient]:
+    """Client condiviso se MODEL_SERVER_SOCKET è configurato, altrimenti None (modelli in-process)."""
+    global _client
+    if MODEL_SERVER_SOCKET and _client is None:
+        _client = ModelServerClient(MODEL_SERVER_SOCKET)
+    return _client
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Server condiviso di embedding e reranking per i worker dell'API.")
+    parser.add_argument("--socket", type=str, default=MODEL_SERVER_SOCKET or DEFAULT_SOCKET, help="Percorso del socket Unix.")
+    args = parser.parse_args()
+
+    ModelServer(args.socket).serve_forever()
@@ -0,0 +1,114 @@
+"""
+Modello per fase della pipeline (tiering) con escalation al modello grande.
+
+Estrazione dei dati e routing sono compiti di classificazione/estrazione in JSON
+vincolato: un modello da 1-3B li risolve con una frazione della latenza di
+llama3:8b. STAGE_MODELS (app/config.py) sceglie il modello di ogni fase; per le
+fasi in ESCALATION_STAGES un output non valido (o un modello non installato su
+Ollama) viene rigenerato con ESCALATION_MODEL.
+
+Per fase e tier (primary|escalation) vengono registrate latenza ed esiti: il tasso
+di escalation dice se il modello piccolo è adatto (su /metrics e /debug/llm-stats).
+"""
+import threading
+from typing import Dict, Optional, Set
+
+from app.config import LLM_MODEL, STAGE_MODELS, ESCALATION_MODEL, ESCALATION_STAGES
+from app.logger import get_agent_logger
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+TIER_CALLS = REGISTRY.counter(
+    "triage_model_tier_total",
+    "Chiamate per fase e tier (primary|escalation) ed esito (ok|escalated|failed).",
+    ("stage", "tier", "model", "outcome"),
+)
+TIER_SECONDS = REGISTRY.histogram(
+    "triage_model_tier_seconds",
+    "Latenza (generazione + validazione) per fase e tier.",
+    ("stage", "tier", "model"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0),
+)
+
+# Nome dell'agente (llm_client / structured_output) -> fase di STAGE_MODELS
+AGENT_STAGES = {
+    "assistant": "extraction",
+    "router": "routing",
+    "image_analyzer": "vision",
+}
+
+_unavailable: Set[str] = set()  # Modelli che Ollama non ha (404): si passa subito all'escalation
+_lock = threading.Lock()
+_stats: Dict[tuple, Dict[str, float]] = {}  # (stage, tier, model) -> contatori e secondi
+
+
+def stage_of(agent: str) -> str:
+    return AGENT_STAGES.get(agent, agent)
+
+
+def model_for(stage: str) -> str:
+    """Modello configurato per la fase (default LLM_MODEL)."""
+    return STAGE_MODELS.get(stage, LLM_MODEL)
+
+
+def escalation_for(stage: str) -> Optional[str]:
+    """Modello di escalation della fase, o None se la fase non ne ha (o usa già quel modello)."""
+    if stage not in ESCALATION_STAGES or model_for(stage) == ESCALATION_MODEL:
+        return None
+    return ESCALATION_MODEL
+
+
+def is_unavailable(model: str) -> bool:
+    return model in _unavailable
+
+
+def mark_unavailable(model: str):
+    with _lock:
+        if model in _unavailable:
+            return
+        _unavailable.add(model)
+    logger.warning(f"Modello '{model}' non disponibile su Ollama: le sue fasi passano al modello di escalation "
+                   f"(installarlo con `ollama pull {model}`).")
+
+
+def is_model_missing(error: Exception) -> bool:
+    """Errore di Ollama per modello non installato."""
+    return getattr(error, "status_code", None) == 404
+
+
+def record(stage: str, tier: str, model: str, seconds: float, outcome: str):
+    """Registra una chiamata di un tier: outcome ok | escalated (output non valido, si passa al tier successivo) | failed."""
+    TIER_CALLS.inc(stage=stage, tier=tier, model=model, outcome=outcome)
+    TIER_SECONDS.observe(seconds, stage=stage, tier=tier, model=model)
+    with _lock:
+        totals = _stats.setdefault((stage, tier, model), {"calls": 0, "ok": 0, "escalated": 0, "failed": 0,
+                                                          "seconds": 0.0})
+        totals["calls"] += 1
+        totals[outcome] += 1
+        totals["seconds"] += seconds
+
+
+def summary() -> dict:
+    """Per fase: modelli, latenza media per tier e tasso di escalation."""
+    with _lock:
+        items = [(key, dict(values)) for key, values in _stats.items()]
+    stages: Dict[str, dict] = {}
+    for (stage, tier, model), v in items:
+        entry = stages.setdefault(stage, {"model": model_for(stage), "escalation_model": escalation_for(stage),
+                                          "tiers": {}})
+        entry["tiers"][tier] = {
+            "model": model,
+            "calls": v["calls"],
+            "ok": v["ok"],
+            "escalated": v["escalated"],
+            "failed": v["failed"],
+            "avg_seconds": round(v["seconds"] / v["calls"], 3) if v["calls"] else None,
+        }
+    for entry in stages.values():
+        primary = entry["tiers"].get("primary")
+        entry["escalation_rate"] = (
+            round(primary["escalated"] / primary["calls"], 3) if primary and primary["calls"] else None
+        )
+    return {"stages": stages, "unavailable_models": sorted(_unavailable)}
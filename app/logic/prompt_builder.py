@@ -0,0 +1,214 @@
+"""
+Costruzione dei prompt a budget di token.
+
+Ogni prompt è composto da sezioni con priorità: il testo base dell'agente è
+obbligatorio, i blocchi variabili (dati paziente, vincoli, domande già fatte,
+chunk del RAG) hanno un tetto proprio e, se il totale supera il budget, vengono
+accorciati partendo dalla priorità più bassa. Da dimensione del prompt e risposta
+attesa si ricava `num_ctx` per Ollama: niente troncamento silenzioso al contesto
+di default, niente KV cache sovradimensionata.
+
+Il conteggio usa il tokenizer del modello se PROMPT_TOKENIZER_FILE punta a un
+tokenizer.json (libreria `tokenizers`), altrimenti una stima prudente in caratteri.
+"""
+import json
+import math
+import threading
+from typing import Any, List, Optional, Sequence
+
+from app.config import (
+    LLM_MODEL, PROMPT_TOKENIZER_FILE, PROMPT_CHARS_PER_TOKEN, PROMPT_MAX_TOKENS,
+    NUM_CTX_BUCKETS, NUM_CTX_STICKY, RESPONSE_RESERVE_TOKENS
+)
+from app.logger import get_agent_logger
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+REQUIRED = math.inf  # Sezioni mai accorciate
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "triage_prompt_tokens",
+    "Token del prompt assemblato (sistema + messaggi) per agente.",
+    ("agent",),
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000),
+)
+PROMPT_TRIMMED = REGISTRY.counter(
+    "triage_prompt_trimmed_total",
+    "Sezioni di prompt accorciate per rispettare tetto o budget.",
+    ("agent", "section"),
+)
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    global _tokenizer
+    if PROMPT_TOKENIZER_FILE and _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from tokenizers import Tokenizer
+                    _tokenizer = Tokenizer.from_file(PROMPT_TOKENIZER_FILE)
+                except Exception as e:
+                    logger.warning(f"Tokenizer '{PROMPT_TOKENIZER_FILE}' non disponibile ({e}): uso la stima in caratteri.")
+                    _tokenizer = False
+    return _tokenizer or None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: Sequence[dict]) -> int:
+    """Token di una lista di messaggi chat (contenuto + intestazioni del template, circa 4 per messaggio)."""
+    return sum(count_tokens(str(m.get("content", ""))) + 4 for m in messages)
+
+
+def compact_json(data: Any) -> str:
+    """JSON senza indentazione né spazi e senza campi vuoti: stessa informazione, meno token."""
+    def prune(value):
+        if isinstance(value, dict):
+            return {k: prune(v) for k, v in value.items() if v not in (None, "", [], {})}
+        if isinstance(value, list):
+            return [prune(v) for v in value]
+        return value
+    return json.dumps(prune(data), ensure_ascii=False, separators=(",", ":"))
+
+
+# Ultimo num_ctx usato per modello (vedi NUM_CTX_STICKY)
+_ctx_in_use = {}
+_ctx_lock = threading.Lock()
+
+
+def num_ctx_for(prompt_tokens: int, response_tokens: int = RESPONSE_RESERVE_TOKENS, model: str = LLM_MODEL) -> int:
+    """
+    Il più piccolo contesto di NUM_CTX_BUCKETS che contiene prompt e risposta.
+    Ollama ricarica il modello quando num_ctx cambia: pochi valori fissi e, con
+    NUM_CTX_STICKY, un modello non scende più sotto il contesto già allocato.
+    """
+    needed = prompt_tokens + response_tokens
+    num_ctx = next((bucket for bucket in NUM_CTX_BUCKETS if needed <= bucket), NUM_CTX_BUCKETS[-1])
+    if NUM_CTX_STICKY:
+        with _ctx_lock:
+            num_ctx = max(num_ctx, _ctx_in_use.get(model, 0))
+            _ctx_in_use[model] = num_ctx
+    return num_ctx
+
+
+def _truncate_text(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = int(len(text) * max_tokens / count_tokens(text))
+    while cut > 0 and count_tokens(text[:cut] + " [...]") > max_tokens:
+        cut = int(cut * 0.9)
+    return text[:cut] + " [...]" if cut > 0 else ""
+
+
+class _Section:
+    def __init__(self, name: str, priority: float, max_tokens: Optional[int], text: str = "",
+                 items: Optional[List[str]] = None, header: str = "", footer: str = "",
+                 separator: str = "\n", keep: str = "head"):
+        self.name = name
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.text = text
+        self.items = items
+        self.header = header
+        self.footer = footer
+        self.separator = separator
+        self.keep = keep
+
+    def render(self) -> str:
+        if self.items is None:
+            return self.text
+        if not self.items:
+            return ""
+        return self.header + self.separator.join(self.items) + self.footer
+
+    def tokens(self) -> int:
+        return count_tokens(self.render())
+
+    def trim_to(self, max_tokens: int) -> bool:
+        """Accorcia la sezione entro `max_tokens`; True se è stata modificata."""
+        if self.tokens() <= max_tokens:
+            return False
+        if self.items is None:
+            self.text = _truncate_text(self.text, max_tokens)
+            return True
+        # Elenchi: si tolgono elementi interi (i meno rilevanti in coda, o i più vecchi in testa)
+        while self.items and self.tokens() > max_tokens:
+            self.items.pop() if self.keep == "head" else self.items.pop(0)
+        return True
+
+
+class PromptBuilder:
+    """
+    Esempio:
+        builder = PromptBuilder("specialist_decision")
+        builder.add("instructions", base_prompt)
+        builder.add("patient_data", patient_context, priority=3, max_tokens=600)
+        builder.add_items("asked_questions", questions, priority=1, max_tokens=300, keep="tail")
+        system_prompt = builder.build(extra_tokens=count_message_tokens(history))
+        options = {"num_ctx": builder.num_ctx}
+    """
+    def __init__(self, agent: str, budget_tokens: int = PROMPT_MAX_TOKENS, model: str = LLM_MODEL):
+        self.agent = agent
+        self.model = model
+        self.budget_tokens = budget_tokens
+        self.sections: List[_Section] = []
+        self.prompt_tokens = 0
+        self.num_ctx = NUM_CTX_BUCKETS[0]
+
+    def add(self, name: str, text: str, priority: float = REQUIRED, max_tokens: Optional[int] = None) -> "PromptBuilder":
+        """Sezione di testo libero (accorciata in coda)."""
+        self.sections.append(_Section(name, priority, max_tokens, text=text or ""))
+        return self
+
+    def add_items(self, name: str, items: Sequence[str], priority: float, max_tokens: Optional[int] = None,
+                  header: str = "", footer: str = "", separator: str = "\n", keep: str = "head") -> "PromptBuilder":
+        """Sezione a elenco: si accorcia togliendo elementi interi (keep="head" tiene i primi, "tail" gli ultimi)."""
+        self.sections.append(_Section(name, priority, max_tokens, items=list(items), header=header,
+                                      footer=footer, separator=separator, keep=keep))
+        return self
+
+    def _trimmed(self, section: _Section):
+        PROMPT_TRIMMED.inc(agent=self.agent, section=section.name)
+        logger.debug("Prompt %s: sezione '%s' accorciata a %d token", self.agent, section.name, section.tokens())
+
+    def build(self, extra_tokens: int = 0, response_tokens: int = RESPONSE_RESERVE_TOKENS) -> str:
+        """
+        Applica tetti e budget e ritorna il testo (sezioni nell'ordine di inserimento).
+        Args:
+            extra_tokens: Token già occupati fuori da questo testo (es. messaggi della cronologia).
+            response_tokens: Token riservati alla risposta nel calcolo di num_ctx.
+        """
+        for section in self.sections:
+            if section.max_tokens is not None and section.trim_to(section.max_tokens):
+                self._trimmed(section)
+
+        total = extra_tokens + sum(s.tokens() for s in self.sections)
+        for section in sorted((s for s in self.sections if s.priority != REQUIRED), key=lambda s: s.priority):
+            if total <= self.budget_tokens:
+                break
+            before = section.tokens()
+            if section.trim_to(max(0, before - (total - self.budget_tokens))):
+                self._trimmed(section)
+                total -= before - section.tokens()
+        if total > self.budget_tokens:
+            logger.warning(f"Prompt {self.agent}: {total} token oltre il budget di {self.budget_tokens} "
+                           "anche dopo l'accorciamento delle sezioni opzionali.")
+
+        self.prompt_tokens = total
+        self.num_ctx = num_ctx_for(total, response_tokens, self.model)
+        PROMPT_TOKENS.observe(total, agent=self.agent)
+        return "".join(s.render() for s in self.sections)
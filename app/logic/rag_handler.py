@@ -1,47 +1,194 @@
-import ollama
 import json
 import os
+import logging
+import threading
 import numpy as np
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
-from sentence_transformers import CrossEncoder
-from app.config import EMBEDDING_MODEL, RERANKER_MODEL
+from pydantic import ValidationError
+from app.config import (
+    EMBEDDING_MODEL, RERANKER_MODEL,
+    MICRO_BATCHING_ENABLED, MICRO_BATCH_MAX_WAIT_MS, EMBED_BATCH_MAX_SIZE, RERANK_BATCH_MAX_SIZE,
+    RAG_CONTEXT_MAX_TOKENS, SINGLE_FLIGHT_ENABLED
+)
 from app.logger import get_rag_logger
+from app.metrics import span, record_outcome
+from app.logic.chunk_dedup import DUPLICATE_SOURCES_KEY, split_provenance
+from app.logic import structured_output, model_tiers
+from app.models import Condition, MedicalAnalysis
+from app.logic.inference_backend import SentenceTransformerEmbeddings, load_sentence_transformer, load_cross_encoder
+from app.logic.model_server import get_model_server_client
+from app.logic.micro_batcher import MicroBatcher
+from app.logic.prompt_builder import PromptBuilder, count_tokens
+from app.logic.single_flight import SingleFlight
 
 # Logger per questo modulo
 logger = get_rag_logger()
 
+# Documenti recuperati dalla ricerca vettoriale e tenuti dopo il reranking
+RETRIEVAL_K = 30
+RERANK_TOP_N = 10
+
+# Chiavi con cui llama3 incapsula a volte la risposta quando l'output non è vincolato dallo schema
+_WRAPPER_KEYS = ("analysis", "response", "result", "output")
+_ALT_CONDITION_KEYS = ("conditions", "diagnoses", "diseases")
+
+
+def _unwrap_analysis(data) -> dict:
+    """
+    Riparazione locale di una risposta non conforme a MedicalAnalysis (senza rigenerare):
+    toglie i wrapper, accetta la lista nuda o chiavi simili e scarta le condizioni non valide.
+    """
+    if isinstance(data, str):
+        # Stringa che contiene JSON (a volte dentro un blocco markdown)
+        data = json.loads(data.replace("```json", "").replace("```", "").strip())
+    if isinstance(data, list):
+        data = {"potential_conditions": data}
+    if not isinstance(data, dict):
+        raise ValueError(f"Risposta di tipo {type(data).__name__} invece di un oggetto JSON")
+
+    if "potential_conditions" not in data:
+        for key in _WRAPPER_KEYS:
+            if key in data:
+                return _unwrap_analysis(data[key])
+        for key in _ALT_CONDITION_KEYS:
+            if isinstance(data.get(key), list):
+                data = {"potential_conditions": data[key]}
+                break
+
+    conditions = data.get("potential_conditions")
+    if not isinstance(conditions, list):
+        raise ValueError(f"Valid JSON but wrong structure. Keys: {list(data.keys())}")
+
+    cleaned = []
+    for item in conditions:
+        try:
+            cleaned.append(Condition.model_validate(item).model_dump())
+        except ValidationError:
+            pass
+    if len(cleaned) < len(conditions):
+        logger.warning(f"Rimossi {len(conditions) - len(cleaned)} elementi non validi da potential_conditions")
+    return {"potential_conditions": cleaned}
+
+# langchain, sentence_transformers/torch (o onnxruntime) e chromadb vengono importati solo quando
+# servono davvero: importare app.main resta veloce (reload, test, avvio dei worker).
+
+class LazyEmbeddings:
+    """
+    Embeddings LangChain (embed_query/embed_documents) costruiti al primo uso.
+    Si può passare subito a Chroma e al VectorRouter: il modello viene caricato
+    solo alla prima richiesta di embedding (o da `load()` nel warm-up).
+    Con MICRO_BATCHING_ENABLED le query concorrenti vengono unite in un solo batch
+    (non con il model server, che raggruppa già le richieste di tutti i worker).
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self._batcher = MicroBatcher(lambda texts: self.load().embed_documents(texts), "embed",
+                                     EMBED_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    client = get_model_server_client()
+                    if client:
+                        logger.info(f"Embedder servito dal model server ({client.socket_path}).")
+                        self._model = client
+                    else:
+                        logger.info(f"Caricamento Embedder ({self.model_name})...")
+                        self._model = SentenceTransformerEmbeddings(load_sentence_transformer(self.model_name))
+        return self._model
+
+    def _use_batcher(self, count: int) -> bool:
+        # Le liste lunghe (indicizzazione, prototipi del router) sono già un batch pieno
+        return MICRO_BATCHING_ENABLED and count <= EMBED_BATCH_MAX_SIZE and get_model_server_client() is None
+
+    def embed_query(self, text: str) -> list:
+        if self._use_batcher(1):
+            return self._batcher.submit([text])[0]
+        return self.load().embed_query(text)
+
+    def embed_documents(self, texts: list) -> list:
+        if self._use_batcher(len(texts)):
+            return list(self._batcher.submit(texts))
+        return self.load().embed_documents(texts)
+
+
 class RAGHandler:
     def __init__(self, base_db_path: str):
         """
-        Inizializza il gestore caricando embedding e reranker.
+        Inizializza il gestore. Embedding e reranker vengono caricati al primo uso
+        oppure in anticipo con `warmup()` (hook di avvio dell'applicazione).
         """
         logger.info("Inizializzazione RAG Handler...")
         self.BASE_DB_PATH = base_db_path 
         
         # Modello per la ricerca vettoriale (multilingue)
-        self.embedding_function = SentenceTransformerEmbeddings(
-            model_name=EMBEDDING_MODEL,
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        self.embedding_function = LazyEmbeddings(EMBEDDING_MODEL)
         
-        # Modello per il Reranking (multilingue IT/ES/PT/EN)
-        logger.info(f"Caricamento Reranker ({RERANKER_MODEL})...")
-        self.reranker = CrossEncoder(RERANKER_MODEL)
-        logger.info("Reranker caricato.")
+        # Modello per il Reranking (multilingue IT/ES/PT/EN), vedi proprietà `reranker`
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+        # Reranking concorrente di più sessioni in un solo batch (vedi app/logic/micro_batcher.py)
+        self._rerank_batcher = MicroBatcher(
+            lambda pairs: self.reranker.predict(pairs, batch_size=RERANK_BATCH_MAX_SIZE, show_progress_bar=False),
+            "rerank", RERANK_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS
+        )
         
         self.loaded_dbs = {}
+        # Prefetch, triage, /diagnose e batch sulla stessa query condividono un solo calcolo
+        self._retrieval_flight = SingleFlight("retrieval")
+        self._rag_flight = SingleFlight("rag", copy_result=True)
+
+    @property
+    def reranker(self):
+        """CrossEncoder costruito alla prima chiamata."""
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    client = get_model_server_client()
+                    if client:
+                        logger.info(f"Reranker servito dal model server ({client.socket_path}).")
+                        self._reranker = client
+                    else:
+                        logger.info(f"Caricamento Reranker ({RERANKER_MODEL})...")
+                        self._reranker = load_cross_encoder(RERANKER_MODEL)
+                        logger.info("Reranker caricato.")
+        return self._reranker
+
+    def warmup(self):
+        """Carica subito embedder e reranker (altrimenti caricati alla prima richiesta)."""
+        self.embedding_function.load()
+        _ = self.reranker
+        client = get_model_server_client()
+        if client:
+            logger.info(f"Model server raggiungibile: {client.ping()}")
+
+    def _resolve_db_path(self, specialty: str) -> str:
+        """Trova la cartella del DB ignorando maiuscole/minuscole (le cartelle sono capitalizzate)."""
+        db_path = os.path.join(self.BASE_DB_PATH, specialty)
+        if os.path.isdir(db_path) or not os.path.isdir(self.BASE_DB_PATH):
+            return db_path
+        for folder in os.listdir(self.BASE_DB_PATH):
+            if folder.lower() == specialty:
+                return os.path.join(self.BASE_DB_PATH, folder)
+        return db_path
 
     def _load_db(self, specialty: str):
         """Carica il DB vettoriale per una data specializzazione (se non già caricato)."""
         specialty = specialty.lower()
         if specialty not in self.loaded_dbs:
-            db_path = os.path.join(self.BASE_DB_PATH, specialty)
+            db_path = self._resolve_db_path(specialty)
             if not os.path.exists(db_path):
                 logger.warning(f"Database vettoriale per '{specialty}' non trovato in '{db_path}'.")
                 return None
             try:
                 logger.info(f"Caricamento database vettoriale per '{specialty}'...")
+                from langchain_chroma import Chroma
                 self.loaded_dbs[specialty] = Chroma(persist_directory=db_path, embedding_function=self.embedding_function)
                 logger.info(f"Database per '{specialty}' caricato.")
             except Exception as e:
@@ -49,57 +196,115 @@ class RAGHandler:
                 return None
         return self.loaded_dbs[specialty]
 
-    def get_potential_conditions(self, symptoms_query: str, specialty: str) -> dict:
+    def retrieve(self, symptoms_query: str, specialty: str, k: int = RETRIEVAL_K) -> list:
         """
-        Esegue la ricerca RAG nel DB con RERANKING.
+        FASE 1: RETRIEVAL (Setaccio Largo).
+        Recuperiamo più documenti per poi filtrarli con il reranker. Ritorna [(doc, distanza)].
+        L'embedding della query è calcolato a parte per misurarlo separatamente dalla ricerca.
         """
         db = self._load_db(specialty)
         if not db:
-             return {"error": f"Database per la specializzazione '{specialty}' non disponibile."}
+            return []
+        with span("embedding", specialty):
+            query_embedding = self.embedding_function.embed_query(symptoms_query)
+        with span("vector_search", specialty):
+            return db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
 
-        logger.info(f"Ricerca Vettoriale in '{specialty}' per: '{symptoms_query}'")
-        
-        try:
-            # --- FASE 1: RETRIEVAL (Setaccio Largo) ---
-            # Recuperiamo più documenti per poi filtrarli con il reranker
-            initial_docs = db.similarity_search_with_relevance_scores(symptoms_query, k=30)
-            
-            if not initial_docs:
-                logger.info("Nessun documento trovato nella fase vettoriale.")
-                return {"potential_conditions": []}
-
-            # --- FASE 2: RERANKING (Filtro di Precisione) ---
-            # Il reranker multilingue assegna un punteggio di rilevanza query-documento
-            pairs = [(symptoms_query, doc.page_content) for doc, _ in initial_docs]
-            rerank_scores = self.reranker.predict(pairs)
-            
-            # Ordina per score decrescente e prendi i top 10
-            ranked_indices = np.argsort(rerank_scores)[::-1][:10]
-            reranked_docs = [initial_docs[i][0] for i in ranked_indices]
-            rerank_scores_sorted = [rerank_scores[i] for i in ranked_indices]
-
-            logger.info(f"Top {len(reranked_docs)} documenti selezionati (Reranker attivo).")
-            
-            # --- DEBUG LOGGING ---
+    def rerank(self, symptoms_query: str, initial_docs: list, top_n: int = RERANK_TOP_N, specialty: str = "") -> list:
+        """
+        FASE 2: RERANKING (Filtro di Precisione).
+        Il reranker multilingue assegna un punteggio di rilevanza query-documento.
+        Ritorna i migliori `top_n` come [(doc, rerank_score)] in ordine decrescente.
+        """
+        if not initial_docs:
+            return []
+        pairs = [(symptoms_query, doc.page_content) for doc, _ in initial_docs]
+        with span("rerank", specialty):
+            if MICRO_BATCHING_ENABLED and get_model_server_client() is None:
+                rerank_scores = self._rerank_batcher.submit(pairs)
+            else:
+                rerank_scores = self.reranker.predict(pairs)
+
+        # Ordina per score decrescente e prendi i top N
+        ranked_indices = np.argsort(rerank_scores)[::-1][:top_n]
+        reranked = [(initial_docs[i][0], rerank_scores[i]) for i in ranked_indices]
+
+        logger.info(f"Top {len(reranked)} documenti selezionati (Reranker attivo).")
+
+        # --- DEBUG LOGGING ---
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug("DOCUMENTI DOPO RERANKING (TOP 5):")
-            for i in range(min(5, len(reranked_docs))):
-                doc = reranked_docs[i]
-                score = rerank_scores_sorted[i]
+            for i, (doc, score) in enumerate(reranked[:5]):
                 source = doc.metadata.get("source", "N/A")
                 logger.debug(f"[{i+1}] RerankerScore: {score:.4f} | File: {os.path.basename(source)}")
+        return reranked
+
+    def retrieve_and_rerank(self, symptoms_query: str, specialty: str, k: int = RETRIEVAL_K,
+                            top_n: int = RERANK_TOP_N) -> list:
+        """
+        FASI 1 e 2: candidati [(doc, rerank_score)] per la query (usato anche dal prefetch).
+        `k` e `top_n` più bassi riducono il lavoro del reranker (modalità degradata, vedi app/logic/degradation.py).
+        """
+        if SINGLE_FLIGHT_ENABLED:
+            return self._retrieval_flight.do((specialty.lower(), symptoms_query, k, top_n), self._retrieve_and_rerank,
+                                             symptoms_query, specialty, k, top_n)
+        return self._retrieve_and_rerank(symptoms_query, specialty, k, top_n)
 
-            # Costruzione del contesto finale
-            context = "\n\n---\n\n".join([d.page_content for d in reranked_docs])
-            sources = list(set(d.metadata.get("source", "N/A") for d in reranked_docs))
+    def _retrieve_and_rerank(self, symptoms_query: str, specialty: str, k: int = RETRIEVAL_K,
+                             top_n: int = RERANK_TOP_N) -> list:
+        initial_docs = self.retrieve(symptoms_query, specialty, k=k)
+        if not initial_docs:
+            logger.info("Nessun documento trovato nella fase vettoriale.")
+            return []
+        return self.rerank(symptoms_query, initial_docs, top_n=top_n, specialty=specialty)
+
+    def get_potential_conditions(self, symptoms_query: str, specialty: str, reranked: list = None,
+                                 k: int = RETRIEVAL_K, top_n: int = RERANK_TOP_N) -> dict:
+        """
+        Esegue la ricerca RAG nel DB con RERANKING.
+        Se `reranked` è passato (prefetch già eseguito per questa query) resta solo la generazione
+        sui primi `top_n` documenti.
+        """
+        if reranked is None and SINGLE_FLIGHT_ENABLED:
+            return self._rag_flight.do((specialty.lower(), symptoms_query, k, top_n), self._get_potential_conditions,
+                                       symptoms_query, specialty, None, k, top_n)
+        return self._get_potential_conditions(symptoms_query, specialty, reranked, k, top_n)
+
+    def _get_potential_conditions(self, symptoms_query: str, specialty: str, reranked: list = None,
+                                  k: int = RETRIEVAL_K, top_n: int = RERANK_TOP_N) -> dict:
+        db = self._load_db(specialty)
+        if not db:
+             return {"error": f"Database per la specializzazione '{specialty}' non disponibile."}
+
+        if reranked is None:
+            logger.info(f"Ricerca Vettoriale in '{specialty}' per: '{symptoms_query}'")
+            try:
+                reranked = self.retrieve_and_rerank(symptoms_query, specialty, k, top_n)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                logger.error(f"Errore CRITICO durante la ricerca '{specialty}': {e}")
+                return {"error": f"Errore RAG: {e}"}
+        else:
+            reranked = reranked[:top_n]
+            logger.info(f"Uso i {len(reranked)} documenti del prefetch RAG per '{specialty}'.")
+
+        if not reranked:
+            return {"potential_conditions": []}
+
+        return self.generate(symptoms_query, specialty, [doc for doc, _ in reranked])
+
+    def generate(self, symptoms_query: str, specialty: str, reranked_docs: list) -> dict:
+        """
+        FASE 3: GENERAZIONE LLM sui documenti selezionati dal reranker.
+        """
+        # Include anche i file dei chunk duplicati collassati in fase di ingestione
+        sources = set()
+        for d in reranked_docs:
+            sources.add(d.metadata.get("source", "N/A"))
+            sources.update(split_provenance(d.metadata.get(DUPLICATE_SOURCES_KEY)))
+        sources = list(sources)
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            logger.error(f"Errore CRITICO durante la ricerca '{specialty}': {e}")
-            return {"error": f"Errore RAG: {e}"}
-        
-        # --- FASE 3: GENERAZIONE LLM (Invariata) ---
-        
         system_prompt = f"""
         You are an expert medical analyst in the specialty '{specialty.upper()}'. 
         Analyze the USER SYMPTOMS and the MEDICAL CONTEXT (from scientific documents) to formulate hypotheses.
@@ -161,105 +366,48 @@ class RAGHandler:
                 }}
             ]
         }}
-
-        MEDICAL CONTEXT ({specialty.upper()}):
-        ---
-        {context}
-        ---
         """
-        
-        user_prompt = f"ANALYZE THE FOLLOWING SYMPTOMS AND IDENTIFY COMPATIBLE PATHOLOGIES: {symptoms_query}"
 
-        # --- RETRY LOOP ---
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"LLM Request (Tentativo {attempt+1}/{max_retries})...")
-                response = ollama.chat(
-                    model='llama3:8b',
+        # --- PREFISSO STABILE + BUDGET DEL PROMPT ---
+        # Il prompt di sistema dipende solo dalla specialità (prefisso riusabile dalla KV cache di Ollama);
+        # chunk e sintomi vanno nel messaggio utente. I chunk sono in ordine di rilevanza:
+        # se non entrano nel budget si tolgono gli ultimi.
+        builder = PromptBuilder("rag", model=model_tiers.model_for("rag"))
+        builder.add_items("medical_context", [d.page_content for d in reranked_docs], priority=1,
+                          max_tokens=RAG_CONTEXT_MAX_TOKENS, header=f"MEDICAL CONTEXT ({specialty.upper()}):\n---\n",
+                          footer="\n---\n\n", separator="\n\n---\n\n", keep="head")
+        builder.add("symptoms", f"ANALYZE THE FOLLOWING SYMPTOMS AND IDENTIFY COMPATIBLE PATHOLOGIES: {symptoms_query}")
+        user_prompt = builder.build(extra_tokens=count_tokens(system_prompt))
+
+        # --- GENERAZIONE STRUTTURATA ---
+        # Lo schema di MedicalAnalysis vincola l'output: niente wrapper da ripulire.
+        # La riparazione locale resta per i modelli/server che non rispettano lo schema.
+        try:
+            logger.info("LLM Request (output vincolato a MedicalAnalysis)...")
+            with span("llm_generation", specialty):
+                validated = structured_output.chat_structured(
+                    agent="rag",
+                    specialty=specialty,
+                    model=model_tiers.model_for("rag"),
+                    escalate_to=model_tiers.escalation_for("rag"),
                     messages=[{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_prompt}],
-                    options={'temperature': 0.1},
-                    format='json'
+                    output_model=MedicalAnalysis,
+                    max_attempts=2,
+                    repair=_unwrap_analysis,
+                    retry_hint=lambda e: f"PREVIOUS ERROR: You returned an invalid format ({e}). YOU MUST return ONLY a valid JSON with the key 'potential_conditions'.",
+                    options={'temperature': 0.1, 'num_ctx': builder.num_ctx}
                 )
-                # Gestione robusta del parsing JSON
-                content = response['message']['content']
-                
-                # A volte l'LLM include testo prima o dopo il JSON, cerchiamo le graffe
-                start = content.find('{')
-                end = content.rfind('}') + 1
-                if start != -1 and end != -1:
-                    analysis = json.loads(content[start:end])
-                else:
-                    analysis = json.loads(content)
-
-                # VALIDAZIONE SCHEMA
-                # Supporto per LLM che wrappano la risposta in "analysis" o "response"
-                if "potential_conditions" not in analysis:
-                    for key in ["analysis", "response", "result", "output"]:
-                        if key in analysis:
-                            content_to_check = analysis[key]
-                            
-                            # Caso 0: Il contenuto è una STRINGA che contiene JSON (es. "{\"potential_conditions\": ...}")
-                            if isinstance(content_to_check, str):
-                                try:
-                                    # Tentiamo di pulire la stringa da eventuali markdown
-                                    clean_str = content_to_check.replace("```json", "").replace("```", "").strip()
-                                    parsed_inner = json.loads(clean_str)
-                                    if isinstance(parsed_inner, dict) and "potential_conditions" in parsed_inner:
-                                        analysis = parsed_inner
-                                        break
-                                    elif isinstance(parsed_inner, list):
-                                        analysis = {"potential_conditions": parsed_inner}
-                                        break
-                                except:
-                                    # If JSON parsing fails, it might be a conversational string (Summary)
-                                    # Raise exception to trigger retry
-                                    raise ValueError(f"LLM returned a string instead of JSON: {content_to_check[:50]}...")
-
-                            # Caso 1: Wrapper contiene un altro oggetto con "potential_conditions"
-                            if isinstance(content_to_check, dict):
-                                if "potential_conditions" in content_to_check:
-                                    analysis = content_to_check
-                                    break
-                                # Fallback per chiavi simili (es. "conditions", "diagnoses")
-                                for alt_key in ["conditions", "diagnoses", "diseases"]:
-                                    if alt_key in content_to_check and isinstance(content_to_check[alt_key], list):
-                                        analysis = {"potential_conditions": content_to_check[alt_key]}
-                                        break
-                            
-                            # Caso 2: Wrapper contiene DIRETTAMENTE la lista
-                            elif isinstance(content_to_check, list):
-                                analysis = {"potential_conditions": content_to_check}
-                                break
-                
-                if "potential_conditions" not in analysis or not isinstance(analysis["potential_conditions"], list):
-                    # If we are here, JSON is valid but structure is wrong.
-                    # We can try to retry if it's the first attempt
-                    if attempt < max_retries - 1:
-                         raise ValueError(f"Valid JSON but wrong structure. Keys: {list(analysis.keys())}")
-                    
-                    logger.warning(f"Invalid LLM JSON Format. Keys: {list(analysis.keys())}")
-                    logger.debug(f"Received content: {analysis}")
-                    analysis = {"potential_conditions": []}
-
-                # PULIZIA: Rimuovi elementi non-dict dalla lista (es. stringhe spurie)
-                if "potential_conditions" in analysis and isinstance(analysis["potential_conditions"], list):
-                    cleaned_conditions = [
-                        item for item in analysis["potential_conditions"]
-                        if isinstance(item, dict) and "condition" in item
-                    ]
-                    if len(cleaned_conditions) < len(analysis["potential_conditions"]):
-                        logger.warning(f"Rimossi {len(analysis['potential_conditions']) - len(cleaned_conditions)} elementi non validi da potential_conditions")
-                    analysis["potential_conditions"] = cleaned_conditions
-
-                analysis["sources_consulted"] = sources
-                return analysis
-                
-            except Exception as e:
-                logger.warning(f"Error attempt {attempt+1}: {e}")
-                if attempt < max_retries - 1:
-                    # Add error message to user prompt for next attempt
-                    user_prompt += f"\n\nPREVIOUS ERROR: You returned an invalid format ({str(e)}). YOU MUST return ONLY a valid JSON with the key 'potential_conditions'."
-                else:
-                    logger.error(f"LLM Error for '{specialty}' after {max_retries} attempts.")
-                    return {"error": f"LLM Analysis Error: {e}", "potential_conditions": []}
\ No newline at end of file
+            analysis = validated.model_dump()
+
+        except structured_output.StructuredOutputError as e:
+            logger.warning(f"Invalid LLM JSON Format for '{specialty}': {e}")
+            record_outcome("rag_generation", "fallback", specialty)
+            analysis = {"potential_conditions": []}
+
+        except Exception as e:
+            logger.error(f"LLM Error for '{specialty}': {e}")
+            record_outcome("rag_generation", "fallback", specialty)
+            return {"error": f"LLM Analysis Error: {e}", "potential_conditions": []}
+
+        analysis["sources_consulted"] = sources
+        return analysis
@@ -0,0 +1,119 @@
+"""
+Prefetch speculativo del RAG (retrieval + reranking) per le sessioni già instradate.
+
+Appena il router sceglie uno specialista la query RAG è già nota (sintomi estratti
+dall'AssistantAgent o riassunto del router): retrieval e reranking partono in
+background mentre lo specialista fa le sue domande, e vengono ripetuti quando la
+query cambia (nuovi sintomi). Al turno di triage, se la query finale coincide con
+quella precaricata, resta da pagare solo la generazione.
+
+I candidati restano in memoria nel processo, per sessione (i Document non vanno
+nel file JSON della sessione). Con più worker un turno servito da un altro
+processo semplicemente non trova il prefetch ed esegue il RAG completo.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+from app.config import RAG_PREFETCH_WORKERS, RAG_PREFETCH_TTL_S, RAG_PREFETCH_WAIT_S
+from app.logger import get_rag_logger
+from app.logic.rag_handler import RETRIEVAL_K, RERANK_TOP_N
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_rag_logger()
+
+PREFETCH_EVENTS = REGISTRY.counter(
+    "triage_rag_prefetch_total",
+    "Prefetch RAG per esito (scheduled|reused|hit|miss|stale|error).",
+    ("specialty", "outcome"),
+)
+
+
+class _Entry:
+    __slots__ = ("specialty", "query", "top_n", "future", "created_at")
+
+    def __init__(self, specialty: str, query: str, top_n: int, future: Future):
+        self.specialty = specialty
+        self.query = query
+        self.top_n = top_n
+        self.future = future
+        self.created_at = time.monotonic()
+
+
+class RAGPrefetcher:
+    def __init__(self, rag_handler, max_workers: int = RAG_PREFETCH_WORKERS,
+                 ttl_s: float = RAG_PREFETCH_TTL_S, wait_s: float = RAG_PREFETCH_WAIT_S):
+        """
+        Args:
+            rag_handler: RAGHandler usato per retrieval e reranking.
+            max_workers: Prefetch eseguiti in parallelo (gli altri restano in coda).
+            ttl_s: Dopo quanto un prefetch non ritirato viene scartato.
+            wait_s: Attesa massima, al turno di triage, per un prefetch ancora in corso.
+        """
+        self.rag_handler = rag_handler
+        self.ttl_s = ttl_s
+        self.wait_s = wait_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-prefetch")
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, query: str, specialty: str, k: int, top_n: int) -> list:
+        return self.rag_handler.retrieve_and_rerank(query, specialty, k, top_n)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for session_id in [s for s, e in self._entries.items() if now - e.created_at > self.ttl_s]:
+            del self._entries[session_id]
+
+    def schedule(self, session_id: str, specialty: str, query: str, k: int = RETRIEVAL_K, top_n: int = RERANK_TOP_N):
+        """
+        Avvia (o aggiorna) il prefetch della sessione; no-op se la query non è cambiata
+        e il prefetch esistente è almeno profondo quanto `top_n`.
+        """
+        if not query:
+            return
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(session_id)
+            if entry and entry.specialty == specialty and entry.query == query and entry.top_n >= top_n:
+                PREFETCH_EVENTS.inc(specialty=specialty, outcome="reused")
+                return
+            future = self._executor.submit(self._run, query, specialty, k, top_n)
+            self._entries[session_id] = _Entry(specialty, query, top_n, future)
+        PREFETCH_EVENTS.inc(specialty=specialty, outcome="scheduled")
+        logger.info(f"Prefetch RAG avviato per '{specialty}' (sessione {session_id}).")
+
+    def take(self, session_id: str, specialty: str, query: str, top_n: int = RERANK_TOP_N) -> Optional[List[tuple]]:
+        """
+        Ritira i candidati [(doc, rerank_score)] precaricati per esattamente questa query.
+        Ritorna None se non ce ne sono o se il prefetch (fatto in modalità degradata) è
+        meno profondo di `top_n`: il chiamante esegue il RAG completo.
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None:
+            PREFETCH_EVENTS.inc(specialty=specialty, outcome="miss")
+            return None
+        if entry.specialty != specialty or entry.query != query or entry.top_n < top_n:
+            PREFETCH_EVENTS.inc(specialty=specialty, outcome="stale")
+            logger.info("Prefetch RAG non utilizzabile: la query finale è cambiata.")
+            return None
+        try:
+            reranked = entry.future.result(timeout=self.wait_s)
+        except FutureTimeoutError:
+            PREFETCH_EVENTS.inc(specialty=specialty, outcome="miss")
+            logger.warning(f"Prefetch RAG ancora in corso dopo {self.wait_s}s: eseguo il RAG completo.")
+            return None
+        except Exception as e:
+            PREFETCH_EVENTS.inc(specialty=specialty, outcome="error")
+            logger.warning(f"Prefetch RAG fallito ({e}): eseguo il RAG completo.")
+            return None
+        PREFETCH_EVENTS.inc(specialty=specialty, outcome="hit")
+        return reranked
+
+    def discard(self, session_id: str):
+        """Dimentica il prefetch di una sessione conclusa."""
+        with self._lock:
+            self._entries.pop(session_id, None)
@@ -3,6 +3,7 @@ import os
 from typing import Dict, Any
 from filelock import FileLock
 from app.logger import get_api_logger
+from app.metrics import timed
 
 # Logger per questo modulo
 logger = get_api_logger()
@@ -19,6 +20,7 @@ class SessionManager:
     def _get_lock_path(self, session_id: str) -> str:
         return os.path.join(self.sessions_dir, f"{session_id}.lock")
 
+    @timed("session_load")
     def load_session(self, session_id: str) -> Dict[str, Any]:
         """
         Carica lo stato della sessione da file con file locking.
@@ -49,6 +51,7 @@ class SessionManager:
             "asked_questions": [] 
         }
 
+    @timed("session_save")
     def save_session(self, session_id: str, data: Dict[str, Any]):
         """
         Salva lo stato della sessione su file con file locking.
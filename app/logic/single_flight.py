@@ -0,0 +1,124 @@
+"""
+Coalescenza di lavoro identico in corso (single-flight) e serializzazione per chiave.
+
+`SingleFlight.do(key, fn)`: se un'altra richiesta con la stessa chiave sta già
+eseguendo `fn`, si attende il suo risultato invece di ripetere il lavoro (retry
+del client dopo un timeout, doppio invio, /diagnose e batch che lanciano la stessa
+analisi). Le eccezioni del leader arrivano a tutti i chiamanti in attesa.
+Con `linger_s` il risultato resta disponibile per qualche secondo anche dopo la
+fine (un retry arrivato subito dopo la risposta riceve la stessa risposta).
+
+`KeyedLocks.hold(key)`: un lock per chiave (es. sessione), creato al primo uso e
+rimosso quando nessuno lo usa più. Serializza i turni della stessa sessione senza
+bloccare le altre.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Tuple
+
+from app.logger import get_agent_logger
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+SINGLE_FLIGHT = REGISTRY.counter(
+    "triage_single_flight_total",
+    "Esecuzioni per gruppo: leader (lavoro eseguito) o shared (risultato di un'esecuzione identica).",
+    ("group", "outcome"),
+)
+KEYED_LOCK_WAIT = REGISTRY.histogram(
+    "triage_keyed_lock_wait_seconds",
+    "Attesa per il lock della chiave (es. turno precedente della stessa sessione).",
+    ("group",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def make_key(*parts: Any) -> str:
+    """Chiave stabile (sha1) da parti serializzabili in JSON (dict ordinati per chiave)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, group: str, linger_s: float = 0.0, copy_result: bool = False):
+        """
+        Args:
+            group: Nome per metriche e log (es. "llm", "retrieval", "chat_turn").
+            linger_s: Per quanto un risultato completato resta condiviso (0 = solo durante l'esecuzione).
+            copy_result: Deep copy del risultato per i chiamanti in attesa (se il chiamante lo modifica).
+        """
+        self.group = group
+        self.linger_s = linger_s
+        self.copy_result = copy_result
+        self._calls: Dict[Hashable, Tuple[Future, float]] = {}  # chiave -> (future, fine o inf)
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Esegue `fn(*args, **kwargs)` oppure attende l'esecuzione identica già in corso."""
+        now = time.monotonic()
+        with self._lock:
+            if self.linger_s:
+                for expired in [k for k, (_, done_at) in self._calls.items() if now - done_at > self.linger_s]:
+                    del self._calls[expired]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                future: Future = Future()
+                self._calls[key] = (future, float("inf"))
+            else:
+                future = call[0]
+
+        if not leader:
+            SINGLE_FLIGHT.inc(group=self.group, outcome="shared")
+            logger.info(f"Single-flight '{self.group}': richiesta identica già in corso, ne condivido il risultato.")
+            result = future.result()
+            return copy.deepcopy(result) if self.copy_result else result
+
+        SINGLE_FLIGHT.inc(group=self.group, outcome="leader")
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            self._finish(key, failed=True)
+            raise
+        future.set_result(copy.deepcopy(result) if self.copy_result else result)
+        self._finish(key)
+        return result
+
+    def _finish(self, key: Hashable, failed: bool = False):
+        with self._lock:
+            if self.linger_s and not failed:
+                self._calls[key] = (self._calls[key][0], time.monotonic())
+            else:
+                self._calls.pop(key, None)
+
+
+class KeyedLocks:
+    def __init__(self, group: str):
+        self.group = group
+        self._locks: Dict[Hashable, list] = {}  # chiave -> [lock, utilizzatori]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable) -> Iterator[None]:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        start = time.perf_counter()
+        entry[0].acquire()
+        KEYED_LOCK_WAIT.observe(time.perf_counter() - start, group=self.group)
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
@@ -0,0 +1,159 @@
+"""
+Output strutturato degli LLM: lo JSON Schema del modello Pydantic atteso viene
+passato come `format` a Ollama, che vincola la generazione allo schema
+(niente chiavi wrapper, stringhe al posto di oggetti o campi mancanti).
+La risposta viene validata una sola volta.
+
+Se la validazione fallisce comunque (modello che ignora lo schema, Ollama
+vecchio, STRUCTURED_OUTPUT_ENABLED = False) si prova prima una riparazione
+locale opzionale e solo dopo un nuovo tentativo, infine (se configurata per la
+fase) l'escalation al modello grande. Esiti per agente su /metrics
+(triage_structured_output_total) e in /debug/llm-stats.
+"""
+import json
+import time
+from functools import lru_cache
+from typing import Any, Callable, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.config import STRUCTURED_OUTPUT_ENABLED
+from app.logger import get_agent_logger
+from app.logic import llm_client, model_tiers
+from app.logic.prompt_builder import count_message_tokens, num_ctx_for
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+T = TypeVar("T", bound=BaseModel)
+
+STRUCTURED_OUTPUT = REGISTRY.counter(
+    "triage_structured_output_total",
+    "Risposte strutturate per esito (valid|repaired|retry|failed).",
+    ("agent", "outcome"),
+)
+
+
+class StructuredOutputError(ValueError):
+    """Nessun tentativo ha prodotto un output valido per lo schema."""
+
+
+@lru_cache(maxsize=None)
+def json_schema(model_cls: Type[BaseModel]) -> dict:
+    """JSON Schema del modello (calcolato una volta per classe)."""
+    return model_cls.model_json_schema()
+
+
+def response_format(model_cls: Type[BaseModel]) -> Any:
+    """Valore di `format` per Ollama: lo schema, oppure 'json' se l'output vincolato è disattivato."""
+    return json_schema(model_cls) if STRUCTURED_OUTPUT_ENABLED else "json"
+
+
+def chat_structured(agent: str, model: str, messages: list, output_model: Type[T], specialty: Optional[str] = None,
+                    max_attempts: int = 1, repair: Optional[Callable[[Any], Any]] = None,
+                    retry_hint: Optional[Callable[[Exception], str]] = None, escalate_to: Optional[str] = None,
+                    **kwargs) -> T:
+    """
+    Chiamata a Ollama con output vincolato a `output_model` e validazione unica.
+
+    Args:
+        agent, model, messages, specialty: Come `llm_client.chat`.
+        output_model: Modello Pydantic atteso (il suo schema diventa `format`).
+        max_attempts: Generazioni massime (i nuovi tentativi servono solo se lo schema non viene rispettato).
+        repair: Funzione opzionale dato JSON -> dato riparato, provata prima di rigenerare.
+        retry_hint: Funzione opzionale errore -> testo aggiunto come messaggio utente al tentativo successivo.
+        escalate_to: Modello più grande (vedi model_tiers) usato se `model` non produce un output valido
+            dopo tutti i tentativi o non è installato su Ollama.
+        **kwargs: Passati a `ollama.chat` (options, ...).
+    Returns:
+        L'istanza validata di `output_model`.
+    Raises:
+        StructuredOutputError dopo l'ultimo tentativo fallito (errori di rete e di Ollama vengono rilanciati).
+    """
+    stage = model_tiers.stage_of(agent)
+    if escalate_to == model:
+        escalate_to = None
+
+    if not (escalate_to and model_tiers.is_unavailable(model)):
+        start = time.perf_counter()
+        try:
+            result = _generate(agent, model, messages, output_model, specialty, max_attempts, repair, retry_hint,
+                               **kwargs)
+            model_tiers.record(stage, "primary", model, time.perf_counter() - start, "ok")
+            return result
+        except StructuredOutputError:
+            if not escalate_to:
+                model_tiers.record(stage, "primary", model, time.perf_counter() - start, "failed")
+                raise
+            logger.warning(f"Output di '{agent}' non valido con '{model}': escalation a '{escalate_to}'.")
+        except Exception as e:
+            if not (escalate_to and model_tiers.is_model_missing(e)):
+                model_tiers.record(stage, "primary", model, time.perf_counter() - start, "failed")
+                raise
+            model_tiers.mark_unavailable(model)
+        model_tiers.record(stage, "primary", model, time.perf_counter() - start, "escalated")
+
+    if "num_ctx" in kwargs.get("options", {}):
+        # Contesto scelto tra i bucket del modello di escalation (evita di ricaricarlo con un num_ctx diverso)
+        kwargs["options"] = {**kwargs["options"],
+                             "num_ctx": num_ctx_for(count_message_tokens(messages), model=escalate_to)}
+    start = time.perf_counter()
+    try:
+        result = _generate(agent, escalate_to, messages, output_model, specialty, 1, repair, retry_hint, **kwargs)
+    except Exception:
+        model_tiers.record(stage, "escalation", escalate_to, time.perf_counter() - start, "failed")
+        raise
+    model_tiers.record(stage, "escalation", escalate_to, time.perf_counter() - start, "ok")
+    return result
+
+
+def _generate(agent: str, model: str, messages: list, output_model: Type[T], specialty: Optional[str],
+              max_attempts: int, repair: Optional[Callable[[Any], Any]], retry_hint: Optional[Callable[[Exception], str]],
+              **kwargs) -> T:
+    messages = list(messages)
+    error: Optional[Exception] = None
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            STRUCTURED_OUTPUT.inc(agent=agent, outcome="retry")
+            if retry_hint:
+                messages.append({"role": "user", "content": retry_hint(error)})
+
+        response = llm_client.chat(agent, model, messages, specialty=specialty,
+                                   format=response_format(output_model), **kwargs)
+        content = response["message"]["content"]
+
+        try:
+            result = output_model.model_validate_json(content)
+            STRUCTURED_OUTPUT.inc(agent=agent, outcome="valid")
+            return result
+        except ValidationError as e:
+            error = e
+
+        if repair:
+            try:
+                result = output_model.model_validate(repair(json.loads(content)))
+                logger.info(f"Output di '{agent}' riparato localmente (nessuna nuova generazione).")
+                STRUCTURED_OUTPUT.inc(agent=agent, outcome="repaired")
+                return result
+            except (ValueError, TypeError, KeyError) as e:  # ValidationError e JSONDecodeError sono ValueError
+                error = e
+
+        logger.warning(f"Output di '{agent}' non conforme a {output_model.__name__} "
+                       f"(tentativo {attempt + 1}/{max_attempts}): {error}")
+        logger.debug("Contenuto non valido: %s", content[:500])
+
+    STRUCTURED_OUTPUT.inc(agent=agent, outcome="failed")
+    raise StructuredOutputError(f"{output_model.__name__} non valido dopo {max_attempts} tentativi: {error}")
+
+
+def summary() -> dict:
+    """Esiti per agente, con la quota di generazioni sprecate (scartate e rigenerate, o fallite)."""
+    by_agent: dict = {}
+    for (agent, outcome), count in STRUCTURED_OUTPUT.snapshot().items():
+        by_agent.setdefault(agent, {"valid": 0, "repaired": 0, "retry": 0, "failed": 0})[outcome] = int(count)
+    for counts in by_agent.values():
+        generations = counts["valid"] + counts["repaired"] + counts["failed"] + counts["retry"]
+        wasted = counts["retry"] + counts["failed"]
+        counts["wasted_generation_share"] = round(wasted / generations, 3) if generations else None
+    return by_agent
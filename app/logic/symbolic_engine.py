@@ -1,65 +1,218 @@
 import json
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Mapping, Sequence, Union
+
+import numpy as np
+
 from app.logger import get_triage_logger
 
 # Logger per questo modulo
 logger = get_triage_logger()
 
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+# Esiti ordinati per gravità crescente: l'indice è il "peso" del livello di probabilità
+OUTCOME_BY_RANK = ["risposta_default", "cura_personale", "contatta_medico", "cura_urgente"]
+_LEVEL_RANK = {"low": 1, "medium": 2, "high": 3}
+
+# Operatori supportati dalle regole (codice -> funzione vettoriale)
+_OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+}
+
+
 def load_knowledge_base() -> dict:
     """Carica la base di conoscenza dal file JSON."""
     # Assicurati che il percorso sia corretto rispetto a questo file
-    kb_path = Path(__file__).parent.parent / "data/knowledge_base.json"
+    kb_path = DATA_DIR / "knowledge_base.json"
     with open(kb_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def load_triage_rules() -> dict:
+    """Carica le regole simboliche dichiarative dal file JSON (accanto alla knowledge base)."""
+    rules_path = DATA_DIR / "triage_rules.json"
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _is_present(value: Any) -> bool:
+    """Come le vecchie regole hard-coded: contano solo int/float diversi da zero (NaN = assente)."""
+    return isinstance(value, (int, float)) and bool(value) and value == value
+
+
+class CompiledRuleSet:
+    def __init__(self, rules: dict):
+        """
+        Compila le regole dichiarative in una tabella decisionale (array NumPy).
+        Le regole sono valutate in ordine: vince la prima che scatta.
+        """
+        safety_rules = rules.get("safety_rules", [])
+        self.rules = safety_rules
+        self.rule_ids = np.array([r["id"] for r in safety_rules] + [""], dtype=object)
+        self.rule_outcomes = np.array([r["outcome"] for r in safety_rules] + [""], dtype=object)
+
+        # Campi usati da almeno una regola -> colonna della matrice dei dati
+        fields: List[str] = []
+        for rule in safety_rules:
+            for name in [c["field"] for c in rule["conditions"]] + rule.get("requires", []):
+                if name not in fields:
+                    fields.append(name)
+        self.fields = fields
+        self.field_index = {name: i for i, name in enumerate(fields)}
+
+        # Tabella delle condizioni: una riga per condizione
+        n_rules = len(safety_rules)
+        conditions = [(r_idx, c) for r_idx, rule in enumerate(safety_rules) for c in rule["conditions"]]
+        self.cond_field = np.array([self.field_index[c["field"]] for _, c in conditions], dtype=np.intp)
+        self.cond_value = np.array([float(c["value"]) for _, c in conditions], dtype=np.float64)
+        self.cond_ops = [c["op"] for _, c in conditions]
+        for op in self.cond_ops:
+            if op not in _OPERATORS:
+                raise ValueError(f"Operatore non supportato nelle regole di triage: '{op}'")
+
+        # Appartenenza condizione -> regola (C x R) e modalità any/all
+        self.membership = np.zeros((len(conditions), n_rules), dtype=np.int32)
+        for c_idx, (r_idx, _) in enumerate(conditions):
+            self.membership[c_idx, r_idx] = 1
+        self.conditions_per_rule = self.membership.sum(axis=0)
+        self.match_all = np.array([r.get("match", "all") == "all" for r in safety_rules], dtype=bool)
+
+        # Campi obbligatori per regola (R x F): tutti devono essere presenti
+        self.requires = np.zeros((n_rules, len(fields)), dtype=np.int32)
+        for r_idx, rule in enumerate(safety_rules):
+            for name in rule.get("requires", []):
+                self.requires[r_idx, self.field_index[name]] = 1
+
+        # Livelli di probabilità (IT/EN) -> peso numerico, calcolati una volta sola
+        self.probability_levels = rules.get("probability_levels", {})
+        self.level_rank = {
+            raw: _LEVEL_RANK[level] for raw, level in self.probability_levels.items() if level in _LEVEL_RANK
+        }
+        outcomes = rules.get("probability_outcomes", {})
+        self.outcome_by_rank = list(OUTCOME_BY_RANK)
+        for level, rank in _LEVEL_RANK.items():
+            if level in outcomes:
+                self.outcome_by_rank[rank] = outcomes[level]
+        self.outcome_by_rank = np.array(self.outcome_by_rank, dtype=object)
+
+    # --- COSTRUZIONE INPUT ---
+
+    def build_matrix(self, records: Union[Sequence[Mapping[str, Any]], Mapping[str, Sequence[Any]]]):
+        """
+        Converte i record in una matrice di valori (N x campi) e nella maschera dei valori presenti.
+        Accetta una lista di dizionari (forma di `extracted_data`) oppure un dizionario
+        colonnare campo -> array, molto più veloce per coorti grandi.
+        """
+        if isinstance(records, Mapping):
+            n = len(next(iter(records.values()))) if records else 0
+            values = np.full((n, len(self.fields)), np.nan)
+            present = np.zeros((n, len(self.fields)), dtype=bool)
+            for name, col in self.field_index.items():
+                if name in records:
+                    column = np.asarray(records[name], dtype=np.float64)
+                    values[:, col] = column
+                    # Stessa regola di _is_present: NaN e zero sono valori assenti
+                    present[:, col] = ~np.isnan(column) & (column != 0)
+            return values, present
+
+        values = np.full((len(records), len(self.fields)), np.nan)
+        present = np.zeros((len(records), len(self.fields)), dtype=bool)
+        for row, record in enumerate(records):
+            if not record:
+                continue
+            for name, col in self.field_index.items():
+                value = record.get(name)
+                if _is_present(value):
+                    values[row, col] = value
+                    present[row, col] = True
+        return values, present
+
+    def probability_ranks(self, conditions_per_record: Sequence[Sequence[Any]]) -> np.ndarray:
+        """Peso massimo (0-3) delle probabilità di ciascun record (liste di condizioni o di stringhe)."""
+        ranks = np.zeros(len(conditions_per_record), dtype=np.intp)
+        for row, conditions in enumerate(conditions_per_record):
+            best = 0
+            for cond in conditions or []:
+                raw = cond.get("probability", "") if isinstance(cond, dict) else cond
+                best = max(best, self.level_rank.get(str(raw).lower().strip(), 0))
+            ranks[row] = best
+        return ranks
+
+    # --- VALUTAZIONE ---
+
+    def fired_rules(self, values: np.ndarray, present: np.ndarray) -> np.ndarray:
+        """Indice della prima regola che scatta per ogni riga (len(rules) = nessuna)."""
+        n_rules = len(self.rules)
+        if n_rules == 0 or values.shape[0] == 0:
+            return np.full(values.shape[0], n_rules, dtype=np.intp)
+
+        cond_values = values[:, self.cond_field]  # N x C
+        results = present[:, self.cond_field].astype(np.int32)
+        for c_idx, op in enumerate(self.cond_ops):
+            # I confronti con NaN sono sempre False: i campi assenti non fanno scattare nulla
+            results[:, c_idx] &= _OPERATORS[op](cond_values[:, c_idx], self.cond_value[c_idx])
+
+        hits = results @ self.membership  # N x R: condizioni soddisfatte per regola
+        rule_ok = np.where(self.match_all, hits == self.conditions_per_rule, hits > 0)
+        missing = (~present).astype(np.int32) @ self.requires.T  # N x R
+        fired = rule_ok & (missing == 0)
+
+        first = np.argmax(fired, axis=1)
+        return np.where(fired.any(axis=1), first, n_rules)
+
+    def evaluate(self, values: np.ndarray, present: np.ndarray,
+                 probability_ranks: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Valuta l'intera coorte in un solo passaggio NumPy.
+        Le regole di sicurezza hanno priorità; altrimenti decide la probabilità più alta.
+        """
+        fired = self.fired_rules(values, present)
+        outcomes = self.rule_outcomes[fired]
+        if probability_ranks is None:
+            probability_ranks = np.zeros(values.shape[0], dtype=np.intp)
+        no_rule = fired == len(self.rules)
+        outcomes = np.where(no_rule, self.outcome_by_rank[probability_ranks], outcomes)
+        return {"outcome": outcomes, "rule_id": self.rule_ids[fired]}
+
+
 class TriageEngine:
     def __init__(self):
-        """Inizializza il motore caricando la base di conoscenza."""
+        """Inizializza il motore caricando la base di conoscenza e compilando le regole."""
         self.kb = load_knowledge_base()
+        self.rules = CompiledRuleSet(load_triage_rules())
+
+    def _recommendation_for(self, outcome: str) -> dict:
+        if outcome in self.kb['raccomandazioni']:
+            return self.kb['raccomandazioni'][outcome]
+        return self.kb['risposta_default']
 
     def _apply_safety_rules(self, extracted_data: dict) -> dict:
         """
-        Applica regole deterministiche (hard-coded) sui parametri vitali.
+        Applica le regole deterministiche (da triage_rules.json) sui parametri vitali.
         Se una regola scatta, restituisce la raccomandazione corrispondente.
         Altrimenti restituisce None.
         """
         if not extracted_data:
             return None
 
-        # --- REGOLA 1: FEBBRE ALTA ---
-        temp = extracted_data.get("temperature_celsius")
-        if temp and isinstance(temp, (int, float)):
-            if temp > 39.5:
-                logger.warning(f"RULE MATCH: Temperatura {temp}°C -> URGENTE")
-                return self.kb['raccomandazioni']['cura_urgente']
-
-        # --- REGOLA 2: DOLORE INTENSO ---
-        pain = extracted_data.get("pain_score")
-        if pain and isinstance(pain, (int, float)):
-            if pain >= 9:
-                logger.warning(f"RULE MATCH: Dolore {pain}/10 -> URGENTE")
-                return self.kb['raccomandazioni']['cura_urgente']
-            if pain >= 7:
-                 logger.warning(f"RULE MATCH: Dolore {pain}/10 -> CONTATTA MEDICO")
-                 return self.kb['raccomandazioni']['contatta_medico']
-
-        # --- REGOLA 3: IPERTENSIONE GRAVE ---
-        sys = extracted_data.get("systolic")
-        dia = extracted_data.get("diastolic")
-        if sys and dia and isinstance(sys, (int, float)) and isinstance(dia, (int, float)):
-            if sys > 180 or dia > 120:
-                logger.warning(f"RULE MATCH: Pressione {sys}/{dia} -> URGENTE (Crisi Ipertensiva)")
-                return self.kb['raccomandazioni']['cura_urgente']
-
-        return None
+        fired = self.rules.fired_rules(*self.rules.build_matrix([extracted_data]))[0]
+        if fired == len(self.rules.rules):
+            return None
+
+        rule = self.rules.rules[fired]
+        logger.warning(f"RULE MATCH: {rule.get('description', rule['id'])} -> {rule['outcome'].upper()}")
+        return self._recommendation_for(rule['outcome'])
 
     def get_recommendation(self, rag_analysis: dict, extracted_data: dict = None) -> dict:
         """
         Combina regole deterministiche (Simboliche) e analisi probabilistica (Neurale).
         Priorità: Regole di Sicurezza > Probabilità Alta > Probabilità Media > Probabilità Bassa.
         """
-        
+
         # 1. CONTROLLO REGOLE SIMBOLICHE (Priorità Assoluta)
         safety_override = self._apply_safety_rules(extracted_data)
         if safety_override:
@@ -67,42 +220,29 @@ class TriageEngine:
 
         # 2. ANALISI PROBABILISTICA (RAG)
         conditions = rag_analysis.get("potential_conditions", [])
-        
+
         if not conditions or not isinstance(conditions, list):
             logger.warning("Analisi RAG non valida o vuota. Uso la risposta di default.")
             return self.kb['risposta_default']
 
-        # Normalizzazione probabilità (supporta IT e EN)
-        # Mappa sinonimi -> livello normalizzato
-        probability_mapping = {
-            # Italiano
-            "alta": "high", "alto": "high",
-            "media": "medium", "medio": "medium",
-            "bassa": "low", "basso": "low",
-            # Inglese
-            "high": "high",
-            "medium": "medium", "moderate": "medium",
-            "low": "low"
-        }
-        
-        # Estrai tutte le probabilità normalizzate
-        normalized_probs = set()
-        for cond in conditions:
-            raw_prob = cond.get("probability", "").lower().strip()
-            normalized = probability_mapping.get(raw_prob, None)
-            if normalized:
-                normalized_probs.add(normalized)
-
-        # "Il rischio maggiore vince"
-        if "high" in normalized_probs:
-            return self.kb['raccomandazioni']['cura_urgente']
-        
-        if "medium" in normalized_probs:
-            return self.kb['raccomandazioni']['contatta_medico']
-        
-        if "low" in normalized_probs:
-            return self.kb['raccomandazioni']['cura_personale']
-
-        # Fallback
-        logger.warning(f"Nessuna probabilità valida trovata in {normalized_probs}. Uso la risposta di default.")
-        return self.kb['risposta_default']
\ No newline at end of file
+        # "Il rischio maggiore vince" (mappa probabilità IT/EN compilata una volta in CompiledRuleSet)
+        rank = self.rules.probability_ranks([conditions])[0]
+        if rank == 0:
+            logger.warning("Nessuna probabilità valida trovata nelle condizioni. Uso la risposta di default.")
+            return self.kb['risposta_default']
+
+        return self._recommendation_for(self.rules.outcome_by_rank[rank])
+
+    def evaluate_batch(self, records: Union[Sequence[Mapping[str, Any]], Mapping[str, Sequence[Any]]],
+                       conditions: Optional[Sequence[Sequence[Any]]] = None) -> Dict[str, np.ndarray]:
+        """
+        Ri-triage offline di una coorte, senza LLM.
+        Args:
+            records: Lista di `extracted_data` (dict) oppure dizionario colonnare campo -> array.
+            conditions: Opzionale, per ogni record la lista di condizioni RAG (o di sole probabilità).
+        Returns:
+            {"outcome": chiavi raccomandazione (es. 'cura_urgente'), "rule_id": regola scattata o ''}
+        """
+        values, present = self.rules.build_matrix(records)
+        ranks = self.rules.probability_ranks(conditions) if conditions is not None else None
+        return self.rules.evaluate(values, present, ranks)
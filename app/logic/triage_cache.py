@@ -0,0 +1,226 @@
+"""
+Cache semantica dei risultati dell'analisi specialistica (RAG + riflessione).
+
+Molte sessioni arrivano allo stesso caso ("febbre 38.5, tosse secca, 3 giorni" dal
+pneumologo) e rifanno retrieval, reranking, generazione e riflessione. Qui il profilo
+del paziente viene normalizzato, trasformato in embedding e confrontato con i casi già
+analizzati della stessa specialità: sopra TRIAGE_CACHE_SIMILARITY si riusa la
+MedicalAnalysis salvata.
+
+Sicurezza:
+  - allergie, farmaci e storia clinica devono coincidere esattamente (normalizzati):
+    la similarità vale solo tra casi con lo stesso profilo di rischio;
+  - si salva solo l'analisi (condizioni e fonti): tool sui parametri vitali e regole
+    del TriageEngine vengono sempre rieseguiti sui dati della sessione corrente.
+
+Le voci scadono dopo TRIAGE_CACHE_TTL_S e vengono scartate quando cambia l'impronta
+delle fonti (file del DB vettoriale della specialità, knowledge base, modelli).
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    EMBEDDING_MODEL, RERANKER_MODEL,
+    TRIAGE_CACHE_SIMILARITY, TRIAGE_CACHE_TTL_S, TRIAGE_CACHE_MAX_ENTRIES
+)
+from app.logger import get_rag_logger
+from app.logic import model_tiers
+from app.logic.symbolic_engine import DATA_DIR
+from app.metrics import REGISTRY
+
+# Logger per questo modulo
+logger = get_rag_logger()
+
+TRIAGE_CACHE_EVENTS = REGISTRY.counter(
+    "triage_semantic_cache_total",
+    "Lookup e scritture della cache semantica del triage (hit|miss|expired|invalidated|stored).",
+    ("specialty", "outcome"),
+)
+TRIAGE_CACHE_SIMILARITY_SCORE = REGISTRY.histogram(
+    "triage_semantic_cache_similarity",
+    "Similarità del caso più vicino in cache a ogni lookup.",
+    ("specialty",),
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99, 1.0),
+)
+
+# Campi del profilo clinico (stessa forma dei dati dell'AssistantAgent)
+SIMILARITY_FIELDS = ("symptoms", "duration", "negative_findings")
+EXACT_FIELDS = ("allergies", "medications", "medical_history")
+
+# File della knowledge base che, se cambiano, invalidano la cache
+KB_FILES = (DATA_DIR / "knowledge_base.json", DATA_DIR / "triage_rules.json")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w.,/%-]+", " ", str(text).lower())).strip()
+
+
+def _normalize_list(values) -> List[str]:
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return sorted({_normalize(v) for v in values if _normalize(v)})
+
+
+def canonical_profile(symptoms_summary: str, patient_data: Optional[dict] = None) -> Tuple[str, str]:
+    """
+    Ritorna (testo per l'embedding, chiave esatta del profilo di rischio).
+    Senza sintomi strutturati il testo è il riassunto normalizzato.
+    """
+    patient_data = patient_data or {}
+    parts = [f"{field}: {'; '.join(_normalize_list(patient_data.get(field)))}"
+             for field in SIMILARITY_FIELDS if patient_data.get(field)]
+    if not patient_data.get("symptoms"):
+        parts.insert(0, f"summary: {_normalize(symptoms_summary)}")
+    risk_key = " | ".join(f"{field}: {'; '.join(_normalize_list(patient_data.get(field)))}" for field in EXACT_FIELDS)
+    return " | ".join(parts), risk_key
+
+
+class _Entry:
+    __slots__ = ("vector", "risk_key", "analysis", "fingerprint", "created_at", "profile")
+
+    def __init__(self, vector: np.ndarray, risk_key: str, analysis: dict, fingerprint: tuple, profile: str):
+        self.vector = vector
+        self.risk_key = risk_key
+        self.analysis = analysis
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.profile = profile
+
+
+class TriageCache:
+    def __init__(self, embeddings, db_path_resolver, similarity: float = TRIAGE_CACHE_SIMILARITY,
+                 ttl_s: float = TRIAGE_CACHE_TTL_S, max_entries: int = TRIAGE_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            embeddings: Oggetto con `embed_query` (lo stesso embedder del RAG).
+            db_path_resolver: specialty -> cartella del DB vettoriale (per l'impronta dell'indice).
+            similarity: Similarità coseno minima per riusare un'analisi.
+            ttl_s: Durata di una voce.
+            max_entries: Voci totali (oltre, si scartano le più vecchie).
+        """
+        self.embeddings = embeddings
+        self.db_path_resolver = db_path_resolver
+        self.similarity = similarity
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: Dict[str, List[_Entry]] = {}  # specialty -> voci
+        self._lock = threading.Lock()
+
+    # --- Impronta delle fonti ---
+    def fingerprint(self, specialty: str) -> tuple:
+        """Dimensione e mtime dei file di indice e knowledge base, più i modelli usati."""
+        files = [str(path) for path in KB_FILES]
+        db_path = self.db_path_resolver(specialty)
+        for root, _, names in os.walk(db_path):
+            files.extend(os.path.join(root, name) for name in names)
+        stats = []
+        for path in sorted(files):
+            try:
+                st = os.stat(path)
+                stats.append((path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                continue
+        models = tuple(model_tiers.model_for(stage) for stage in ("rag", "reflection", "forced_diagnosis"))
+        return models + (EMBEDDING_MODEL, RERANKER_MODEL, tuple(stats))
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # --- Lookup e scrittura ---
+    def lookup(self, specialty: str, symptoms_summary: str, patient_data: Optional[dict] = None
+               ) -> Tuple[Optional[dict], Optional[np.ndarray]]:
+        """
+        Analisi salvata per un caso equivalente, o None.
+        Ritorna anche l'embedding del profilo, da riusare in `store` dopo un miss.
+        """
+        profile, risk_key = canonical_profile(symptoms_summary, patient_data)
+        fingerprint = self.fingerprint(specialty)
+        vector = self._embed(profile)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._entries.get(specialty, [])
+            if entries and entries[0].fingerprint != fingerprint:
+                logger.info(f"Cache triage '{specialty}': indice o knowledge base cambiati, {len(entries)} voci scartate.")
+                TRIAGE_CACHE_EVENTS.inc(len(entries), specialty=specialty, outcome="invalidated")
+                entries = []
+            fresh = [e for e in entries if now - e.created_at <= self.ttl_s]
+            if len(fresh) < len(entries):
+                TRIAGE_CACHE_EVENTS.inc(len(entries) - len(fresh), specialty=specialty, outcome="expired")
+            self._entries[specialty] = fresh
+            candidates = [e for e in fresh if e.risk_key == risk_key]
+
+        best, best_score = None, 0.0
+        if candidates:
+            scores = np.stack([e.vector for e in candidates]) @ vector
+            index = int(np.argmax(scores))
+            best, best_score = candidates[index], float(scores[index])
+            TRIAGE_CACHE_SIMILARITY_SCORE.observe(best_score, specialty=specialty)
+
+        if best is None or best_score < self.similarity:
+            TRIAGE_CACHE_EVENTS.inc(specialty=specialty, outcome="miss")
+            return None, vector
+
+        TRIAGE_CACHE_EVENTS.inc(specialty=specialty, outcome="hit")
+        logger.info(f"Cache triage '{specialty}': riuso l'analisi di un caso equivalente "
+                    f"(similarità {best_score:.3f}).")
+        logger.debug("Profilo: %s | in cache: %s", profile, best.profile)
+        return _copy_analysis(best.analysis), vector
+
+    def store(self, specialty: str, symptoms_summary: str, patient_data: Optional[dict], analysis: dict,
+              vector: Optional[np.ndarray] = None):
+        """Salva l'analisi (solo condizioni e fonti) per i prossimi casi equivalenti."""
+        if not analysis.get("potential_conditions"):
+            return
+        profile, risk_key = canonical_profile(symptoms_summary, patient_data)
+        if vector is None:
+            vector = self._embed(profile)
+        entry = _Entry(vector, risk_key, _copy_analysis(analysis), self.fingerprint(specialty), profile)
+        with self._lock:
+            entries = self._entries.setdefault(specialty, [])
+            if entries and entries[0].fingerprint != entry.fingerprint:
+                entries.clear()
+            entries.append(entry)
+            total = sum(len(v) for v in self._entries.values())
+            while total > self.max_entries:
+                oldest = min((v for v in self._entries.values() if v), key=lambda v: v[0].created_at)
+                oldest.pop(0)
+                total -= 1
+        TRIAGE_CACHE_EVENTS.inc(specialty=specialty, outcome="stored")
+
+    def clear(self, specialty: Optional[str] = None):
+        """Svuota la cache (di una specialità o tutta), es. dopo una ricostruzione manuale dei DB."""
+        with self._lock:
+            if specialty:
+                self._entries.pop(specialty, None)
+            else:
+                self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """Voci per specialità ed esiti dei lookup, con hit rate."""
+        with self._lock:
+            entries = {specialty: len(v) for specialty, v in self._entries.items()}
+        outcomes: Dict[str, Dict[str, int]] = {}
+        for (specialty, outcome), count in TRIAGE_CACHE_EVENTS.snapshot().items():
+            outcomes.setdefault(specialty, {})[outcome] = int(count)
+        for counts in outcomes.values():
+            lookups = counts.get("hit", 0) + counts.get("miss", 0)
+            counts["hit_rate"] = round(counts.get("hit", 0) / lookups, 3) if lookups else None
+        return {"entries": entries, "by_specialty": outcomes}
+
+
+def _copy_analysis(analysis: dict) -> dict:
+    """Copia di condizioni e fonti: il chiamante ordina e taglia la lista sul posto."""
+    return {
+        "potential_conditions": [dict(c) for c in analysis.get("potential_conditions", [])],
+        "sources_consulted": list(analysis.get("sources_consulted", [])),
+    }
@@ -0,0 +1,334 @@
+"""
+Router vettoriale: fast path che instrada senza chiamare l'LLM quando è sicuro.
+
+Ogni specialista è rappresentato da un prototipo (vettore normalizzato) ottenuto
+combinando l'embedding della sua descrizione, il centroide del suo corpus in
+`vector_dbs` e, se disponibili, gli embedding delle decisioni di routing già
+registrate. Se lo scarto (margin) tra il primo e il secondo specialista supera
+una soglia calibrata, il router decide da solo; altrimenti si usa l'LLM.
+
+Il log delle decisioni contiene solo l'embedding della query e lo specialista scelto
+(nessun testo del paziente). Ogni record ha uno `split`:
+  - "prototype": decisioni LLM usate per affinare i prototipi;
+  - "calibration": decisioni LLM tenute da parte (ROUTER_CALIBRATION_HOLDOUT) e verifiche
+    shadow del fast path, cioè campioni sopra la soglia corrente.
+La soglia viene calibrata solo sui campioni "calibration" (precisione fuori campione),
+alla costruzione dei prototipi e ogni ROUTER_CALIBRATE_EVERY nuove decisioni.
+"""
+import json
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    ROUTER_FAST_PATH_MARGIN, ROUTER_FAST_PATH_MIN_SIMILARITY,
+    ROUTER_FAST_PATH_SHADOW_RATE, ROUTER_DECISIONS_LOG, ROUTER_DECISIONS_LOG_MAX_BYTES, ROUTER_CALIBRATE_EVERY,
+    ROUTER_CALIBRATION_HOLDOUT, DEGRADED_ROUTER_MARGIN_SCALE
+)
+from app.logger import get_agent_logger
+
+# Logger per questo modulo
+logger = get_agent_logger()
+
+# Massimo numero di vettori letti da ogni DB per stimare il centroide del corpus
+CENTROID_SAMPLE_SIZE = 2000
+# Decisioni registrate minime per specialista prima di usarle nel prototipo
+MIN_LOGGED_DECISIONS = 3
+# Embedding delle query recenti (route() e record_*() sullo stesso turno)
+QUERY_CACHE_SIZE = 256
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class VectorRouter:
+    def __init__(self, embedding_function, specialist_descriptions: Dict[str, str], specialists: List[str],
+                 rag_handler=None, decisions_log_path: Optional[str] = ROUTER_DECISIONS_LOG,
+                 margin_threshold: float = ROUTER_FAST_PATH_MARGIN,
+                 min_similarity: float = ROUTER_FAST_PATH_MIN_SIMILARITY,
+                 shadow_rate: float = ROUTER_FAST_PATH_SHADOW_RATE):
+        """
+        Args:
+            embedding_function: Embeddings LangChain (embed_query/embed_documents) normalizzati.
+            specialist_descriptions: Descrizione testuale per specialista.
+            specialists: Specialisti disponibili (minuscolo).
+            rag_handler: Se passato, i centroidi del corpus vengono letti dai suoi DB.
+            decisions_log_path: File JSONL dove registrare le decisioni dell'LLM (None = disattivato).
+            margin_threshold: Scarto minimo top1 - top2 per usare il fast path.
+            min_similarity: Similarità minima del top1 per usare il fast path.
+            shadow_rate: Frazione di decisioni del fast path verificate comunque con l'LLM.
+        """
+        self.embedding_function = embedding_function
+        self.specialist_descriptions = specialist_descriptions
+        self.specialists = [s.lower() for s in specialists]
+        self.rag_handler = rag_handler
+        self.decisions_log_path = decisions_log_path
+        self.margin_threshold = margin_threshold
+        self.default_margin_threshold = margin_threshold  # Ripiego se la calibrazione non trova una soglia precisa
+        self.min_similarity = min_similarity
+        self.shadow_rate = shadow_rate
+
+        self._prototypes: Optional[np.ndarray] = None
+        self._prototype_names: List[str] = []
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._query_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._decisions_since_calibration = 0
+        self.stats = {
+            "turns": 0,             # Turni in cui il router vettoriale è stato consultato
+            "fast_path": 0,         # Turni instradati senza LLM
+            "relaxed_fast_path": 0, # ... di cui con lo scarto ridotto della modalità degradata
+            "llm_fallback": 0,      # Turni ambigui lasciati all'LLM
+            "shadow_checks": 0,     # Decisioni del fast path verificate con l'LLM
+            "shadow_agreements": 0, # ... di cui confermate dall'LLM
+            "llm_routed": 0,        # Instradamenti decisi dall'LLM (con confronto vettoriale)
+            "llm_agreements": 0,    # ... in cui il top1 vettoriale coincideva
+        }
+
+    # --- COSTRUZIONE PROTOTIPI ---
+
+    def _corpus_centroid(self, specialty: str) -> Optional[np.ndarray]:
+        if not self.rag_handler:
+            return None
+        db = self.rag_handler._load_db(specialty)
+        if db is None:
+            return None
+        try:
+            data = db.get(limit=CENTROID_SAMPLE_SIZE, include=["embeddings"])
+            embeddings = data.get("embeddings")
+            if embeddings is None or len(embeddings) == 0:
+                return None
+            return _normalize(np.asarray(embeddings, dtype=np.float32).mean(axis=0))
+        except Exception as e:
+            logger.warning(f"VectorRouter: centroide non disponibile per '{specialty}': {e}")
+            return None
+
+    def _load_logged_decisions(self, split: str) -> List[dict]:
+        """Decisioni con embedding di uno split (generazione ruotata .1 e file corrente)."""
+        if not self.decisions_log_path:
+            return []
+        records = []
+        for path in (self.decisions_log_path + ".1", self.decisions_log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # I record senza split (log precedenti) valgono come dati dei prototipi
+                    if record.get("embedding") and record.get("split", "prototype") == split:
+                        records.append(record)
+        return records
+
+    def build(self):
+        """Calcola i prototipi degli specialisti (chiamato alla prima richiesta)."""
+        names = list(self.specialists)
+        descriptions = [self.specialist_descriptions.get(s, s) for s in names]
+        description_vectors = np.asarray(self.embedding_function.embed_documents(descriptions), dtype=np.float32)
+
+        # Raggruppa le decisioni registrate dall'LLM per specialista (mai quelle di calibrazione)
+        logged: Dict[str, List[list]] = {}
+        for record in self._load_logged_decisions("prototype"):
+            if record.get("specialist") in names:
+                logged.setdefault(record["specialist"], []).append(record["embedding"])
+
+        prototypes = []
+        for i, name in enumerate(names):
+            components = [_normalize(description_vectors[i])]
+            centroid = self._corpus_centroid(name)
+            if centroid is not None:
+                components.append(centroid)
+            query_vectors = logged.get(name, [])
+            if len(query_vectors) >= MIN_LOGGED_DECISIONS:
+                components.append(_normalize(np.asarray(query_vectors, dtype=np.float32).mean(axis=0)))
+            prototypes.append(_normalize(np.mean(components, axis=0)))
+
+        self._prototypes = np.vstack(prototypes)
+        self._prototype_names = names
+        logger.info(f"VectorRouter: prototipi costruiti per {len(names)} specialisti.")
+
+    def _ensure_built(self):
+        if self._prototypes is None:
+            with self._lock:
+                if self._prototypes is None:
+                    self.build()
+                    self.calibrate()
+
+    # --- SCORING E ROUTING ---
+
+    def _embed(self, query: str) -> np.ndarray:
+        """Embedding normalizzato della query (le query recenti non vengono ricalcolate)."""
+        with self._query_lock:
+            vector = self._query_vectors.get(query)
+            if vector is not None:
+                self._query_vectors.move_to_end(query)
+                return vector
+        vector = _normalize(np.asarray(self.embedding_function.embed_query(query), dtype=np.float32))
+        with self._query_lock:
+            self._query_vectors[query] = vector
+            while len(self._query_vectors) > QUERY_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+    def score(self, query: str) -> List[Tuple[str, float]]:
+        """Ritorna (specialista, similarità coseno) ordinati per similarità decrescente."""
+        self._ensure_built()
+        return self._score_vector(self._embed(query))
+
+    def _score_vector(self, vector: np.ndarray) -> List[Tuple[str, float]]:
+        similarities = self._prototypes @ vector
+        order = np.argsort(similarities)[::-1]
+        return [(self._prototype_names[i], float(similarities[i])) for i in order]
+
+    def _margin(self, scores: List[Tuple[str, float]]) -> float:
+        if len(scores) < 2:
+            return scores[0][1] if scores else 0.0
+        return scores[0][1] - scores[1][1]
+
+    def route(self, query: str, relaxed: bool = False) -> Optional[dict]:
+        """
+        Ritorna {"specialist", "similarity", "margin", "shadow"} se il fast path è sicuro, altrimenti None.
+        Se "shadow" è True il chiamante deve comunque consultare l'LLM e chiamare record_shadow().
+        `relaxed` (modalità degradata sotto carico): scarto minimo ridotto di DEGRADED_ROUTER_MARGIN_SCALE
+        e nessuna verifica shadow.
+        """
+        if not query or not self.specialists:
+            return None
+        try:
+            scores = self.score(query)
+        except Exception as e:
+            logger.warning(f"VectorRouter non disponibile, uso LLM: {e}")
+            return None
+
+        self.stats["turns"] += 1
+        top_name, top_sim = scores[0]
+        margin = self._margin(scores)
+        margin_threshold = self.margin_threshold * (DEGRADED_ROUTER_MARGIN_SCALE if relaxed else 1.0)
+        if top_sim < self.min_similarity or margin < margin_threshold:
+            self.stats["llm_fallback"] += 1
+            logger.debug("VectorRouter: ambiguo (top=%s sim=%.3f margin=%.3f).", top_name, top_sim, margin)
+            return None
+
+        shadow = not relaxed and random.random() < self.shadow_rate
+        if not shadow:
+            self.stats["fast_path"] += 1
+        if relaxed and margin < self.margin_threshold:
+            self.stats["relaxed_fast_path"] += 1
+        logger.info(f"VectorRouter: fast path -> {top_name} (sim={top_sim:.3f}, margin={margin:.3f}, shadow={shadow}).")
+        return {"specialist": top_name, "similarity": top_sim, "margin": margin, "shadow": shadow}
+
+    # --- REGISTRAZIONE DECISIONI E STATISTICHE ---
+
+    def record_llm_decision(self, query: str, specialist: str):
+        """
+        Registra una decisione di routing dell'LLM e la confronta con il top1 vettoriale.
+        L'embedding viene da route() sullo stesso turno; nel log finiscono solo embedding e specialista.
+        """
+        try:
+            vector = self._embed(query)
+            top_name = self._score_vector(vector)[0][0]
+        except Exception:
+            return
+        self.stats["llm_routed"] += 1
+        if top_name == specialist:
+            self.stats["llm_agreements"] += 1
+        split = "calibration" if random.random() < ROUTER_CALIBRATION_HOLDOUT else "prototype"
+        self._record(vector, specialist, "llm", top_name, split)
+
+    def record_shadow(self, query: str, fast_path_specialist: str, llm_specialist: Optional[str]):
+        """
+        Confronta una decisione del fast path con quella dell'LLM (campionamento shadow).
+        Sono gli unici campioni sopra la soglia corrente: finiscono tutti nella calibrazione,
+        che così può anche alzare la soglia.
+        """
+        self.stats["shadow_checks"] += 1
+        if llm_specialist == fast_path_specialist:
+            self.stats["shadow_agreements"] += 1
+        try:
+            vector = self._embed(query)
+        except Exception:
+            return
+        self._record(vector, llm_specialist, "shadow", fast_path_specialist, "calibration")
+
+    def _record(self, vector: np.ndarray, specialist: Optional[str], source: str, vector_top1: str, split: str):
+        self._append_log({"embedding": [round(float(x), 5) for x in vector], "specialist": specialist,
+                          "source": source, "vector_top1": vector_top1, "split": split})
+
+        self._decisions_since_calibration += 1
+        if ROUTER_CALIBRATE_EVERY and self._decisions_since_calibration >= ROUTER_CALIBRATE_EVERY:
+            self._decisions_since_calibration = 0
+            try:
+                self.calibrate()
+            except Exception as e:
+                logger.warning(f"VectorRouter: calibrazione fallita: {e}")
+
+    def _append_log(self, record: dict):
+        if not self.decisions_log_path:
+            return
+        try:
+            with self._log_lock:
+                if (os.path.exists(self.decisions_log_path)
+                        and os.path.getsize(self.decisions_log_path) > ROUTER_DECISIONS_LOG_MAX_BYTES):
+                    os.replace(self.decisions_log_path, self.decisions_log_path + ".1")
+                with open(self.decisions_log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.warning(f"VectorRouter: impossibile registrare la decisione: {e}")
+
+    def calibrate(self, target_precision: float = 0.95, min_samples: int = 20) -> float:
+        """
+        Sceglie la soglia di margin più bassa che, sui campioni di calibrazione (decisioni LLM
+        tenute fuori dai prototipi e verifiche shadow), mantiene una precisione del fast path
+        >= target_precision. Se nessuna soglia la raggiunge si torna alla soglia configurata
+        (o più in alto, se la soglia corrente era già più alta). Con pochi dati resta invariata.
+        """
+        records = self._load_logged_decisions("calibration")
+        if len(records) < min_samples:
+            logger.info(f"VectorRouter: calibrazione saltata ({len(records)} campioni, minimo {min_samples}).")
+            return self.margin_threshold
+
+        scored = []
+        for record in records:
+            scores = self._score_vector(np.asarray(record["embedding"], dtype=np.float32))
+            # specialist None = l'LLM non ha instradato: il fast path avrebbe sbagliato
+            scored.append((self._margin(scores), scores[0][0] == record.get("specialist")))
+        scored.sort(key=lambda x: x[0], reverse=True)
+
+        # Scorre le soglie dalla più alta alla più bassa e tiene la più bassa in cui la precisione regge
+        best = None
+        correct = 0
+        for count, (margin, is_correct) in enumerate(scored, start=1):
+            correct += is_correct
+            if count >= min_samples and correct / count >= target_precision:
+                best = margin
+        if best is None:
+            best = max(self.margin_threshold, self.default_margin_threshold)
+            logger.warning(f"VectorRouter: precisione {target_precision:.0%} mai raggiunta su {len(scored)} "
+                           f"campioni, soglia di margin riportata a {best:.3f}.")
+        else:
+            logger.info(f"VectorRouter: soglia di margin calibrata a {best:.3f} ({len(scored)} campioni).")
+        self.margin_threshold = best
+        return best
+
+    def get_stats(self) -> dict:
+        """Frequenza e accuratezza stimata del fast path."""
+        stats = dict(self.stats)
+        turns = stats["turns"]
+        stats["fast_path_rate"] = stats["fast_path"] / turns if turns else 0.0
+        stats["fast_path_precision"] = (
+            stats["shadow_agreements"] / stats["shadow_checks"] if stats["shadow_checks"] else None
+        )
+        stats["vector_llm_agreement"] = (
+            stats["llm_agreements"] / stats["llm_routed"] if stats["llm_routed"] else None
+        )
+        stats["margin_threshold"] = self.margin_threshold
+        return stats
@@ -1,31 +1,72 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
 import os
+import asyncio
+import copy
 import threading 
 import time      
+import uuid
 
 # --- IMPORTS DEL PROGETTO ---
 from app.agents.router_agent import RouterAgent
 from app.agents.specialist_agent import SpecialistAgent
 from app.agents.assistant_agent import AssistantAgent
-from app.logic.rag_handler import RAGHandler
+from app.logic.rag_handler import RAGHandler, RETRIEVAL_K, RERANK_TOP_N
 from app.logic.symbolic_engine import TriageEngine
 # Importiamo il gestore di sessione
 from app.logic.session_manager import SessionManager 
 
 from app.logic.image_analyzer import ImageAnalyzer
-from app.logger import get_api_logger
-from app.translations import get_translation, DEFAULT_LANGUAGE
+from app.logic.vector_router import VectorRouter
+from app.logic.lexical_matcher import get_lexical_matcher
+from app.logic.batch_triage import BatchTriageRunner
+from app.logic.rag_prefetch import RAGPrefetcher
+from app.logic.history_compactor import HistoryCompactor
+from app.logic.triage_cache import TriageCache
+from app.logic.single_flight import SingleFlight, KeyedLocks, make_key
+from app.logic.llm_client import llm_stats, begin_turn, TURN_PROMPT_EVAL_SAVED
+from app.logic import structured_output, model_tiers, degradation
+from app.logic.degradation import DegradationMode, FULL, DEGRADATION_TURNS
+from app.config import (
+    ROUTER_FAST_PATH_ENABLED, LEXICAL_PREROUTER_ENABLED,
+    BATCH_TRIAGE_MAX_WORKERS, BATCH_TRIAGE_WORKERS_LIMIT, MODEL_WARMUP, RAG_PREFETCH_ENABLED,
+    HISTORY_COMPACTION_ENABLED, TRIAGE_CACHE_ENABLED, SINGLE_FLIGHT_ENABLED, CHAT_DUPLICATE_WINDOW_S
+)
+from app.logger import get_api_logger, bind_log_context
+from app.metrics import REGISTRY, REQUESTS, REQUEST_DURATION, CONTENT_TYPE
+from app.translations import get_translation, get_triage_message, DEFAULT_LANGUAGE
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
+import json
 
 # Logger per questo modulo
 logger = get_api_logger()
 
 # --- SETUP APPLICAZIONE ---
-app = FastAPI(title="Multi-Agent Conversational RAG Triage Bot API")
+def warm_up_models():
+    """Carica embedder, reranker e prototipi del router (altrimenti caricati alla prima richiesta)."""
+    start = time.perf_counter()
+    try:
+        rag_handler.warmup()
+        if router_agent.vector_router:
+            router_agent.vector_router._ensure_built()
+        logger.info(f"Warm-up modelli completato in {time.perf_counter() - start:.1f}s.")
+    except Exception as e:
+        logger.error(f"Warm-up modelli fallito (verranno caricati al primo uso): {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvio: i modelli pesanti non vengono costruiti all'import del modulo ma qui (vedi MODEL_WARMUP)."""
+    if MODEL_WARMUP == "blocking":
+        await asyncio.to_thread(warm_up_models)
+    elif MODEL_WARMUP == "background":
+        threading.Thread(target=warm_up_models, name="model-warmup", daemon=True).start()
+    yield
+
+app = FastAPI(title="Multi-Agent Conversational RAG Triage Bot API", lifespan=lifespan)
 
 # --- CONFIGURAZIONE PERCORSI ---
 # Calcoliamo i percorsi assoluti per evitare errori "File not found"
@@ -33,6 +74,34 @@ MAIN_PY_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(MAIN_PY_DIR) 
 VECTOR_DB_PATH = os.path.join(PROJECT_ROOT, "vector_dbs") 
 
+# --- METRICHE HTTP E CONTESTO DEI LOG ---
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Conta le richieste e ne misura la durata per endpoint (template della route, non il path grezzo).
+    Assegna un request_id (o riusa l'header X-Request-ID) che compare in tutti i log della richiesta.
+    Per le richieste che chiamano Ollama registra il prompt eval risparmiato dal riuso della KV cache.
+    """
+    start = time.perf_counter()
+    status = 500
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    bind_log_context(request_id=request_id)
+    turn = begin_turn()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "other")
+        REQUESTS.inc(endpoint=endpoint, status=str(status))
+        REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+        if turn["calls"]:
+            TURN_PROMPT_EVAL_SAVED.observe(turn["prompt_eval_saved_seconds"], endpoint=endpoint)
+            logger.debug("Riuso KV cache: %d token di prompt, %.2fs di prompt eval risparmiati su %d chiamate LLM",
+                         turn["cached_tokens"], turn["prompt_eval_saved_seconds"], turn["calls"])
+
 # Mount Static Files
 app.mount("/static", StaticFiles(directory=os.path.join(MAIN_PY_DIR, "static")), name="static")
 
@@ -56,13 +125,41 @@ else:
 logger.info("Inizializzazione Motori IA...")
 rag_handler = RAGHandler(base_db_path=VECTOR_DB_PATH) 
 triage_engine = TriageEngine()
+# Retrieval + reranking in background mentre lo specialista fa le sue domande
+rag_prefetcher = RAGPrefetcher(rag_handler) if RAG_PREFETCH_ENABLED else None
+# Analisi di casi equivalenti riusate (le regole del TriageEngine vengono sempre rieseguite)
+triage_cache = (
+    TriageCache(rag_handler.embedding_function, rag_handler._resolve_db_path) if TRIAGE_CACHE_ENABLED else None
+)
 router_agent = RouterAgent(available_specialists=AVAILABLE_SPECIALISTS)
+if ROUTER_FAST_PATH_ENABLED:
+    # Fast path vettoriale: prototipi costruiti alla prima richiesta di routing
+    router_agent.vector_router = VectorRouter(
+        rag_handler.embedding_function,
+        router_agent.specialist_descriptions,
+        AVAILABLE_SPECIALISTS,
+        rag_handler=rag_handler
+    )
 assistant_agent = AssistantAgent() # Agente Scriba
+# Riassunto progressivo dei turni vecchi + ultimi messaggi nei prompt di router e specialista
+history_compactor = HistoryCompactor() if HISTORY_COMPACTION_ENABLED else None
 image_analyzer = ImageAnalyzer() # Inizializza Analizzatore Immagini
 session_manager = SessionManager() # Inizializza Gestore Sessioni
+lexical_matcher = get_lexical_matcher() # Automa Aho-Corasick per red flag e parole chiave
 
-# Cache per le istanze degli specialisti (per non ricrearli ad ogni chiamata)
+# Cache per le istanze degli agenti (per non ricrearli ad ogni chiamata).
+# Una istanza per lingua: i turni di sessioni diverse girano in parallelo e non
+# possono cambiare la lingua di un agente condiviso.
 specialist_agents_instances = {}
+language_agents = {}
+language_agents_lock = threading.Lock()
+
+# Turni di chat: uno alla volta per sessione, messaggi identici in corso (doppio invio) coalescenti.
+# Solo con un `message_id` del client la risposta resta condivisa anche dopo la fine del turno (retry):
+# senza, la stessa risposta data a due domande diverse ("no", "no") sono due turni distinti.
+session_locks = KeyedLocks("chat_session")
+chat_turn_flight = SingleFlight("chat_turn")
+chat_retry_flight = SingleFlight("chat_retry", linger_s=CHAT_DUPLICATE_WINDOW_S)
 
 # --- MODELLI DATI API (Pydantic) ---
 class UserMessage(BaseModel):
@@ -70,6 +167,7 @@ class UserMessage(BaseModel):
     session_id: str
     image_data: Optional[str] = None  # Base64 string
     language: Optional[str] = "en"  # "en" or "it", default English
+    message_id: Optional[str] = None  # Id del messaggio scelto dal client, uguale nei retry
 
 class ResetRequest(BaseModel):
     session_id: Optional[str] = None
@@ -83,22 +181,89 @@ class AgentResponse(BaseModel):
     extracted_info: Optional[Dict] = None
     extra_messages: Optional[List[Dict]] = None
     patient_data: Optional[Dict] = None
+    pipeline_mode: str = "full"  # Modalità della pipeline sotto carico (vedi app/logic/degradation.py)
+
+class TriageCase(BaseModel):
+    case_id: Optional[str] = None
+    specialty: Optional[str] = None  # Se assente il caso viene instradato dal router
+    summary: Optional[str] = None    # Se assente viene ricostruito da patient_data
+    patient_data: Dict[str, Any] = {}  # Stessa forma dei dati dell'AssistantAgent
+    extracted_data: Dict[str, Any] = {}  # Parametri vitali (temperature_celsius, pain_score, systolic, diastolic)
+    language: Optional[str] = "en"
+
+class BatchTriageRequest(BaseModel):
+    cases: List[TriageCase]
+    max_workers: Optional[int] = BATCH_TRIAGE_MAX_WORKERS
 
 # --- FUNZIONI HELPER ---
 def get_specialist_agent(specialist_name: str, language: str = "en") -> Optional[SpecialistAgent]:
-    """Factory per ottenere o creare l'agente specialista richiesto."""
+    """Factory per ottenere o creare l'agente specialista richiesto (una istanza per lingua)."""
     name_lower = specialist_name.lower()
     if name_lower not in AVAILABLE_SPECIALISTS:
         return None
     
-    if name_lower not in specialist_agents_instances:
-        specialist_agents_instances[name_lower] = SpecialistAgent(
-            name_lower, rag_handler, triage_engine, language=language
-        )
-    else:
-        # Aggiorna la lingua se già esiste
-        specialist_agents_instances[name_lower].set_language(language)
-    return specialist_agents_instances[name_lower]
+    key = (name_lower, language)
+    with language_agents_lock:
+        if key not in specialist_agents_instances:
+            specialist_agents_instances[key] = SpecialistAgent(
+                name_lower, rag_handler, triage_engine, language=language, triage_cache=triage_cache
+            )
+        return specialist_agents_instances[key]
+
+def get_language_agents(language: str):
+    """Router e AssistantAgent nella lingua richiesta (il router condivide fast path e pre-router)."""
+    with language_agents_lock:
+        if language not in language_agents:
+            router = copy.copy(router_agent)
+            router.set_language(language)
+            language_agents[language] = (router, AssistantAgent(language=language))
+        return language_agents[language]
+
+def schedule_rag_prefetch(session_id: str, specialist: SpecialistAgent, summary: str, patient_data: dict,
+                          mode: DegradationMode = FULL):
+    """Avvia/aggiorna il prefetch RAG della sessione con la query (e la profondità) che userebbe il triage adesso."""
+    if rag_prefetcher:
+        rag_prefetcher.schedule(session_id, specialist.specialty, specialist.build_rag_query(summary, patient_data),
+                                mode.retrieval_k or RETRIEVAL_K, mode.rerank_top_n or RERANK_TOP_N)
+
+def take_rag_prefetch(session_id: str, specialist: SpecialistAgent, summary: str, patient_data: dict,
+                      mode: DegradationMode = FULL) -> Optional[list]:
+    """Candidati precaricati se la query del triage coincide con l'ultima precaricata, altrimenti None."""
+    if not rag_prefetcher:
+        return None
+    return rag_prefetcher.take(session_id, specialist.specialty, specialist.build_rag_query(summary, patient_data),
+                               mode.rerank_top_n or RERANK_TOP_N)
+
+def discard_session_caches(session_id: str):
+    """Dimentica prefetch RAG e riassunto in attesa di una sessione conclusa o resettata."""
+    if rag_prefetcher:
+        rag_prefetcher.discard(session_id)
+    if history_compactor:
+        history_compactor.discard(session_id)
+
+def compact_history(session_id: str, session_state: dict, agent: str) -> Optional[list]:
+    """Cronologia compattata per il prompt dell'agente (None = finestra degli ultimi 12 messaggi)."""
+    if not history_compactor:
+        return None
+    summary_state = history_compactor.sync(session_id, session_state)
+    return history_compactor.build(session_state["chat_history"], summary_state, agent=agent)
+
+def route_batch_case(summary: str, patient_data: dict, language: str) -> Optional[str]:
+    """
+    Instrada un caso del batch che non specifica la specialità (router senza stato di sessione).
+    Usa il router della lingua del caso: quello condiviso resta nella lingua di default e
+    set_language() da un thread del batch lo cambierebbe anche per /chat.
+    """
+    history = [{"role": "user", "content": summary}]
+    router, _ = get_language_agents(language)
+    decision = router.decide_routing(history, patient_data)
+    if decision.get("action") == "route_to_specialist":
+        return decision.get("specialist")
+    return None
+
+def create_batch_specialist(specialty: str, language: str) -> SpecialistAgent:
+    """Agente dedicato al batch: non condivide lo stato lingua con gli agenti di /chat."""
+    return SpecialistAgent(specialty, rag_handler, triage_engine, language=language, triage_cache=triage_cache)
 
 # --- BACKGROUND TASK: PULIZIA SESSIONI ---
 # --- BACKGROUND TASK: PULIZIA SESSIONI ---
@@ -124,11 +289,35 @@ def get_specialist_agent(specialist_name: str, language: str = "en") -> Optional
 async def handle_chat(user_message: UserMessage):
     """
     Gestisce il flusso conversazionale.
+    Il turno gira in un thread (le altre sessioni non aspettano); i turni della stessa
+    sessione sono serializzati e un messaggio identico già in corso (doppio invio) riceve
+    la stessa risposta invece di rieseguire la pipeline. Un retry con lo stesso
+    `message_id` la riceve anche entro CHAT_DUPLICATE_WINDOW_S dalla fine del turno.
+    """
+    if SINGLE_FLIGHT_ENABLED:
+        key = make_key(user_message.session_id, user_message.message, user_message.image_data, user_message.language,
+                       user_message.message_id)
+        flight = chat_retry_flight if user_message.message_id else chat_turn_flight
+        return await asyncio.to_thread(flight.do, key, run_chat_turn, user_message)
+    return await asyncio.to_thread(run_chat_turn, user_message)
+
+def run_chat_turn(user_message: UserMessage) -> AgentResponse:
+    """Un turno alla volta per sessione; la modalità della pipeline (carico attuale) vale per tutto il turno."""
+    with session_locks.hold(user_message.session_id):
+        mode = degradation.controller.mode()
+        DEGRADATION_TURNS.inc(mode=mode.name)
+        response = process_chat_turn(user_message, mode)
+        response.pipeline_mode = mode.name
+        return response
+
+def process_chat_turn(user_message: UserMessage, mode: DegradationMode = FULL) -> AgentResponse:
+    """
     1. Recupera stato sessione da SQLite.
     2. Esegue logica Agente (Router o Specialista).
     3. Salva nuovo stato su SQLite (o cancella se finito).
     """
     session_id = user_message.session_id
+    bind_log_context(session_id=session_id)
 
     # 1. Recupera la sessione dal DB
     session_state = session_manager.load_session(session_id)
@@ -143,6 +332,7 @@ async def handle_chat(user_message: UserMessage):
             "language": user_message.language or DEFAULT_LANGUAGE
         }
         session_manager.save_session(session_id, session_state)
+        discard_session_caches(session_id)
         # Resetta anche i dati clinici
         assistant_agent._save_data(session_id, {
             "symptoms": [], "duration": [], "negative_findings": [],
@@ -162,7 +352,7 @@ async def handle_chat(user_message: UserMessage):
         try:
             if session_state["current_agent"] in AVAILABLE_SPECIALISTS:
                 logger.warning(f"DIAGNOSI FORZATA RICHIESTA (Sessione: {session_id})")
-                active_specialist = get_specialist_agent(session_state["current_agent"])
+                active_specialist = get_specialist_agent(session_state["current_agent"], session_state.get("language", DEFAULT_LANGUAGE))
                 
                 # Genera un sommario al volo dai messaggi utente
                 summary_forced = " ".join([m['content'] for m in session_state["chat_history"] if m['role'] == 'user'])
@@ -170,8 +360,10 @@ async def handle_chat(user_message: UserMessage):
                 # Carica i dati del paziente (senza aggiornarli con "/diagnose")
                 patient_data = assistant_agent._load_data(session_id)
 
-                # Forza l'analisi
-                triage_result = active_specialist.perform_analysis_and_triage(summary_forced, {}, patient_data)
+                # Forza l'analisi (con i candidati del prefetch RAG, se ancora validi)
+                prefetched = take_rag_prefetch(session_id, active_specialist, summary_forced, patient_data, mode)
+                triage_result = active_specialist.perform_analysis_and_triage(summary_forced, {}, patient_data, prefetched,
+                                                                              mode)
                 
                 if triage_result.get("type") == "triage_result":
                     data = triage_result.get("data", {})
@@ -224,19 +416,52 @@ async def handle_chat(user_message: UserMessage):
     request_lang = user_message.language or DEFAULT_LANGUAGE
     if "language" not in session_state or session_state["language"] != request_lang:
         session_state["language"] = request_lang
-        # Aggiorna la lingua degli agenti
-        router_agent.set_language(request_lang)
-        assistant_agent.set_language(request_lang)
     lang = session_state.get("language", DEFAULT_LANGUAGE)
+    # Agenti nella lingua della sessione
+    session_router, session_assistant = get_language_agents(lang)
+
+    # --- PRE-TRIAGE LESSICALE: RED FLAG DI EMERGENZA ---
+    # Scansione del messaggio grezzo in microsecondi: in caso di emergenza nessun LLM viene chiamato
+    if LEXICAL_PREROUTER_ENABLED:
+        red_flags = lexical_matcher.find_red_flags(user_message.message)
+        if red_flags:
+            logger.warning(f"RED FLAG rilevate (Sessione: {session_id[:8]}...): {red_flags} -> URGENTE")
+            urgent = get_triage_message(lang, "cura_urgente")
+            md_response = get_translation(lang, "red_flag_detected", terms=", ".join(red_flags))
+            md_response += f"\n\n**Outcome: {urgent['livello']}**\n\n{urgent['messaggio']}"
+
+            # Sessione conclusa: come dopo un triage completo
+            session_manager.save_session(session_id, {
+                "chat_history": [], "current_agent": "router", "last_summary": "", "asked_questions": []
+            })
+            return AgentResponse(
+                response=md_response,
+                agent_type=session_state["current_agent"],
+                is_final=True,
+                extracted_info={"red_flags": red_flags},
+                patient_data=assistant_agent._load_data(session_id)
+            )
 
     # --- GESTIONE IMMAGINE ---
+    # Sotto carico (modalità deferred_images) l'analisi resta in sessione fino a un turno con meno carico
     image_context = ""
-    if user_message.image_data:
-        logger.info("Immagine ricevuta. Avvio analisi...")
-        image_description = image_analyzer.analyze_image(user_message.image_data)
-        image_context = f"\n\n[SYSTEM NOTE: User uploaded an image. Visual analysis detects: {image_description}]"
-        # Add analysis to history as system message
-        session_state["chat_history"].append({"role": "system", "content": f"User Image Analysis: {image_description}"})
+    pending_images = session_state.pop("pending_images", [])
+    if mode.defer_images and (pending_images or user_message.image_data):
+        session_state["pending_images"] = pending_images + ([user_message.image_data] if user_message.image_data else [])
+        logger.info(f"Analisi di {len(session_state['pending_images'])} immagini rimandata (modalità {mode.name}).")
+        if user_message.image_data:
+            image_context = "\n\n[SYSTEM NOTE: User uploaded an image. Visual analysis is deferred (server under load).]"
+    else:
+        for image_data in pending_images:
+            logger.info("Analisi di un'immagine rimandata da un turno precedente...")
+            image_description = image_analyzer.analyze_image(image_data)
+            session_state["chat_history"].append({"role": "system", "content": f"User Image Analysis: {image_description}"})
+        if user_message.image_data:
+            logger.info("Immagine ricevuta. Avvio analisi...")
+            image_description = image_analyzer.analyze_image(user_message.image_data)
+            image_context = f"\n\n[SYSTEM NOTE: User uploaded an image. Visual analysis detects: {image_description}]"
+            # Add analysis to history as system message
+            session_state["chat_history"].append({"role": "system", "content": f"User Image Analysis: {image_description}"})
 
     # Aggiungi messaggio utente alla cronologia (con eventuale contesto immagine appeso per chiarezza)
     full_user_message = user_message.message + image_context
@@ -255,7 +480,7 @@ async def handle_chat(user_message: UserMessage):
                 last_agent_msg = msg["content"]
                 break
 
-    patient_data = assistant_agent.update_patient_data(session_id, user_message.message, last_agent_msg)
+    patient_data = session_assistant.update_patient_data(session_id, user_message.message, last_agent_msg)
 
     # Response variables
     agent_response_content = "Unexpected error."
@@ -269,7 +494,9 @@ async def handle_chat(user_message: UserMessage):
     try:
         # --- CASO 1: ROUTER (Smistamento) ---
         if agent_type == "router":
-            router_decision = router_agent.decide_routing(current_history, patient_data)
+            prompt_history = compact_history(session_id, session_state, "router")
+            router_decision = session_router.decide_routing(current_history, patient_data, prompt_history,
+                                                            fast_router=mode.fast_router)
             action = router_decision.get("action")
 
             if action == "ask_general_followup":
@@ -281,10 +508,14 @@ async def handle_chat(user_message: UserMessage):
                 summary = router_decision.get("summary")
                 
                 # Verifichiamo che lo specialista esista
-                if get_specialist_agent(specialist_name, lang):
+                new_specialist = get_specialist_agent(specialist_name, lang)
+                if new_specialist:
                     session_state["current_agent"] = specialist_name
                     session_state["last_summary"] = summary
                     agent_type = specialist_name
+
+                    # Retrieval + reranking partono subito, mentre lo specialista fa le sue domande
+                    schedule_rag_prefetch(session_id, new_specialist, summary, patient_data, mode)
                     
                     # 1. Router Message (Transition) - tradotto
                     router_msg = get_translation(lang, "connecting_specialist", specialist=specialist_name.capitalize())
@@ -312,7 +543,10 @@ async def handle_chat(user_message: UserMessage):
             
             # Decide se chiedere altro o fare triage
             asked_questions = session_state.get("asked_questions", [])
-            decision = active_specialist.decide_next_action(current_history, patient_data, asked_questions)
+            # Nuovi sintomi in questo turno: il prefetch RAG si aggiorna in parallelo alla decisione
+            schedule_rag_prefetch(session_id, active_specialist, session_state.get("last_summary"), patient_data, mode)
+            prompt_history = compact_history(session_id, session_state, "specialist_decision")
+            decision = active_specialist.decide_next_action(current_history, patient_data, asked_questions, prompt_history)
             action = decision.get("action")
 
             if action == "ask_specialist_followup":
@@ -330,7 +564,10 @@ async def handle_chat(user_message: UserMessage):
                 extracted_data = decision.get("extracted_data", {})
                 
                 # Esegue RAG + Logica Simbolica (Passiamo anche i dati del paziente!)
-                triage_result = active_specialist.perform_analysis_and_triage(summary, extracted_data, patient_data)
+                # Se la query coincide con quella precaricata resta solo la generazione
+                prefetched = take_rag_prefetch(session_id, active_specialist, summary, patient_data, mode)
+                triage_result = active_specialist.perform_analysis_and_triage(summary, extracted_data, patient_data,
+                                                                              prefetched, mode)
 
                 if triage_result.get("type") == "triage_result":
                     data = triage_result.get("data", {})
@@ -395,6 +632,7 @@ async def handle_chat(user_message: UserMessage):
     # 3. SALVATAGGIO O CANCELLAZIONE SESSIONE
     if is_final:
         logger.info(f"Sessione conclusa: {session_id}")
+        discard_session_caches(session_id)
         # Per ora resettiamo solo lo stato in memoria/file
         session_state = {
             "chat_history": [],
@@ -405,6 +643,10 @@ async def handle_chat(user_message: UserMessage):
         session_manager.save_session(session_id, session_state)
     else:
         session_manager.save_session(session_id, session_state)
+        # Il riassunto dei turni vecchi si aggiorna dopo la risposta, fuori dal percorso critico
+        if history_compactor:
+            history_compactor.schedule_refresh(session_id, session_state["chat_history"],
+                                               session_state.get("history_summary"))
 
     return AgentResponse(
         response=agent_response_content,
@@ -416,6 +658,27 @@ async def handle_chat(user_message: UserMessage):
         patient_data=patient_data
     )
 
+# --- ENDPOINT: TRIAGE IN BATCH ---
+@app.post("/triage/batch")
+def triage_batch(request: BatchTriageRequest):
+    """
+    Triage di molti casi già strutturati, senza turni conversazionali né sessioni su disco.
+    I risultati sono restituiti in streaming come JSONL (una riga per caso, in ordine di completamento),
+    seguiti da una riga di riepilogo con latenze per caso e throughput.
+    """
+    max_workers = max(1, min(request.max_workers or BATCH_TRIAGE_MAX_WORKERS, BATCH_TRIAGE_WORKERS_LIMIT))
+    runner = BatchTriageRunner(
+        create_batch_specialist, route_batch_case, AVAILABLE_SPECIALISTS, max_workers=max_workers
+    )
+    logger.info(f"Batch triage: {len(request.cases)} casi, {max_workers} worker.")
+    cases = (case.model_dump() for case in request.cases)
+
+    def stream():
+        for result in runner.run(cases):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # --- ALTRI ENDPOINT ---
 @app.post("/reset")
 def reset_session_endpoint(request: ResetRequest):
@@ -430,9 +693,44 @@ def reset_session_endpoint(request: ResetRequest):
             "asked_questions": []
         }
         session_manager.save_session(request.session_id, empty_state)
+        discard_session_caches(request.session_id)
         return {"message": f"Sessione {request.session_id} resettata."}
     return {"message": "ID sessione mancante."}
 
+@app.get("/debug/router-stats")
+def router_stats():
+    """Frequenza e accuratezza stimata del fast path vettoriale del router."""
+    if not router_agent.vector_router:
+        return {"enabled": False}
+    return {"enabled": True, **router_agent.vector_router.get_stats()}
+
+@app.get("/debug/triage-cache")
+def triage_cache_stats():
+    """Voci e hit rate della cache semantica del triage per specialità."""
+    if not triage_cache:
+        return {"enabled": False}
+    return {"enabled": True, **triage_cache.get_stats()}
+
+@app.get("/debug/llm-stats")
+def llm_stats_endpoint():
+    """
+    Token e durate delle chiamate a Ollama per agente, specialità e modello (prompt più costosi in cima),
+    più gli esiti dell'output strutturato (validi, riparati, rigenerati, falliti) e, per fase,
+    latenza dei tier di modello e tasso di escalation.
+    """
+    return {**llm_stats.summary(), "structured_output": structured_output.summary(),
+            "model_tiers": model_tiers.summary()}
+
+@app.get("/debug/degradation")
+def degradation_stats():
+    """Modalità attuale della pipeline, segnali di carico (chiamate LLM in corso, rallentamento) e turni per modalità."""
+    return degradation.controller.get_stats()
+
+@app.get("/metrics")
+def metrics():
+    """Metriche in formato Prometheus (durate per fase, esiti, richieste HTTP)."""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 def read_root():
     return FileResponse(os.path.join(MAIN_PY_DIR, "static", "index.html"))
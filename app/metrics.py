@@ -0,0 +1,215 @@
+"""
+Metriche leggere (contatori e istogrammi) esportate in formato Prometheus su /metrics.
+
+Nessuna dipendenza esterna: ogni metrica è un dizionario etichette -> valori protetto
+da un lock, quindi il costo per osservazione è di pochi microsecondi e la
+strumentazione può restare sempre attiva.
+
+Uso tipico:
+    with span("vector_search", specialty="cardiologo"):
+        ...
+    record_outcome("rag_generation", "retry", specialty="cardiologo")
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bucket (secondi) adatti sia a fasi CPU da millisecondi sia a chiamate LLM da decine di secondi
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        # Etichette mancanti -> stringa vuota (evita KeyError sul percorso caldo)
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per etichette: [conteggi per bucket (non cumulativi) + overflow, somma, conteggio]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], dict]:
+        """Per etichette: {"count", "sum", "buckets": [(limite, cumulativo)]}."""
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        result = {}
+        for key, counts, total, count in items:
+            cumulative, running = [], 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                cumulative.append((bound, running))
+            result[key] = {"count": count, "sum": total, "buckets": cumulative}
+        return result
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, state in sorted(self.snapshot().items()):
+            for bound, cumulative in state["buckets"]:
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Testo nel formato di esposizione Prometheus 0.0.4."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registro di processo usato da tutta l'applicazione
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "triage_stage_duration_seconds",
+    "Durata delle fasi della pipeline (estrazione, routing, RAG, LLM, riflessione, I/O sessione).",
+    ("stage", "specialty", "status"),
+)
+STAGE_OUTCOMES = REGISTRY.counter(
+    "triage_stage_outcomes_total",
+    "Esiti notevoli delle fasi (retry, fallback, diagnosi forzata, fast path...).",
+    ("stage", "specialty", "outcome"),
+)
+REQUESTS = REGISTRY.counter(
+    "triage_requests_total",
+    "Richieste HTTP gestite per endpoint e codice di risposta.",
+    ("endpoint", "status"),
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "triage_request_duration_seconds",
+    "Durata delle richieste HTTP per endpoint.",
+    ("endpoint",),
+)
+
+
+@contextmanager
+def span(stage: str, specialty: str = "") -> Iterator[None]:
+    """
+    Misura la durata del blocco e la registra in STAGE_DURATION.
+    Lo status è "error" se il blocco solleva un'eccezione (che viene comunque propagata).
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage, specialty=specialty, status=status)
+
+
+def timed(stage: str):
+    """Decoratore: come span() sull'intera funzione; la specialità è letta da `self.specialty` se presente."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            specialty = getattr(args[0], "specialty", "") if args else ""
+            with span(stage, specialty):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_outcome(stage: str, outcome: str, specialty: str = "", amount: float = 1.0):
+    """Conta un esito notevole di una fase (es. "retry", "fallback", "forced_diagnosis")."""
+    STAGE_OUTCOMES.inc(amount, stage=stage, specialty=specialty, outcome=outcome)
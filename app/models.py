@@ -3,7 +3,10 @@ from typing import List, Literal, Optional
 
 class Condition(BaseModel):
     condition: str = Field(..., description="Il nome della patologia identificata.")
-    probability: str = Field(..., description="La probabilità della condizione basata sui sintomi (High, Medium, Low).")
+    probability: str = Field(
+        ..., description="La probabilità della condizione basata sui sintomi (High, Medium, Low).",
+        json_schema_extra={"enum": ["High", "Medium", "Low"]}  # Vincola l'output strutturato di Ollama
+    )
     reasoning: str = Field(..., description="Breve spiegazione (max 2 frasi) del perché questa condizione è rilevante.")
     treatment: str = Field(default="", description="Suggested treatment or therapy for this condition.")
     
@@ -23,11 +26,24 @@ class Condition(BaseModel):
         raise ValueError(f"Invalid probability '{v}'. Must be High, Medium, or Low (or Italian equivalents).")
 
 class MedicalAnalysis(BaseModel):
-    potential_conditions: List[Condition] = Field(default_factory=list, description="Lista delle condizioni mediche identificate.")
+    # Obbligatoria: nello schema passato a Ollama la chiave non può essere omessa
+    potential_conditions: List[Condition] = Field(..., description="Lista delle condizioni mediche identificate.")
     sources_consulted: List[str] = Field(default_factory=list, description="Elenco dei file sorgente utilizzati.")
 
 class AgentAction(BaseModel):
     action: Literal["ask_specialist_followup", "perform_triage"]
     question: Optional[str] = Field(None, description="La domanda da porre all'utente se action è 'ask_specialist_followup'.")
     summary: Optional[str] = Field(None, description="Il riassunto dei sintomi se action è 'perform_triage'.")
-    extracted_data: Optional[dict] = Field(default_factory=dict, description="Dati numerici estratti (temp, dolore, etc).")
\ No newline at end of file
+    extracted_data: Optional[dict] = Field(default_factory=dict, description="Dati numerici estratti (temp, dolore, etc).")
+
+
+class PatientDataDelta(BaseModel):
+    # Solo i dati nuovi del messaggio: il merge con quelli salvati avviene in AssistantAgent
+    symptoms: List[str] = Field(default_factory=list)
+    duration: List[str] = Field(default_factory=list)
+    negative_findings: List[str] = Field(default_factory=list)
+    medical_history: List[str] = Field(default_factory=list)
+    medications: List[str] = Field(default_factory=list)
+    allergies: List[str] = Field(default_factory=list)
+    vital_signs: dict = Field(default_factory=dict, description="Parametri vitali (nome -> valore).")
+    notes: str = ""
@@ -0,0 +1,278 @@
+"""
+Versioni batch (array in ingresso, array in uscita) dei tool di `medical_calculators`,
+per analisi su coorti di centinaia di migliaia di record.
+
+Le soglie sono tabelle NumPy applicate con `searchsorted`/`select`; gli stessi casi
+limite delle versioni scalari (buchi tra le fasce della febbre, troncamento a intero,
+NaN, valori non convertibili) danno lo stesso risultato. Dove il tool scalare
+ritornerebbe {"error": ...}, qui il record ha `valid = False` e categorie a None.
+
+Ogni funzione ritorna un dizionario di array della stessa lunghezza dell'input.
+Gli array numerici vengono usati direttamente; liste con stringhe ("38,5") o None
+vengono convertite elemento per elemento con lo stesso parser dei tool scalari.
+"""
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.logger import get_triage_logger
+from app.tools.medical_calculators import _safe_float
+
+# Logger per questo modulo
+logger = get_triage_logger()
+
+# Esito della conversione di ogni valore
+OK, MISSING, INVALID, OVERFLOW = 0, 1, 2, 3  # MISSING = None, OVERFLOW = int(inf)
+
+# --- TABELLE DELLE SOGLIE ---
+
+FEVER_CATEGORIES = (
+    ("Ipotermia", "Temperatura pericolosamente bassa."),
+    ("Normale", "Temperatura corporea normale."),
+    ("Febbricola (Subfebbrilità)", "Temperatura leggermente elevata."),
+    ("Febbre Moderata", "Febbre significativa."),
+    ("Febbre Alta", "Febbre molto alta, monitorare con attenzione."),
+    ("Indeterminata", "Valore non valido."),  # Fuori dalle fasce (es. 38.25, NaN)
+)
+
+PAIN_BINS = np.array([1, 4, 7])  # Inizio di Lieve, Moderato, Severo
+PAIN_CATEGORIES = ("Nessun Dolore", "Dolore Lieve", "Dolore Moderato", "Dolore Severo")
+
+DURATION_BINS = np.array([14, 90])  # Fine (inclusa) di Acuta e Subacuta
+DURATION_CATEGORIES = ("Acuta", "Subacuta", "Cronica")
+# Giorni per unità, nello stesso ordine di controllo del tool scalare
+DURATION_UNITS = (
+    (("giorno", "giorni", "day"), 1),
+    (("settimana", "settimane", "week"), 7),
+    (("mese", "mesi", "month"), 30),
+    (("ora", "ore", "hour"), 0),
+)
+
+CURB65_INTERPRETATIONS = (
+    "Rischio Basso (0,7% mortalità). Trattabile a domicilio.",
+    "Rischio Basso (2,1% mortalità). Probabile trattamento domiciliare.",
+    "Rischio Moderato (9,2% mortalità). Considerare ricovero ospedaliero breve.",
+    "Rischio Alto (14,5% mortalità). Ricovero necessario, considerare Terapia Intensiva.",
+    "Rischio Molto Alto (Score 4). Ricovero immediato, considerare Terapia Intensiva.",
+    "Rischio Molto Alto (Score 5). Ricovero immediato, considerare Terapia Intensiva.",
+)
+
+BLOOD_PRESSURE_CATEGORIES = (
+    ("Crisi Ipertensiva", "Crisi ipertensiva. Consultare immediatamente un medico."),
+    ("Ipertensione (Stadio 2)", "Ipertensione di Stadio 2. Consulto medico necessario."),
+    ("Ipertensione (Stadio 1)", "Ipertensione di Stadio 1. Si raccomanda un consulto medico."),
+    ("Elevata", "Pressione elevata. Rischio di sviluppare ipertensione."),
+    ("Normale", "Pressione sanguigna ottimale."),
+    ("Ipotensione (o dati insoliti)", "Valori di pressione bassi (ipotensione) o insoliti."),
+)
+
+# --- HELPER INTERNI ---
+
+def _labels(codes: np.ndarray, labels: Sequence[str]) -> np.ndarray:
+    """Etichette per codice; il codice -1 (record non valido) diventa None."""
+    table = np.array(list(labels) + [None], dtype=object)
+    return table[codes]
+
+
+def _parse_float(values: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Equivalente vettoriale di `_safe_float`: ritorna (valori float64, esito per record)."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        return arr.astype(np.float64).ravel(), np.zeros(arr.size, dtype=np.int8)
+
+    items = arr.ravel().tolist()
+    out = np.full(len(items), np.nan)
+    status = np.zeros(len(items), dtype=np.int8)
+    for i, value in enumerate(items):
+        if value is None:
+            status[i] = MISSING
+            continue
+        try:
+            out[i] = _safe_float(value)
+        except ValueError:
+            status[i] = INVALID
+    return out, status
+
+
+def _parse_int(values: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Equivalente vettoriale di `_safe_int` (troncamento verso zero; NaN non valido, inf in overflow)."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biu":
+        return arr.astype(np.int64).ravel(), np.zeros(arr.size, dtype=np.int8)
+
+    floats, status = _parse_float(arr)
+    parsed = status == OK
+    status[parsed & np.isnan(floats)] = INVALID
+    status[parsed & np.isinf(floats)] = OVERFLOW
+    ints = np.zeros(floats.size, dtype=np.int64)
+    ok = status == OK
+    ints[ok] = np.trunc(floats[ok])
+    return ints, status
+
+
+def _parse_optional(values: Any, size: int, parser) -> Tuple[np.ndarray, np.ndarray]:
+    """Parametro opzionale: None per tutta la colonna equivale a una colonna di None."""
+    if values is None:
+        return np.zeros(size, dtype=np.float64), np.full(size, MISSING, dtype=np.int8)
+    return parser(values)
+
+
+def _truthy(values: Any) -> np.ndarray:
+    """bool(x) per ogni elemento (bool("False") è True, come nel tool scalare)."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        return arr.ravel() != 0  # NaN != 0 come bool(nan)
+    return np.fromiter((bool(v) for v in arr.ravel().tolist()), dtype=bool, count=arr.size)
+
+
+def _unit_days(unit: str) -> Optional[int]:
+    unit = unit.lower().strip()
+    for keywords, days in DURATION_UNITS:
+        if any(x in unit for x in keywords):
+            return days
+    return None
+
+
+def _log_batch(tool: str, valid: np.ndarray):
+    logger.debug("Tool batch %s: %d record, %d non validi", tool, valid.size, int(valid.size - valid.sum()))
+
+# --- TOOL GENERICI ---
+
+def classify_fever_batch(temperatures_celsius: Any) -> Dict[str, np.ndarray]:
+    """Batch di `classify_fever`: temperature (float, NaN per i non validi), categoria e interpretazione."""
+    temps, status = _parse_float(temperatures_celsius)
+    valid = status == OK
+
+    with np.errstate(invalid="ignore"):
+        codes = np.select(
+            [temps < 35.0, temps < 37.6, (temps >= 37.6) & (temps <= 38.2),
+             (temps >= 38.3) & (temps <= 39.4), temps >= 39.5],
+            [0, 1, 2, 3, 4],
+            default=5,
+        )
+    codes[~valid] = -1
+
+    _log_batch("classify_fever", valid)
+    return {
+        "temperature_input_celsius": np.where(valid, temps, np.nan),
+        "category": _labels(codes, [c for c, _ in FEVER_CATEGORIES]),
+        "interpretation": _labels(codes, [i for _, i in FEVER_CATEGORIES]),
+        "valid": valid,
+    }
+
+
+def classify_pain_level_batch(scores: Any) -> Dict[str, np.ndarray]:
+    """Batch di `classify_pain_level` (NRS 0-10; fuori scala = non valido)."""
+    values, status = _parse_int(scores)
+    valid = (status == OK) & (values >= 0) & (values <= 10)
+
+    codes = np.searchsorted(PAIN_BINS, values, side="right")
+    codes[~valid] = -1
+
+    _log_batch("classify_pain_level", valid)
+    return {
+        "score_input": np.where(valid, values, -1),
+        "category": _labels(codes, PAIN_CATEGORIES),
+        "valid": valid,
+    }
+
+
+def classify_symptom_duration_batch(duration_values: Any, duration_units: Any) -> Dict[str, np.ndarray]:
+    """
+    Batch di `classify_symptom_duration`. `duration_units` può essere una sola unità
+    per tutti i record; le unità vengono risolte una volta per valore distinto.
+    """
+    values, status = _parse_int(duration_values)
+    units = np.asarray(duration_units, dtype=object).ravel()
+    if units.size == 1:
+        units = np.repeat(units, values.size)
+
+    unique_units, inverse = np.unique(units.astype(str), return_inverse=True)
+    days_per_unit = [_unit_days(u) for u in unique_units.tolist()]
+    known = np.array([d is not None for d in days_per_unit], dtype=bool)[inverse]
+    multiplier = np.array([d or 0 for d in days_per_unit], dtype=np.int64)[inverse]
+
+    valid = (status == OK) & known
+    total_days = values * multiplier
+    codes = np.searchsorted(DURATION_BINS, total_days, side="left")
+    codes[~valid] = -1
+
+    _log_batch("classify_symptom_duration", valid)
+    return {
+        "total_days_approx": np.where(valid, total_days, -1),
+        "category": _labels(codes, DURATION_CATEGORIES),
+        "valid": valid,
+    }
+
+# --- TOOL SPECIFICI ---
+
+def calculate_simple_curb65_batch(ages: Any, confusion: Any, respiratory_rates: Any, urea_mmol_l: Any = None,
+                                  systolic_bp: Any = None, diastolic_bp: Any = None) -> Dict[str, np.ndarray]:
+    """
+    Batch di `calculate_simple_curb65`. Al posto della lista testuale `factors`
+    ritorna un array booleano per criterio; urea e pressione mancanti o non valide
+    non contano (come nel tool scalare), e `*_invalid` segnala i dati non validi.
+    """
+    age, age_status = _parse_int(ages)
+    resp, resp_status = _parse_int(respiratory_rates)
+    size = age.size
+    confused = _truthy(confusion)
+    urea, urea_status = _parse_optional(urea_mmol_l, size, _parse_float)
+    sys_val, sys_status = _parse_optional(systolic_bp, size, _parse_int)
+    dia_val, dia_status = _parse_optional(diastolic_bp, size, _parse_int)
+
+    # La pressione si valuta solo se entrambe presenti; la sistolica viene convertita per prima
+    bp_present = (sys_status != MISSING) & (dia_status != MISSING)
+    bp_overflow = bp_present & ((sys_status == OVERFLOW) | ((sys_status == OK) & (dia_status == OVERFLOW)))
+    bp_ok = bp_present & (sys_status == OK) & (dia_status == OK)
+
+    valid = (age_status == OK) & (resp_status == OK) & ~bp_overflow
+
+    with np.errstate(invalid="ignore"):
+        criteria = {
+            "age_65": age >= 65,
+            "confusion": confused,
+            "respiratory_rate_30": resp >= 30,
+            "urea_7": (urea_status == OK) & (urea > 7),
+            "low_blood_pressure": bp_ok & ((sys_val < 90) | (dia_val <= 60)),
+        }
+    score = np.sum(list(criteria.values()), axis=0, dtype=np.int64)
+    codes = np.where(valid, score, -1)
+
+    _log_batch("calculate_simple_curb65", valid)
+    result = {name: flags & valid for name, flags in criteria.items()}
+    result.update({
+        "score": codes,
+        "interpretation": _labels(codes, CURB65_INTERPRETATIONS),
+        "urea_invalid": valid & (urea_status == INVALID),
+        "blood_pressure_invalid": valid & bp_present & ~bp_ok,
+        "valid": valid,
+    })
+    return result
+
+
+def classify_blood_pressure_batch(systolic: Any, diastolic: Any) -> Dict[str, np.ndarray]:
+    """Batch di `classify_blood_pressure` (stesso ordine di precedenza delle fasce)."""
+    sys_val, sys_status = _parse_int(systolic)
+    dia_val, dia_status = _parse_int(diastolic)
+    valid = (sys_status == OK) & (dia_status == OK)
+
+    codes = np.select(
+        [(sys_val > 180) | (dia_val > 120),
+         (sys_val >= 140) | (dia_val >= 90),
+         ((sys_val >= 130) & (sys_val <= 139)) | ((dia_val >= 80) & (dia_val <= 89)),
+         (sys_val >= 120) & (sys_val <= 129) & (dia_val < 80),
+         (sys_val < 120) & (dia_val < 80)],
+        [0, 1, 2, 3, 4],
+        default=5,
+    )
+    codes[~valid] = -1
+
+    _log_batch("classify_blood_pressure", valid)
+    return {
+        "category": _labels(codes, [c for c, _ in BLOOD_PRESSURE_CATEGORIES]),
+        "interpretation": _labels(codes, [i for _, i in BLOOD_PRESSURE_CATEGORIES]),
+        "systolic_input": np.where(valid, sys_val, -1),
+        "diastolic_input": np.where(valid, dia_val, -1),
+        "valid": valid,
+    }
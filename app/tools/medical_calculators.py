@@ -69,7 +69,7 @@ def classify_fever(temperature_celsius: Any) -> Dict[str, Any]:
             "category": category,
             "interpretation": interpretation
         }
-        logger.debug(f"Tool Simbolico Eseguito: {result}")
+        logger.debug("Tool Simbolico Eseguito: %s", result)
         return result
         
     except Exception as e:
@@ -100,7 +100,7 @@ def classify_pain_level(score: Any) -> Dict[str, Any]:
             "score_input": score_int,
             "category": category
         }
-        logger.debug(f"Tool Simbolico Eseguito: {result}")
+        logger.debug("Tool Simbolico Eseguito: %s", result)
         return result
 
     except Exception as e:
@@ -141,7 +141,7 @@ def classify_symptom_duration(duration_value: Any, duration_unit: str) -> Dict[s
             "total_days_approx": total_days,
             "category": category
         }
-        logger.debug(f"Tool Simbolico Eseguito: {result}")
+        logger.debug("Tool Simbolico Eseguito: %s", result)
         return result
         
     except Exception as e:
@@ -165,15 +165,12 @@ IMPORTANTE:
 # =============================================================================
 # ASSISTANT AGENT PROMPTS
 # =============================================================================
+# Le parti variabili ({context}, {user_message}) stanno in fondo: tutto il resto è un
+# prefisso fisso che Ollama riusa dalla KV cache a ogni messaggio.
 ASSISTANT_EXTRACTION_PROMPTS = {
     "en": """
 You are a medical "Scribe" assistant. Your task is to analyze the last user message and EXTRACT ONLY NEW INFORMATION.
 
-{context}
-
-New user message:
-"{user_message}"
-
 Instructions:
 1. Identify ONLY NEW or UPDATED information present in this message.
 2. DO NOT include old information not mentioned here.
@@ -201,14 +198,14 @@ Respond EXCLUSIVELY with a valid JSON with ONLY the found fields (leave empty li
     "vital_signs": {{}},
     "notes": ""
 }}
-""",
-    "it": """
-Sei un assistente medico "Scriba". Il tuo compito è analizzare l'ultimo messaggio dell'utente ed ESTRARRE SOLO NUOVE INFORMAZIONI.
 
 {context}
 
-Nuovo messaggio utente:
+New user message:
 "{user_message}"
+""",
+    "it": """
+Sei un assistente medico "Scriba". Il tuo compito è analizzare l'ultimo messaggio dell'utente ed ESTRARRE SOLO NUOVE INFORMAZIONI.
 
 Istruzioni:
 1. Identifica SOLO informazioni NUOVE o AGGIORNATE presenti in questo messaggio.
@@ -237,6 +234,11 @@ Rispondi ESCLUSIVAMENTE con un JSON valido con SOLO i campi trovati (lascia list
     "vital_signs": {{}},
     "notes": ""
 }}
+
+{context}
+
+Nuovo messaggio utente:
+"{user_message}"
 """
 }
 
@@ -257,7 +259,8 @@ UI_MESSAGES = {
         "clarify_symptom": "Could you describe your symptoms better?",
         "repeat_symptom": "Excuse me, I got confused for a moment. Can you repeat the last symptom?",
         "not_understood": "I'm not sure I understood. Can you give me more details?",
-        "validation_error": "Sorry, I didn't understand well. Can you repeat the main symptom?"
+        "validation_error": "Sorry, I didn't understand well. Can you repeat the main symptom?",
+        "red_flag_detected": "⚠️ Your message describes a possible emergency sign: **{terms}**."
     },
     "it": {
         "connecting_specialist": "Ti sto mettendo in contatto con lo specialista **{specialist}**. Un momento...",
@@ -272,7 +275,8 @@ UI_MESSAGES = {
         "clarify_symptom": "Puoi descrivere meglio i tuoi sintomi?",
         "repeat_symptom": "Scusa, mi sono confuso per un momento. Puoi ripetere l'ultimo sintomo?",
         "not_understood": "Non sono sicuro di aver capito. Puoi darmi più dettagli?",
-        "validation_error": "Scusa, non ho capito bene. Puoi ripetere il sintomo principale?"
+        "validation_error": "Scusa, non ho capito bene. Puoi ripetere il sintomo principale?",
+        "red_flag_detected": "⚠️ Il tuo messaggio descrive un possibile segnale d'allarme: **{terms}**."
     }
 }
 
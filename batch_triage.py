@@ -0,0 +1,68 @@
+import sys
+import json
+import argparse
+import requests
+from app.config import API_BASE_URL, BATCH_TRIAGE_MAX_WORKERS
+
+
+def load_cases(path: str) -> list:
+    """
+    Legge i casi da un file JSONL (un caso per riga) oppure JSON (lista di casi).
+    Ogni caso: {"case_id", "specialty", "summary", "patient_data", "extracted_data", "language"}.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data["cases"] if isinstance(data, dict) else data
+
+
+def run_batch(cases: list, output, max_workers: int, base_url: str = API_BASE_URL, timeout: int = 3600) -> dict:
+    """Invia i casi a /triage/batch e scrive i risultati JSONL man mano che arrivano."""
+    summary = {}
+    with requests.post(
+        f"{base_url}/triage/batch",
+        json={"cases": cases, "max_workers": max_workers},
+        stream=True,
+        timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            result = json.loads(line)
+            if result.get("type") == "summary":
+                summary = result
+            else:
+                status = "✅" if result.get("status") == "ok" else "❌"
+                print(f"{status} {result.get('case_id')}: {result.get('livello', result.get('error'))} "
+                      f"({result.get('latency_ms')} ms)", file=sys.stderr)
+            output.write(line + "\n")
+            output.flush()
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Triage in batch di casi strutturati tramite l'endpoint /triage/batch.")
+    parser.add_argument("input", type=str, help="File .jsonl (un caso per riga) o .json (lista di casi).")
+    parser.add_argument("-o", "--output", type=str, default=None, help="File JSONL dei risultati (default: stdout).")
+    parser.add_argument("--workers", type=int, default=BATCH_TRIAGE_MAX_WORKERS, help="Casi elaborati in parallelo dal server.")
+    parser.add_argument("--url", type=str, default=API_BASE_URL, help="Indirizzo del backend.")
+
+    args = parser.parse_args()
+
+    cases = load_cases(args.input)
+    print(f"Invio di {len(cases)} casi a {args.url}/triage/batch ({args.workers} worker)...", file=sys.stderr)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        summary = run_batch(cases, output, args.workers, base_url=args.url)
+    finally:
+        if args.output:
+            output.close()
+
+    if summary:
+        latency = summary.get("latency_ms", {})
+        print(f"\n{summary['cases']} casi ({summary['errors']} errori) in {summary['total_seconds']}s - "
+              f"{summary['throughput_cases_per_sec']} casi/s, latenza p50 {latency.get('p50')} ms, "
+              f"p95 {latency.get('p95')} ms", file=sys.stderr)
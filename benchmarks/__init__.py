@@ -0,0 +1,8 @@
+"""
+Micro-benchmark per fase della pipeline di triage.
+
+Ogni fase (estrazione dati, routing, RAG retrieve/rerank/generate, riflessione,
+motore simbolico) viene eseguita in isolamento su input fissi contro un server
+Ollama finto, così i costi CPU di retrieval e reranking sono misurabili anche
+senza un modello reale. Uso: `python -m benchmarks.run --help`.
+"""
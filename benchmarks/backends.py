@@ -0,0 +1,164 @@
+"""
+Confronto tra backend di inferenza (torch vs ONNX / ONNX int8) per embedder e reranker.
+
+    python -m benchmarks.backends --specialty cardiologo
+    python -m benchmarks.backends --candidates onnx-int8 --reranker-max-length 256 --threads 4
+
+Per ogni backend candidato riporta l'accordo con il modello PyTorch di riferimento
+(similarità coseno degli embedding, sovrapposizione dei top-k recuperati,
+correlazione di Spearman e sovrapposizione dei top-10 del reranker) e le latenze.
+I passaggi vengono letti dal DB vettoriale della specialità, se presente,
+altrimenti si usa il piccolo corpus di `benchmarks.fixtures`.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app.config import EMBEDDING_MODEL, RERANKER_MODEL, ONNX_QUANTIZATION_CONFIG
+from app.logic.inference_backend import BACKENDS, load_sentence_transformer, load_cross_encoder
+from benchmarks import fixtures
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOP_K = 10
+
+
+def load_passages(specialty: str, limit: int) -> list:
+    """Chunk del DB vettoriale della specialità (cartella con qualsiasi maiuscola), o il corpus di riserva."""
+    base = os.path.join(PROJECT_ROOT, "vector_dbs")
+    folder = next((f for f in os.listdir(base) if f.lower() == specialty.lower()), None) if os.path.isdir(base) else None
+    if folder:
+        try:
+            import chromadb
+            client = chromadb.PersistentClient(path=os.path.join(base, folder))
+            documents = client.get_collection("langchain").get(limit=limit, include=["documents"])["documents"]
+            if documents:
+                return documents
+        except Exception as e:
+            print(f"DB '{folder}' non leggibile ({e}), uso il corpus di riserva.")
+    return list(fixtures.SAMPLE_PASSAGES)
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values)] = np.arange(len(values))
+    return ranks
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.corrcoef(_rank(a), _rank(b))[0, 1])
+
+
+def overlap_at_k(a: np.ndarray, b: np.ndarray, k: int) -> float:
+    k = min(k, len(a))
+    return len(set(np.argsort(a)[::-1][:k]) & set(np.argsort(b)[::-1][:k])) / k
+
+
+def run_backend(backend: str, queries: list, passages: list, args) -> dict:
+    """Embedding e punteggi del reranker con un backend, più le latenze misurate."""
+    embedder = load_sentence_transformer(EMBEDDING_MODEL, backend=backend, threads=args.threads,
+                                         quantization_config=args.quantization)
+    reranker = load_cross_encoder(RERANKER_MODEL, backend=backend, max_length=args.reranker_max_length,
+                                  threads=args.threads, quantization_config=args.quantization)
+
+    encode = lambda texts: embedder.encode(texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False)
+    encode(passages[:8])  # Warm-up
+    start = time.perf_counter()
+    passage_vectors = encode(passages)
+    embed_ms = (time.perf_counter() - start) * 1000 / len(passages)
+
+    query_latencies, query_vectors = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(encode([query])[0])
+        query_latencies.append((time.perf_counter() - start) * 1000)
+
+    rerank_latencies, rerank_scores = [], []
+    for query in queries:
+        pairs = [(query, passage) for passage in passages]
+        start = time.perf_counter()
+        rerank_scores.append(np.asarray(reranker.predict(pairs, show_progress_bar=False), dtype=np.float64))
+        rerank_latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "passage_vectors": np.asarray(passage_vectors),
+        "query_vectors": np.asarray(query_vectors),
+        "rerank_scores": rerank_scores,
+        "latency": {
+            "embed_ms_per_passage": round(embed_ms, 3),
+            "embed_query_ms_p50": round(float(np.median(query_latencies)), 3),
+            "rerank_ms_per_query_p50": round(float(np.median(rerank_latencies)), 3),
+        },
+    }
+
+
+def compare(reference: dict, candidate: dict) -> dict:
+    cosines = np.sum(reference["passage_vectors"] * candidate["passage_vectors"], axis=1)
+    retrieval_overlap = [
+        overlap_at_k(reference["passage_vectors"] @ q_ref, candidate["passage_vectors"] @ q_cand, TOP_K)
+        for q_ref, q_cand in zip(reference["query_vectors"], candidate["query_vectors"])
+    ]
+    rerank_spearman = [spearman(a, b) for a, b in zip(reference["rerank_scores"], candidate["rerank_scores"])]
+    rerank_overlap = [overlap_at_k(a, b, TOP_K) for a, b in zip(reference["rerank_scores"], candidate["rerank_scores"])]
+    return {
+        "embedding_cosine_mean": round(float(cosines.mean()), 5),
+        "embedding_cosine_min": round(float(cosines.min()), 5),
+        f"retrieval_overlap_at_{TOP_K}": round(float(np.mean(retrieval_overlap)), 3),
+        "rerank_spearman_mean": round(float(np.mean(rerank_spearman)), 4),
+        f"rerank_overlap_at_{TOP_K}": round(float(np.mean(rerank_overlap)), 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Accordo e latenza dei backend ONNX/int8 rispetto a PyTorch.")
+    parser.add_argument("--candidates", nargs="*", default=["onnx", "onnx-int8"], choices=[b for b in BACKENDS if b != "torch"])
+    parser.add_argument("--specialty", type=str, default=fixtures.SPECIALTY, help="DB da cui leggere i passaggi.")
+    parser.add_argument("--passages", type=int, default=200, help="Numero massimo di passaggi.")
+    parser.add_argument("--reranker-max-length", type=int, default=None, help="max_length del reranker per i candidati.")
+    parser.add_argument("--threads", type=int, default=None, help="Thread intra-op.")
+    parser.add_argument("--quantization", type=str, default=ONNX_QUANTIZATION_CONFIG, help="Configurazione int8.")
+    parser.add_argument("--json", type=str, default=None, help="Salva i risultati in un file JSON.")
+
+    args = parser.parse_args()
+
+    passages = load_passages(args.specialty, args.passages)
+    queries = fixtures.SAMPLE_QUERIES
+    print(f"{len(passages)} passaggi, {len(queries)} query.")
+
+    # Il riferimento usa sempre la lunghezza di default del modello
+    reference_args = argparse.Namespace(**{**vars(args), "reranker_max_length": None})
+    print("Backend di riferimento: torch...")
+    reference = run_backend("torch", queries, passages, reference_args)
+    results = {"torch": {"latency": reference["latency"]}}
+
+    for backend in args.candidates:
+        print(f"Backend candidato: {backend}...")
+        try:
+            candidate = run_backend(backend, queries, passages, args)
+        except Exception as e:
+            results[backend] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        results[backend] = {"latency": candidate["latency"], "agreement": compare(reference, candidate)}
+
+    print()
+    for backend, result in results.items():
+        if "error" in result:
+            print(f"{backend:<10} errore: {result['error']}")
+            continue
+        latency = result["latency"]
+        line = (f"{backend:<10} embed {latency['embed_ms_per_passage']:.2f} ms/passaggio | "
+                f"query {latency['embed_query_ms_p50']:.2f} ms | rerank {latency['rerank_ms_per_query_p50']:.1f} ms/query")
+        if "agreement" in result:
+            agreement = result["agreement"]
+            line += (f" | coseno {agreement['embedding_cosine_mean']:.4f} (min {agreement['embedding_cosine_min']:.4f})"
+                     f" | retrieval@{TOP_K} {agreement[f'retrieval_overlap_at_{TOP_K}']:.2f}"
+                     f" | spearman {agreement['rerank_spearman_mean']:.3f}"
+                     f" | rerank@{TOP_K} {agreement[f'rerank_overlap_at_{TOP_K}']:.2f}")
+        print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"passages": len(passages), "queries": len(queries), "results": results}, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
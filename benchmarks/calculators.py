@@ -0,0 +1,159 @@
+"""
+Tool medici scalari in loop contro le versioni batch NumPy (app/tools/batch_calculators.py).
+
+    python -m benchmarks.calculators --records 200000
+    python -m benchmarks.calculators --records 50000 --dirty 0.1 --json calculators.json
+
+Prima delle misure verifica che ogni record dia lo stesso risultato con le due versioni.
+`--dirty` è la frazione di record "sporchi" (stringhe con virgola, None, NaN, fuori scala):
+i dati numerici puliti usano il percorso vettoriale puro, quelli sporchi il parser per elemento.
+"""
+import argparse
+import json
+import logging
+import math
+import time
+
+import numpy as np
+
+from app.logger import get_triage_logger
+from app.tools import medical_calculators as scalar
+from app.tools import batch_calculators as batch
+
+UNITS = ["giorni", "settimane", "mesi", "ore", "days", "weeks", "anni"]
+
+
+def _dirty(values: np.ndarray, rng: np.random.Generator, fraction: float) -> list:
+    """Sostituisce una frazione dei valori con input che i tool scalari devono gestire."""
+    if fraction <= 0:
+        return values
+    out = values.astype(object)
+    for i in np.flatnonzero(rng.random(len(values)) < fraction):
+        out[i] = rng.choice([None, "None", "n/d", str(values[i]).replace(".", ","), float("nan"), -3, 250])
+    return list(out)
+
+
+def build_cohort(records: int, dirty: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "temperature": _dirty(np.round(rng.normal(37.5, 1.3, records), 2), rng, dirty),
+        "pain": _dirty(rng.integers(0, 11, records), rng, dirty),
+        "duration": _dirty(rng.integers(0, 200, records), rng, dirty),
+        "unit": list(rng.choice(UNITS, records)),
+        "age": _dirty(rng.integers(18, 95, records), rng, dirty),
+        "confusion": rng.random(records) < 0.2,
+        "respiratory_rate": _dirty(rng.integers(10, 40, records), rng, dirty),
+        "urea": _dirty(np.round(rng.normal(6.5, 2.5, records), 1), rng, dirty),
+        "systolic": _dirty(rng.integers(70, 200, records), rng, dirty),
+        "diastolic": _dirty(rng.integers(40, 130, records), rng, dirty),
+    }
+
+
+def _scalar_value(values, i):
+    value = values[i]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# Per tool: (chiamata scalare sul record i, chiamata batch, campi da confrontare)
+def tools(cohort: dict) -> dict:
+    c = cohort
+    n = len(c["unit"])
+    return {
+        "classify_fever": (
+            lambda i: scalar.classify_fever(_scalar_value(c["temperature"], i)),
+            lambda: batch.classify_fever_batch(c["temperature"]),
+            ("temperature_input_celsius", "category", "interpretation"),
+        ),
+        "classify_pain_level": (
+            lambda i: scalar.classify_pain_level(_scalar_value(c["pain"], i)),
+            lambda: batch.classify_pain_level_batch(c["pain"]),
+            ("score_input", "category"),
+        ),
+        "classify_symptom_duration": (
+            lambda i: scalar.classify_symptom_duration(_scalar_value(c["duration"], i), c["unit"][i]),
+            lambda: batch.classify_symptom_duration_batch(c["duration"], c["unit"]),
+            ("total_days_approx", "category"),
+        ),
+        "calculate_simple_curb65": (
+            lambda i: scalar.calculate_simple_curb65(
+                _scalar_value(c["age"], i), bool(c["confusion"][i]), _scalar_value(c["respiratory_rate"], i),
+                _scalar_value(c["urea"], i), _scalar_value(c["systolic"], i), _scalar_value(c["diastolic"], i)),
+            lambda: batch.calculate_simple_curb65_batch(
+                c["age"], c["confusion"], c["respiratory_rate"], c["urea"], c["systolic"], c["diastolic"]),
+            ("score", "interpretation"),
+        ),
+        "classify_blood_pressure": (
+            lambda i: scalar.classify_blood_pressure(_scalar_value(c["systolic"], i), _scalar_value(c["diastolic"], i)),
+            lambda: batch.classify_blood_pressure_batch(c["systolic"], c["diastolic"]),
+            ("category", "interpretation", "systolic_input", "diastolic_input"),
+        ),
+    }, n
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+def check_agreement(name: str, scalar_call, batch_result: dict, fields: tuple, n: int) -> int:
+    """Record in cui scalare e batch non coincidono (stampa i primi)."""
+    mismatches = 0
+    for i in range(n):
+        expected = scalar_call(i)
+        valid = bool(batch_result["valid"][i])
+        if "error" in expected:
+            ok = not valid
+        else:
+            ok = valid and all(_same(expected[f], batch_result[f][i].item() if isinstance(batch_result[f][i], np.generic)
+                                     else batch_result[f][i]) for f in fields)
+            if ok and name == "calculate_simple_curb65":
+                ok = len(expected["factors"]) == sum(
+                    int(batch_result[k][i]) for k in ("age_65", "confusion", "respiratory_rate_30", "urea_7",
+                                                      "low_blood_pressure", "urea_invalid", "blood_pressure_invalid"))
+        if not ok:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"  [{name}] record {i}: scalare={expected} batch={ {k: v[i] for k, v in batch_result.items()} }")
+    return mismatches
+
+
+def timeit(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tool medici scalari vs batch NumPy.")
+    parser.add_argument("--records", type=int, default=100000, help="Record della coorte sintetica.")
+    parser.add_argument("--dirty", type=float, default=0.0, help="Frazione di record con input sporchi.")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni (si tiene la migliore).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default=None, help="Salva i risultati in un file JSON.")
+
+    args = parser.parse_args()
+
+    # I tool scalari registrano un errore per ogni input non valido: non lo misuriamo
+    get_triage_logger().setLevel(logging.CRITICAL)
+
+    cohort = build_cohort(args.records, args.dirty, args.seed)
+    suite, n = tools(cohort)
+    results = {}
+    print(f"Coorte: {n} record, {args.dirty:.0%} sporchi\n")
+    print(f"{'tool':<28}{'scalare (s)':>14}{'batch (s)':>12}{'speedup':>10}{'diversi':>10}")
+    for name, (scalar_call, batch_call, fields) in suite.items():
+        mismatches = check_agreement(name, scalar_call, batch_call(), fields, n)
+        scalar_s = timeit(lambda: [scalar_call(i) for i in range(n)], args.repeat)
+        batch_s = timeit(batch_call, args.repeat)
+        results[name] = {"scalar_seconds": round(scalar_s, 4), "batch_seconds": round(batch_s, 4),
+                         "speedup": round(scalar_s / batch_s, 1), "mismatches": mismatches}
+        print(f"{name:<28}{scalar_s:>14.3f}{batch_s:>12.4f}{scalar_s / batch_s:>9.0f}x{mismatches:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"records": n, "dirty": args.dirty, "tools": results}, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
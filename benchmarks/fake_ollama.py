@@ -0,0 +1,169 @@
+"""
+Server HTTP che imita `/api/chat` di Ollama con latenza configurabile e risposte JSON fisse.
+
+La risposta viene scelta in base al prompt di sistema (router, scriba, specialista,
+analista RAG, supervisore della riflessione), così ogni agente riceve un JSON valido
+per il proprio schema. Le durate riportate seguono il formato di Ollama (nanosecondi).
+Come Ollama con un solo slot, `prompt_eval_count` conta solo la parte del prompt che
+non coincide con la richiesta precedente (prefisso in KV cache).
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Risposte fisse per tipo di prompt (il primo marcatore trovato vince)
+CANNED_RESPONSES = [
+    (("conversation summarizer",), {
+        "summary": "Patient reports chest pain for 2 days, worse on exertion. No allergies."
+    }),
+    (("senior medical supervisor",), {
+        "potential_conditions": [
+            {"condition": "Angina Pectoris", "probability": "High", "reasoning": "Chest pain on exertion."},
+            {"condition": "GERD", "probability": "Low", "reasoning": "Burning sensation after meals."}
+        ],
+        "sources_consulted": []
+    }),
+    (("expert medical analyst", "medical specialist in"), {
+        "potential_conditions": [
+            {"condition": "Angina Pectoris", "probability": "High", "reasoning": "Exertional chest pain."},
+            {"condition": "Hypertension", "probability": "Medium", "reasoning": "Elevated blood pressure."}
+        ]
+    }),
+    (('"Scribe"', '"Scriba"'), {
+        "symptoms": ["chest pain"],
+        "duration": ["2 days"],
+        "negative_findings": [],
+        "medical_history": [],
+        "medications": [],
+        "allergies": [],
+        "vital_signs": {},
+        "notes": ""
+    }),
+    (("MEDICAL SPECIALIST", "SPECIALISTA MEDICO"), {
+        "action": "perform_triage",
+        "summary": "Patient with chest pain for 2 days",
+        "extracted_data": {"pain_score": 6}
+    }),
+    (("SPECIALISTS AVAILABLE", "SPECIALISTI DISPONIBILI"), {
+        "action": "route_to_specialist",
+        "specialist": "cardiologo",
+        "summary": "Patient with chest pain for 2 days"
+    }),
+]
+DEFAULT_RESPONSE = {"potential_conditions": []}
+
+
+def pick_response(messages: list) -> dict:
+    """Risposta fissa per il tipo di prompt contenuto nei messaggi."""
+    text = "\n".join(str(m.get("content", "")) for m in messages)
+    for markers, response in CANNED_RESPONSES:
+        if any(marker in text for marker in markers):
+            return response
+    return DEFAULT_RESPONSE
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # Niente log per richiesta: falserebbe i tempi
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/api/chat":
+            self._send_json({"error": f"endpoint non supportato: {self.path}"}, status=404)
+            return
+
+        latency_s = self.server.latency_ms / 1000.0
+        time.sleep(latency_s)
+        messages = request.get("messages", [])
+        content = json.dumps(pick_response(messages))
+        prompt = "\n".join(f"{m.get('role')}:{m.get('content', '')}" for m in messages)
+        model = request.get("model", "fake")
+
+        with self.server.lock:
+            self.server.requests += 1
+            cached_chars = len(os.path.commonprefix([self.server.kv_cache.get(model, ""), prompt]))
+            self.server.kv_cache[model] = prompt + f"\nassistant:{content}"
+        prompt_chars = len(prompt) - cached_chars
+        self._send_json({
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(latency_s * 1e9),
+            "load_duration": 0,
+            # Stima grezza: ~4 caratteri per token
+            "prompt_eval_count": prompt_chars // 4,
+            "prompt_eval_duration": int(latency_s * 0.2e9),
+            "eval_count": len(content) // 4,
+            "eval_duration": int(latency_s * 0.8e9),
+        })
+
+
+class FakeOllamaServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        """
+        Args:
+            port: 0 = porta libera scelta dal sistema.
+            latency_ms: Ritardo applicato ad ogni chiamata (simula il tempo di generazione).
+        """
+        self._server = ThreadingHTTPServer((host, port), _ChatHandler)
+        self._server.daemon_threads = True
+        self._server.latency_ms = latency_ms
+        self._server.requests = 0
+        self._server.kv_cache = {}  # modello -> ultimo prompt + risposta
+        self._server.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Server Ollama finto per i benchmark.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(port=args.port, latency_ms=args.latency_ms)
+    print(f"Fake Ollama in ascolto su {server.url} (latenza {args.latency_ms} ms). Ctrl+C per uscire.")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
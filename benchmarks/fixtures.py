@@ -0,0 +1,62 @@
+"""Input fissi per i benchmark: stessi dati ad ogni esecuzione, così i tempi sono confrontabili."""
+
+SESSION_ID = "benchmark-session"
+LANGUAGE = "en"
+SPECIALTY = "cardiologo"
+
+USER_MESSAGE = "I have had a pressing pain in my chest for two days, it gets worse when I climb the stairs."
+LAST_AGENT_MESSAGE = "Can you describe your symptoms?"
+
+# Messaggio generico: il pre-router lessicale non lo risolve, quindi il router arriva all'LLM
+CHAT_HISTORY = [
+    {"role": "assistant", "content": "Hello, how can I help you today?"},
+    {"role": "user", "content": "I don't feel well, I have been tired and uneasy for two days."},
+]
+
+PATIENT_DATA = {
+    "symptoms": ["chest pain on exertion", "shortness of breath"],
+    "duration": ["2 days"],
+    "negative_findings": ["no fever"],
+    "medical_history": ["hypertension"],
+    "medications": ["ramipril"],
+    "allergies": [],
+    "vital_signs": {},
+    "notes": ""
+}
+
+SYMPTOMS_QUERY = "Pressing chest pain on exertion for two days with shortness of breath, history of hypertension"
+
+INITIAL_ANALYSIS = {
+    "potential_conditions": [
+        {"condition": "Angina Pectoris", "probability": "High", "reasoning": "Exertional chest pain."},
+        {"condition": "Hypertension", "probability": "Medium", "reasoning": "Known history."},
+        {"condition": "GERD", "probability": "Low", "reasoning": "Atypical chest discomfort."}
+    ],
+    "sources_consulted": ["cardiology_guidelines.pdf"]
+}
+
+EXTRACTED_DATA = {"pain_score": 6, "systolic": 150, "diastolic": 95}
+
+# Corpus di riserva per il confronto dei backend quando non c'è un DB vettoriale
+SAMPLE_QUERIES = [
+    SYMPTOMS_QUERY,
+    "Dolore addominale dopo i pasti con bruciore e reflusso acido",
+    "Tosse secca persistente da tre settimane, respiro sibilante di notte",
+    "Eruzione cutanea pruriginosa sulle braccia dopo aver mangiato arachidi",
+    "Stanchezza, aumento di peso e intolleranza al freddo da alcuni mesi",
+]
+
+SAMPLE_PASSAGES = [
+    "Angina pectoris is chest pain caused by reduced blood flow to the heart muscle, typically triggered by exertion and relieved by rest.",
+    "La malattia da reflusso gastroesofageo si manifesta con pirosi e rigurgito acido, spesso dopo i pasti o in posizione supina.",
+    "El asma es una enfermedad inflamatoria crónica de las vías respiratorias caracterizada por sibilancias, disnea y tos nocturna.",
+    "Food allergy to peanuts can cause urticaria, angioedema and, in severe cases, anaphylaxis within minutes of ingestion.",
+    "L'ipotiroidismo si presenta con astenia, aumento ponderale, stipsi e intolleranza al freddo; il TSH risulta elevato.",
+    "Hypertension is usually asymptomatic and is diagnosed when repeated office readings exceed 140/90 mmHg.",
+    "La fibrilación auricular produce palpitaciones irregulares y aumenta el riesgo de ictus tromboembólico.",
+    "Atopic dermatitis is a chronic relapsing eczema with intense itching, dry skin and flexural involvement.",
+    "La gastrite cronica può causare dolore epigastrico, nausea e senso di sazietà precoce.",
+    "Chronic obstructive pulmonary disease presents with progressive dyspnea and productive cough in smokers.",
+    "Rheumatoid arthritis causes symmetric swelling of the small joints of the hands with morning stiffness over one hour.",
+    "L'anemia sideropenica si manifesta con pallore, astenia e ridotta tolleranza allo sforzo.",
+]
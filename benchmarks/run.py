@@ -0,0 +1,115 @@
+"""
+Esegue i micro-benchmark per fase e stampa la distribuzione delle latenze.
+
+    python -m benchmarks.run --iterations 50 --latency-ms 200
+    python -m benchmarks.run --stages rag_retrieve rag_rerank --json results.json
+
+Senza --ollama-url viene avviato un server Ollama finto locale: i tempi delle fasi
+LLM sono quindi "latenza simulata + overhead del codice", quelli di retrieval,
+reranking e motore simbolico sono reali.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.fake_ollama import FakeOllamaServer
+
+
+def _distribution(samples_ms: list) -> dict:
+    values = np.asarray(samples_ms)
+    return {
+        "n": int(values.size),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "min": round(float(values.min()), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def run_stage(name: str, setup, iterations: int, warmup: int) -> dict:
+    """Prepara la fase, scarta `warmup` esecuzioni e misura le successive `iterations`."""
+    try:
+        fn = setup()
+    except Exception as e:
+        return {"stage": name, "status": "skipped", "error": f"{type(e).__name__}: {e}"}
+
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"stage": name, "status": "ok", **_distribution(samples)}
+
+
+def print_table(results: list):
+    header = f"{'Fase':<14}{'n':>6}{'mean':>11}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['stage']:<14}  saltata: {r['error']}")
+            continue
+        print(f"{r['stage']:<14}{r['n']:>6}{r['mean']:>11.2f}{r['p50']:>11.2f}"
+              f"{r['p95']:>11.2f}{r['p99']:>11.2f}{r['max']:>11.2f}")
+    print("(tempi in ms)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark per fase della pipeline di triage.")
+    parser.add_argument("--stages", nargs="*", default=None, help="Fasi da misurare (default: tutte).")
+    parser.add_argument("--iterations", type=int, default=20, help="Esecuzioni misurate per fase.")
+    parser.add_argument("--warmup", type=int, default=2, help="Esecuzioni iniziali scartate.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latenza simulata del server Ollama finto.")
+    parser.add_argument("--ollama-url", type=str, default=None, help="Usa un Ollama reale invece di quello finto.")
+    parser.add_argument("--json", type=str, default=None, help="Salva i risultati in un file JSON.")
+    parser.add_argument("--list", action="store_true", help="Mostra le fasi disponibili ed esce.")
+
+    args = parser.parse_args()
+
+    # Il server finto va avviato e OLLAMA_HOST impostato PRIMA di importare i moduli dell'app
+    fake_server = None
+    if args.ollama_url:
+        os.environ["OLLAMA_HOST"] = args.ollama_url
+    else:
+        fake_server = FakeOllamaServer(latency_ms=args.latency_ms).start()
+        os.environ["OLLAMA_HOST"] = fake_server.url
+
+    from benchmarks.stages import STAGES
+
+    if args.list:
+        print("\n".join(STAGES))
+        sys.exit(0)
+
+    selected = args.stages or list(STAGES)
+    unknown = [s for s in selected if s not in STAGES]
+    if unknown:
+        parser.error(f"Fasi sconosciute: {', '.join(unknown)} (disponibili: {', '.join(STAGES)})")
+
+    print(f"Ollama: {os.environ['OLLAMA_HOST']}" + (f" (finto, latenza {args.latency_ms} ms)" if fake_server else ""))
+    results = []
+    try:
+        for name in selected:
+            print(f"Misuro '{name}' ({args.iterations} iterazioni)...")
+            results.append(run_stage(name, STAGES[name], args.iterations, args.warmup))
+    finally:
+        if fake_server:
+            fake_server.stop()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "iterations": args.iterations,
+                "latency_ms": args.latency_ms if fake_server else None,
+                "ollama_url": args.ollama_url,
+                "results": results,
+            }, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
@@ -0,0 +1,93 @@
+"""
+Definizione delle fasi misurate.
+
+Ogni fase è una funzione `setup() -> callable`: la preparazione (caricamento modelli,
+DB, dati intermedi) resta fuori dal tempo misurato, il callable restituito è una
+singola esecuzione della fase. Gli import dell'app sono dentro le funzioni perché
+il client Ollama legge OLLAMA_HOST all'import e il runner deve impostarlo prima.
+"""
+import os
+import tempfile
+from typing import Callable, Dict
+
+from benchmarks import fixtures
+
+VECTOR_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vector_dbs")
+
+
+def setup_extraction() -> Callable[[], object]:
+    from app.agents.assistant_agent import AssistantAgent
+
+    agent = AssistantAgent(data_dir=tempfile.mkdtemp(prefix="bench_patient_data_"), language=fixtures.LANGUAGE)
+    return lambda: agent.update_patient_data(fixtures.SESSION_ID, fixtures.USER_MESSAGE, fixtures.LAST_AGENT_MESSAGE)
+
+
+def setup_routing() -> Callable[[], object]:
+    from app.agents.router_agent import RouterAgent
+
+    router = RouterAgent([fixtures.SPECIALTY, "pneumologo", "gastroenterologo"], language=fixtures.LANGUAGE)
+    return lambda: router.decide_routing(fixtures.CHAT_HISTORY, fixtures.PATIENT_DATA)
+
+
+# Un solo RAGHandler condiviso tra le fasi RAG (i modelli vengono caricati una volta)
+_rag_handler = None
+
+
+def _get_rag_handler():
+    global _rag_handler
+    if _rag_handler is None:
+        from app.logic.rag_handler import RAGHandler
+        _rag_handler = RAGHandler(base_db_path=VECTOR_DB_PATH)
+    return _rag_handler
+
+
+def _retrieved_docs(handler) -> list:
+    docs = handler.retrieve(fixtures.SYMPTOMS_QUERY, fixtures.SPECIALTY)
+    if not docs:
+        raise RuntimeError(f"Nessun documento recuperato: DB vettoriale '{fixtures.SPECIALTY}' assente o vuoto.")
+    return docs
+
+
+def setup_rag_retrieve() -> Callable[[], object]:
+    handler = _get_rag_handler()
+    _retrieved_docs(handler)  # Warm-up: carica il DB fuori dalla misura
+    return lambda: handler.retrieve(fixtures.SYMPTOMS_QUERY, fixtures.SPECIALTY)
+
+
+def setup_rag_rerank() -> Callable[[], object]:
+    handler = _get_rag_handler()
+    docs = _retrieved_docs(handler)
+    return lambda: handler.rerank(fixtures.SYMPTOMS_QUERY, docs)
+
+
+def setup_rag_generate() -> Callable[[], object]:
+    handler = _get_rag_handler()
+    reranked = [doc for doc, _ in handler.rerank(fixtures.SYMPTOMS_QUERY, _retrieved_docs(handler))]
+    return lambda: handler.generate(fixtures.SYMPTOMS_QUERY, fixtures.SPECIALTY, reranked)
+
+
+def setup_reflection() -> Callable[[], object]:
+    from app.agents.specialist_agent import SpecialistAgent
+    from app.logic.symbolic_engine import TriageEngine
+
+    agent = SpecialistAgent(fixtures.SPECIALTY, rag_handler=None, triage_engine=TriageEngine(), language=fixtures.LANGUAGE)
+    return lambda: agent._run_reflection(fixtures.SYMPTOMS_QUERY, fixtures.INITIAL_ANALYSIS, fixtures.PATIENT_DATA)
+
+
+def setup_triage() -> Callable[[], object]:
+    from app.logic.symbolic_engine import TriageEngine
+
+    engine = TriageEngine()
+    return lambda: engine.get_recommendation(fixtures.INITIAL_ANALYSIS, fixtures.EXTRACTED_DATA)
+
+
+# Nome fase -> setup, nell'ordine della pipeline
+STAGES: Dict[str, Callable[[], Callable[[], object]]] = {
+    "extraction": setup_extraction,
+    "routing": setup_routing,
+    "rag_retrieve": setup_rag_retrieve,
+    "rag_rerank": setup_rag_rerank,
+    "rag_generate": setup_rag_generate,
+    "reflection": setup_reflection,
+    "triage": setup_triage,
+}
@@ -0,0 +1,129 @@
+"""
+Benchmark di avvio: tempo di import di `app.main` e tempo fino a quando uvicorn accetta richieste.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 3 --top 15 --json startup.json
+
+Ogni misura parte da un processo Python nuovo (niente cache dei moduli), quindi
+riflette quello che paga un worker di uvicorn o un `--reload`.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _summary(values: list) -> dict:
+    data = np.asarray(values)
+    return {
+        "n": int(data.size),
+        "mean": round(float(data.mean()), 3),
+        "p50": round(float(np.percentile(data, 50)), 3),
+        "min": round(float(data.min()), 3),
+        "max": round(float(data.max()), 3),
+    }
+
+
+def measure_import(runs: int) -> dict:
+    """Secondi per `import app.main` in un interprete nuovo."""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        )
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return _summary(samples)
+
+
+def top_imports(limit: int) -> list:
+    """Moduli con il tempo di import cumulativo più alto (da `python -X importtime`)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        entries.append({"module": name, "cumulative_ms": int(cumulative_us) / 1000, "self_ms": int(self_us) / 1000})
+    entries.sort(key=lambda e: e["cumulative_ms"], reverse=True)
+    return entries[:limit]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_time_to_listening(runs: int, timeout: float) -> dict:
+    """Secondi dal lancio di uvicorn alla prima risposta HTTP di /metrics."""
+    samples = []
+    for _ in range(runs):
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}/metrics"
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn è terminato durante l'avvio (exit code {process.returncode}).")
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"uvicorn non risponde dopo {timeout}s.")
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.02)
+            samples.append(time.perf_counter() - start)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return _summary(samples)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tempo di import e di avvio dell'API.")
+    parser.add_argument("--runs", type=int, default=3, help="Processi nuovi per ogni misura.")
+    parser.add_argument("--top", type=int, default=10, help="Moduli più lenti da mostrare.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Attesa massima per l'avvio di uvicorn (s).")
+    parser.add_argument("--skip-server", action="store_true", help="Misura solo l'import.")
+    parser.add_argument("--json", type=str, default=None, help="Salva i risultati in un file JSON.")
+
+    args = parser.parse_args()
+
+    results = {"import_seconds": measure_import(args.runs), "top_imports": top_imports(args.top)}
+    print(f"\nimport app.main: p50 {results['import_seconds']['p50']}s "
+          f"(min {results['import_seconds']['min']}s, max {results['import_seconds']['max']}s)")
+    print("\nModuli più lenti (cumulativo):")
+    for entry in results["top_imports"]:
+        print(f"  {entry['cumulative_ms']:>9.1f} ms  {entry['module']}")
+
+    if not args.skip_server:
+        results["time_to_listening_seconds"] = measure_time_to_listening(args.runs, args.timeout)
+        print(f"\nuvicorn in ascolto dopo: p50 {results['time_to_listening_seconds']['p50']}s "
+              f"(min {results['time_to_listening_seconds']['min']}s, max {results['time_to_listening_seconds']['max']}s)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
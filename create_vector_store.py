@@ -1,95 +1,334 @@
 import os
+import sys
 import shutil
+import time
+import json
+import uuid
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import Optional
 from langchain_community.document_loaders import PDFPlumberLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_chroma import Chroma
 from app.config import EMBEDDING_MODEL
+from app.logic.chunk_dedup import ChunkDeduplicator
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = SCRIPT_DIR 
 
 BASE_DOCS_PATH = os.path.join(PROJECT_ROOT, "documenti_medici")
 BASE_DB_PATH = os.path.join(PROJECT_ROOT, "vector_dbs")
+BUILD_SUMMARY_PATH = os.path.join(BASE_DB_PATH, "build_summary.json")
 
-def create_specialist_vector_store(specialty: str, limit: int = 0):
+# Numero di chunk embeddati e scritti nel DB ad ogni passo.
+# Tiene limitata la memoria: in RAM c'è al massimo un batch di testi + vettori.
+DEFAULT_BATCH_SIZE = 256
+# Batch interno del sentence-transformer (quanti testi per forward pass)
+DEFAULT_EMBED_BATCH_SIZE = 32
+# Jaccard stimata (MinHash) oltre la quale due chunk sono considerati duplicati
+DEFAULT_DEDUP_THRESHOLD = 0.85
+
+
+def _peak_rss_mb() -> float:
+    """Ritorna il picco di memoria residente (RSS) del processo in MB, 0 se non disponibile."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def resolve_specialty(specialty: str) -> str:
+    """
+    Ritorna il nome della cartella in 'documenti_medici' che corrisponde alla specialità,
+    ignorando maiuscole/minuscole (le cartelle sono capitalizzate, es. 'Cardiologo').
+    Se non esiste nessuna cartella corrispondente ritorna il nome invariato.
+    """
+    if os.path.isdir(BASE_DOCS_PATH):
+        for folder in os.listdir(BASE_DOCS_PATH):
+            if folder.lower() == specialty.lower() and os.path.isdir(os.path.join(BASE_DOCS_PATH, folder)):
+                return folder
+    return specialty
+
+
+def list_specialties() -> list:
+    """Elenca tutte le specialità che hanno una cartella di documenti."""
+    if not os.path.isdir(BASE_DOCS_PATH):
+        return []
+    return sorted(
+        d for d in os.listdir(BASE_DOCS_PATH)
+        if os.path.isdir(os.path.join(BASE_DOCS_PATH, d)) and not d.startswith('.')
+    )
+
+
+def build_embedding_function(embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE):
+    """Carica il modello di embedding (operazione costosa: va fatta una sola volta per processo)."""
+    return SentenceTransformerEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': embed_batch_size}
+    )
+
+
+def _iter_chunks(docs_path: str, pdf_files: list, text_splitter):
+    """
+    Carica e suddivide un PDF alla volta, restituendo i chunk in streaming.
+    In questo modo non teniamo mai in memoria l'intero corpus.
+    """
+    for pdf_file in pdf_files:
+        print(f"   Processing: {pdf_file}...")
+        try:
+            loader = PDFPlumberLoader(os.path.join(docs_path, pdf_file))
+            loaded_docs = loader.load()
+        except Exception as e:
+            print(f"Errore durante il caricamento di {pdf_file}: {e}")
+            continue # Salta il file problematico
+
+        # Aggiungi metadati per sapere da quale file proviene il chunk
+        for doc in loaded_docs:
+            doc.metadata["source"] = pdf_file
+
+        yield from text_splitter.split_documents(loaded_docs)
+
+
+def _iter_batches(iterable, batch_size: int):
+    """Raggruppa un iteratore in liste di al massimo `batch_size` elementi."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _attach_provenance(db, deduplicator: ChunkDeduplicator, batch_size: int):
+    """
+    Aggiorna i metadati dei chunk rappresentanti con la provenienza delle copie scartate.
+    Lavora a batch per non rileggere l'intero DB in memoria.
+    """
+    ids = list(deduplicator.provenance.keys())
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start:start + batch_size]
+        stored = db.get(ids=batch_ids, include=["metadatas"])
+        metadatas = [
+            deduplicator.provenance_metadata(chunk_id, metadata or {})
+            for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+        ]
+        # Solo metadati, sulla collection Chroma sottostante: Chroma.update_documents di LangChain
+        # richiede i Document completi e ricalcola gli embedding di ogni chunk
+        db._collection.update(ids=stored["ids"], metadatas=metadatas)
+
+
+def create_specialist_vector_store(specialty: str, limit: int = 0,
+                                   batch_size: int = DEFAULT_BATCH_SIZE,
+                                   embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+                                   embedding_function=None,
+                                   dedup_threshold: Optional[float] = DEFAULT_DEDUP_THRESHOLD) -> dict:
     """
     Crea o ricrea il database vettoriale per una specifica specializzazione medica.
+    I chunk vengono embeddati e scritti nel DB a batch di `batch_size`.
+    Se `embedding_function` è passato viene riusato, altrimenti il modello viene caricato qui.
+    Se `dedup_threshold` non è None i chunk quasi-duplicati vengono scartati prima
+    dell'embedding, conservandone la provenienza sul chunk rappresentante.
+    Ritorna un dizionario con l'esito, il numero di chunk e i tempi.
     """
+    stats = {"specialty": specialty, "status": "error", "pdf_files": 0, "chunks": 0,
+             "duplicates_removed": 0, "seconds": 0.0}
     docs_path = os.path.join(BASE_DOCS_PATH, specialty)
     db_path = os.path.join(BASE_DB_PATH, specialty)
 
     if not os.path.exists(docs_path):
         print(f"Errore: La cartella dei documenti per '{specialty}' non esiste: '{docs_path}'")
-        return
+        return stats
 
     # Rimuove il DB esistente per questa specialità per ricrearlo
     if os.path.exists(db_path):
         print(f"Rimuovo il database esistente per '{specialty}' in '{db_path}'...")
         shutil.rmtree(db_path)
 
-    all_docs = []
     pdf_files = [f for f in os.listdir(docs_path) if f.endswith('.pdf')]
     if not pdf_files:
         print(f"Nessun file PDF trovato per '{specialty}' in '{docs_path}'.")
         # Crea comunque la cartella del DB vuota se non ci sono file
         os.makedirs(db_path, exist_ok=True)
         print(f"Cartella DB vuota creata per '{specialty}' in '{db_path}'.")
-        return
+        stats["status"] = "empty"
+        return stats
 
+    stats["pdf_files"] = len(pdf_files)
     print(f"Caricamento di {len(pdf_files)} file PDF per '{specialty}'...")
-    for pdf_file in pdf_files:
-        print(f"   Processing: {pdf_file}...")
-        try:
-            loader = PDFPlumberLoader(os.path.join(docs_path, pdf_file))
-            loaded_docs = loader.load()
-            # Aggiungi metadati per sapere da quale file proviene il chunk
-            for doc in loaded_docs:
-                doc.metadata["source"] = pdf_file
-            all_docs.extend(loaded_docs)
-        except Exception as e:
-            print(f"Errore durante il caricamento di {pdf_file}: {e}")
-            continue # Salta il file problematico
-
-    if not all_docs:
-        print(f"Nessun documento caricato con successo per '{specialty}'.")
-        return
-
-    print("Suddivisione dei documenti in chunk...")
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_documents(all_docs)
-    
+    chunks = _iter_chunks(docs_path, pdf_files, text_splitter)
+
     # LIMIT CHECK
     if limit and limit > 0:
         print(f"⚠️ LIMIT MODE: Processing only first {limit} chunks.")
-        chunks = chunks[:limit]
+        chunks = islice(chunks, limit)
 
-    print(f"Creazione degli embedding e del Vector Store per {len(chunks)} chunks...")
-    embedding_function = SentenceTransformerEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        encode_kwargs={'normalize_embeddings': True}
-    )
+    if embedding_function is None:
+        embedding_function = build_embedding_function(embed_batch_size)
 
+    deduplicator = ChunkDeduplicator(threshold=dedup_threshold) if dedup_threshold is not None else None
+
+    print(f"Creazione degli embedding e del Vector Store (batch da {batch_size} chunk)...")
+    db = None
+    total_chunks = 0
+    start = time.perf_counter()
     try:
-        db = Chroma.from_documents(
-            chunks,
-            embedding_function,
-            persist_directory=db_path
-        )
-        print(f"✅ Database vettoriale per '{specialty}' creato con successo in '{db_path}'.")
+        for batch in _iter_batches(chunks, batch_size):
+            ids = [str(uuid.uuid4()) for _ in batch]
+            if deduplicator:
+                kept = [
+                    (chunk_id, chunk) for chunk_id, chunk in zip(ids, batch)
+                    if deduplicator.find_duplicate(chunk_id, chunk.page_content, chunk.metadata) is None
+                ]
+                if not kept:
+                    continue
+                ids = [chunk_id for chunk_id, _ in kept]
+                batch = [chunk for _, chunk in kept]
+
+            # Il DB viene creato solo al primo batch, così non resta vuoto se non ci sono chunk
+            if db is None:
+                db = Chroma(persist_directory=db_path, embedding_function=embedding_function)
+            # Embedding + scrittura immediata del batch: nulla si accumula in RAM
+            db.add_documents(batch, ids=ids)
+            total_chunks += len(batch)
+
+            elapsed = time.perf_counter() - start
+            rate = total_chunks / elapsed if elapsed > 0 else 0.0
+            print(f"   [{specialty}] {total_chunks} chunk indicizzati ({rate:.1f} chunk/s, picco RSS {_peak_rss_mb():.0f} MB)")
+
+        if deduplicator and db is not None and deduplicator.provenance:
+            _attach_provenance(db, deduplicator, batch_size)
     except Exception as e:
          print(f"❌ Errore durante la creazione del DB per '{specialty}': {e}")
+         stats.update(chunks=total_chunks, seconds=round(time.perf_counter() - start, 2), error=str(e))
+         return stats
+
+    elapsed = time.perf_counter() - start
+    stats.update(chunks=total_chunks, seconds=round(elapsed, 2))
+    if deduplicator:
+        stats["duplicates_removed"] = deduplicator.duplicates_removed
+
+    if total_chunks == 0:
+        print(f"Nessun documento caricato con successo per '{specialty}'.")
+        stats["status"] = "empty"  # Nessuna eccezione: PDF presenti ma senza testo estraibile
+        return stats
+
+    rate = total_chunks / elapsed if elapsed > 0 else 0.0
+    stats["status"] = "ok"
+    print(f"✅ Database vettoriale per '{specialty}' creato con successo in '{db_path}'.")
+    print(f"   {total_chunks} chunk in {elapsed:.1f}s ({rate:.1f} chunk/s), picco RSS {_peak_rss_mb():.0f} MB.")
+    if deduplicator:
+        print(f"   Deduplica: {deduplicator.duplicates_removed} chunk quasi-duplicati scartati "
+              f"(provenienza conservata su {len(deduplicator.provenance)} chunk).")
+    return stats
+
+
+def create_vector_stores(specialties: list, limit: int = 0, workers: int = 2,
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+                         dedup_threshold: Optional[float] = DEFAULT_DEDUP_THRESHOLD) -> list:
+    """
+    Ricostruisce più specialità in un unico processo.
+    Il modello di embedding viene caricato una sola volta e condiviso tra i thread:
+    il parsing dei PDF di una specialità si sovrappone all'embedding di un'altra.
+    Scrive un riepilogo (chunk e tempi per specialità) in BUILD_SUMMARY_PATH.
+    """
+    start = time.perf_counter()
+    print(f"Caricamento modello di embedding condiviso ({EMBEDDING_MODEL})...")
+    embedding_function = build_embedding_function(embed_batch_size)
+    model_load_seconds = time.perf_counter() - start
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(
+                create_specialist_vector_store, specialty, limit, batch_size,
+                embed_batch_size, embedding_function, dedup_threshold
+            ): specialty
+            for specialty in specialties
+        }
+        for future in as_completed(futures):
+            specialty = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ Errore non gestito per '{specialty}': {e}")
+                results.append({"specialty": specialty, "status": "error", "pdf_files": 0,
+                                "chunks": 0, "duplicates_removed": 0, "seconds": 0.0, "error": str(e)})
+
+    results.sort(key=lambda r: r["specialty"])
+    summary = {
+        "embedding_model": EMBEDDING_MODEL,
+        "model_load_seconds": round(model_load_seconds, 2),
+        "total_seconds": round(time.perf_counter() - start, 2),
+        "total_chunks": sum(r["chunks"] for r in results),
+        "total_duplicates_removed": sum(r["duplicates_removed"] for r in results),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "specialties": results,
+    }
+
+    os.makedirs(BASE_DB_PATH, exist_ok=True)
+    with open(BUILD_SUMMARY_PATH, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4, ensure_ascii=False)
+
+    print("\n--- RIEPILOGO BUILD ---")
+    print(f"{'Specialità':<20}{'Esito':<8}{'PDF':>6}{'Chunk':>10}{'Duplicati':>11}{'Secondi':>10}")
+    for r in results:
+        print(f"{r['specialty']:<20}{r['status']:<8}{r['pdf_files']:>6}{r['chunks']:>10}"
+              f"{r['duplicates_removed']:>11}{r['seconds']:>10.1f}")
+    print(f"Totale: {summary['total_chunks']} chunk in {summary['total_seconds']:.1f}s "
+          f"(caricamento modello {summary['model_load_seconds']:.1f}s). Riepilogo salvato in '{BUILD_SUMMARY_PATH}'.")
+    return results
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Crea un database vettoriale per una specializzazione medica.")
-    parser.add_argument("specialty", type=str, help="Nome della specializzazione (deve corrispondere a una sottocartella in 'documenti'). Es: 'cardiologia'")
+    parser = argparse.ArgumentParser(description="Crea i database vettoriali per una o più specializzazioni mediche.")
+    parser.add_argument("specialties", type=str, nargs="*", help="Nomi delle specializzazioni (sottocartelle in 'documenti_medici', maiuscole/minuscole ignorate). Es: 'Cardiologo'")
+    parser.add_argument("--all", action="store_true", help="Ricostruisce tutte le specialità presenti in 'documenti_medici'.")
+    parser.add_argument("--workers", type=int, default=2, help="Specialità elaborate in parallelo (modello di embedding condiviso).")
     parser.add_argument("--limit", type=int, default=0, help="Limita il numero di chunk da processare (per test). 0 = tutti.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Chunk embeddati e scritti nel DB per ogni batch.")
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_EMBED_BATCH_SIZE, help="Batch interno del modello di embedding.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_DEDUP_THRESHOLD, help="Similarità (Jaccard MinHash) oltre la quale un chunk è un duplicato.")
+    parser.add_argument("--no-dedup", action="store_true", help="Disattiva l'eliminazione dei chunk quasi-duplicati.")
     
     args = parser.parse_args()
+
+    if args.all:
+        specialties = list_specialties()
+    else:
+        # Le cartelle sono capitalizzate: risolviamo il nome reale invece di forzare il lowercase
+        specialties = [resolve_specialty(s) for s in args.specialties]
+
+    if not specialties:
+        parser.error("Specificare almeno una specialità oppure --all.")
     
+    dedup_threshold = None if args.no_dedup else args.dedup_threshold
+
     # Crea la cartella base per i DB se non esiste
     os.makedirs(BASE_DB_PATH, exist_ok=True)
-    
-    create_specialist_vector_store(args.specialty.lower(), limit=args.limit) # Usa lowercase per coerenza
\ No newline at end of file
+
+    if len(specialties) == 1:
+        create_specialist_vector_store(
+            specialties[0],
+            limit=args.limit,
+            batch_size=args.batch_size,
+            embed_batch_size=args.embed_batch_size,
+            dedup_threshold=dedup_threshold
+        )
+    else:
+        create_vector_stores(
+            specialties,
+            limit=args.limit,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            embed_batch_size=args.embed_batch_size,
+            dedup_threshold=dedup_threshold
+        )
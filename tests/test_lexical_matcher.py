@@ -0,0 +1,58 @@
+"""Pre-router lessicale: red flag e negazioni (nessun LLM, nessun modello)."""
+import pytest
+
+from app.logic.lexical_matcher import get_lexical_matcher
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return get_lexical_matcher()
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("No, I can't breathe", "can't breathe"),
+    ("no, non riesco a respirare", "non riesco a respirare"),
+    ("no non riesco a respirare", "non riesco a respirare"),
+    ("No I can't breathe", "can't breathe"),
+    ("no fever. I have seizures", "seizures"),
+])
+def test_leading_no_does_not_hide_red_flag(matcher, message, expected):
+    assert expected in matcher.find_red_flags(message)
+
+
+@pytest.mark.parametrize("message", [
+    "I can't breathe",
+    "non riesco a respirare",
+])
+def test_red_flag_without_negation(matcher, message):
+    assert matcher.find_red_flags(message)
+
+
+@pytest.mark.parametrize("message", [
+    "non ho dolore al petto e sudorazione",
+    "I don't have chest pain and sweating",
+    "no chest pain and sweating",
+    "never had a seizure",
+])
+def test_governing_negation_suppresses_red_flag(matcher, message):
+    assert matcher.find_red_flags(message) == []
+
+
+@pytest.mark.parametrize("message", [
+    "I haven't had any seizures",
+    "she hasn't fainted",
+    "I didn't have a seizure",
+    "he doesn't have chest pain and sweating",
+])
+def test_contracted_negation_suppresses_red_flag(matcher, message):
+    # normalize_text unisce l'apostrofo: "haven't" -> "havent"
+    assert matcher.find_red_flags(message) == []
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("I fainted this morning", "fainted"),
+    ("I feel faint", "faint"),
+    ("mi sento svenire", "svenire"),
+])
+def test_faint_variants(matcher, message, expected):
+    assert expected in matcher.find_red_flags(message)
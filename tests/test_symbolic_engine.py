@@ -0,0 +1,43 @@
+"""Regole di triage compilate: forma a record e forma colonnare devono coincidere."""
+import math
+
+import numpy as np
+import pytest
+
+from app.logic.symbolic_engine import TriageEngine
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return TriageEngine()
+
+
+RECORDS = [
+    {"systolic": 200.0, "diastolic": math.nan},
+    {"systolic": 200.0},
+    {"systolic": 200.0, "diastolic": 125.0},
+    {"temperature_celsius": math.nan, "pain_score": 9},
+    {"temperature_celsius": 40.0},
+    {"temperature_celsius": 0, "pain_score": 0},
+    {},
+]
+
+
+def _columnar(records):
+    fields = sorted({name for record in records for name in record})
+    return {name: np.array([record.get(name, math.nan) for record in records], dtype=np.float64)
+            for name in fields}
+
+
+def test_columnar_and_record_forms_agree(engine):
+    by_record = engine.evaluate_batch(RECORDS)
+    by_column = engine.evaluate_batch(_columnar(RECORDS))
+    assert list(by_record["outcome"]) == list(by_column["outcome"])
+    assert list(by_record["rule_id"]) == list(by_column["rule_id"])
+
+
+def test_nan_is_missing_in_columnar_form(engine):
+    nan_diastolic = engine.evaluate_batch({"systolic": [200.0], "diastolic": [math.nan]})
+    no_diastolic = engine.evaluate_batch([{"systolic": 200}])
+    assert nan_diastolic["outcome"][0] == no_diastolic["outcome"][0]
+    assert nan_diastolic["rule_id"][0] == no_diastolic["rule_id"][0]